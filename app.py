@@ -1,8 +1,19 @@
 # app.py (secure + mobile tweaks + SP override fix)
 import io
+import re
+import random
 import csv
 import os
+import sqlite3
+import time
+import uuid
+import hashlib
+import functools
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, date
+from urllib.parse import urlsplit
 from zoneinfo import ZoneInfo
 from typing import Optional
 from sqlalchemy import func
@@ -18,10 +29,23 @@ from flask import (
     session,
     render_template_string,
     jsonify,
-    json
+    json,
+    make_response,
+    has_request_context,
+    has_app_context,
+    g,
 )
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text, func
+from markupsafe import escape
+import click
+from sqlalchemy import text, func, event, inspect, select, update, case, and_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import Session as OrmSession, joinedload
+from sqlalchemy.ext.hybrid import hybrid_property
+
+_IMPORT_STARTED = time.perf_counter()
 
 # -----------------------------------------------------------------------------
 # Config / DB
@@ -29,6 +53,147 @@ from sqlalchemy import text, func
 db = SQLAlchemy()
 KG_PER_TON = 1000.0
 
+# How long a connection waits on a locked SQLite file before giving up (ms).
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "15000"))
+
+
+@event.listens_for(Engine, "connect")
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    WAL lets readers run alongside the single writer, which is what makes
+    several gunicorn workers safe on one SQLite file.
+    """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cur = dbapi_connection.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute("PRAGMA synchronous=NORMAL")
+    cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cur.close()
+    # Let SQLAlchemy emit BEGIN itself (see _sqlite_begin) instead of the
+    # sqlite3 module's implicit deferred BEGIN before the first write.
+    dbapi_connection.isolation_level = None
+
+
+# -----------------------------------------------------------------------------
+# Write contention
+# -----------------------------------------------------------------------------
+# A deferred transaction that reads and then writes has to upgrade its lock
+# part-way through; under WAL that upgrade fails at once with "database is
+# locked" when another worker committed in between (the busy timeout does not
+# apply). Transactions of write requests therefore take the write lock up
+# front with BEGIN IMMEDIATE, which does wait on busy_timeout, and retry that
+# with jittered backoff. Reads keep plain BEGIN; a GET that has to write
+# wraps the write in write_transaction().
+#
+# The whole wait for the lock, busy_timeout and retries together, is capped
+# at WRITE_LOCK_WAIT_MS so a write request gives up with a 503 well before
+# gunicorn's worker timeout kills it.
+WRITE_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+WRITE_RETRY_ATTEMPTS = int(os.environ.get("WRITE_RETRY_ATTEMPTS", "4"))
+WRITE_RETRY_BASE_MS = int(os.environ.get("WRITE_RETRY_BASE_MS", "50"))
+WRITE_LOCK_WAIT_MS = int(os.environ.get("WRITE_LOCK_WAIT_MS", "20000"))
+# POST views that parse an upload first and take the lock only around their
+# inserts, with write_transaction()
+LATE_LOCK_ENDPOINTS = {"import_page", "bank_import"}
+WRITE_BUSY_MESSAGE = "The database is busy with other saves - please submit again in a moment."
+
+_contention_lock = threading.Lock()
+_contention = {}
+
+
+@event.listens_for(Engine, "begin")
+def _sqlite_begin(conn):
+    if conn.dialect.name != "sqlite":
+        return
+    if (has_app_context() and g.get("write_transaction")) or (has_request_context() and (
+            request.method in WRITE_METHODS and request.endpoint not in LATE_LOCK_ENDPOINTS)):
+        _begin_immediate(conn.connection.driver_connection)
+    else:
+        conn.exec_driver_sql("BEGIN")
+
+
+def _begin_immediate(dbapi_connection) -> None:
+    """
+    BEGIN IMMEDIATE, retrying "database is locked" up to WRITE_RETRY_ATTEMPTS
+    times with full-jitter backoff. Each attempt waits on a busy_timeout of
+    its share of WRITE_LOCK_WAIT_MS, and neither those waits nor the sleeps
+    run past it. Every write transaction lands in the contention counters.
+    """
+    started = time.perf_counter()
+    deadline = started + WRITE_LOCK_WAIT_MS / 1000
+    attempt_ms = max(1, WRITE_LOCK_WAIT_MS // (WRITE_RETRY_ATTEMPTS + 1))
+    retries = 0
+    error = None
+    try:
+        while True:
+            left_ms = int((deadline - time.perf_counter()) * 1000)
+            dbapi_connection.execute(f"PRAGMA busy_timeout={max(1, min(attempt_ms, left_ms))}")
+            try:
+                dbapi_connection.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError as exc:
+                left = deadline - time.perf_counter()
+                if "database is locked" not in str(exc) or retries >= WRITE_RETRY_ATTEMPTS or left <= 0:
+                    error = exc
+                    break
+                retries += 1
+                time.sleep(min(left, random.uniform(0, WRITE_RETRY_BASE_MS * 2 ** retries) / 1000))
+    finally:
+        dbapi_connection.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    endpoint = request.endpoint if has_request_context() else "background_job"
+    record_write_contention(endpoint, (time.perf_counter() - started) * 1000, retries, error is not None)
+    if error is not None:
+        raise OperationalError("BEGIN IMMEDIATE", None, error)
+
+
+@contextmanager
+def write_transaction():
+    """
+    Ends the current (read) transaction and runs the block in its own BEGIN
+    IMMEDIATE transaction, committed on exit. Re-read what you update inside.
+    """
+    db.session.rollback()
+    g.write_transaction = True
+    try:
+        yield
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        g.write_transaction = False
+
+
+def is_locked_error(exc) -> bool:
+    return isinstance(exc, OperationalError) and "database is locked" in str(exc)
+
+
+def record_write_contention(endpoint, wait_ms, retries, failed) -> None:
+    """Per-process counters behind /api/write-contention."""
+    with _contention_lock:
+        for key in ("ALL", endpoint or "?"):
+            m = _contention.setdefault(key, {
+                "transactions": 0, "contended": 0, "retries": 0, "failures": 0,
+                "wait_ms_total": 0.0, "wait_ms_max": 0.0,
+            })
+            m["transactions"] += 1
+            m["contended"] += 1 if (retries or wait_ms >= 1.0) else 0
+            m["retries"] += retries
+            m["failures"] += 1 if failed else 0
+            m["wait_ms_total"] += wait_ms
+            m["wait_ms_max"] = max(m["wait_ms_max"], wait_ms)
+
+
+def write_contention_stats() -> dict:
+    with _contention_lock:
+        stats = {k: dict(v) for k, v in _contention.items()}
+    for m in stats.values():
+        m["wait_ms_avg"] = round(m["wait_ms_total"] / m["transactions"], 2) if m["transactions"] else 0.0
+        m["wait_ms_total"] = round(m["wait_ms_total"], 1)
+        m["wait_ms_max"] = round(m["wait_ms_max"], 1)
+    return stats
+
 
 EXPENSE_CATEGORIES = [
     "CNG",
@@ -44,6 +209,14 @@ EXPENSE_CATEGORIES = [
     "Miscellaneous"
 ]
 
+DEFAULT_BOTTLE_TYPES = [
+    {"label": "1 ltr", "quantity_ltr": 1.0, "bottles_in_batch": 12, "can_price": 4.25, "price_per_kg": 9.0, "box_cost": 21, "selling_price_per_batch": 170},
+    {"label": "0.5 ltr", "quantity_ltr": 0.5, "bottles_in_batch": 24, "can_price": 6.0, "price_per_kg": 9.0, "box_cost": 21, "selling_price_per_batch": 220},
+    {"label": "5 ltr", "quantity_ltr": 5.0, "bottles_in_batch": 1, "can_price": 15.0, "price_per_kg": 9.0, "box_cost": 0.0, "selling_price_per_batch": 80},
+]
+
+DEAL_CHOICES = ["Need To Visit", "In Discussion", "Deal Closed", "Deal Rejected"]
+
 
 def create_app(test_config: Optional[dict] = None) -> Flask:
     app = Flask(__name__, static_folder="static", template_folder="templates")
@@ -66,37 +239,134 @@ def create_app(test_config: Optional[dict] = None) -> Flask:
 
     db.init_app(app)
 
-    # create tables automatically for local dev
-    with app.app_context():
-        db.create_all()
-        
-        # Seed ExpenseCategory if empty
-        if ExpenseCategory.query.count() == 0:
-            for cat_name in EXPENSE_CATEGORIES:
-                db.session.add(ExpenseCategory(name=cat_name))
-            db.session.commit()
+    timings = {"since_import": (time.perf_counter() - _IMPORT_STARTED) * 1000}
+    started = time.perf_counter()
 
-        # Seed ProductBatch for existing products if ProductBatch is empty
-        if ProductBatch.query.count() == 0:
-            for p in Product.query.all():
-                if p.current_stock_kg != 0:
-                    batch = ProductBatch(
-                        product_id=p.id,
-                        rate=p.valuation_rate or 0.0,
-                        quantity_kg=p.current_stock_kg
-                    )
-                    db.session.add(batch)
-            db.session.commit()
+    # Table creation + seeding runs once per database (see bootstrap_db);
+    # after that boot only pays for two tiny version lookups.
+    with app.app_context():
+        boot_version, schema_version = db_boot_state()
+        if boot_version < BOOTSTRAP_VERSION:
+            timings.update(bootstrap_db())
+            boot_version, schema_version = db_boot_state()
+        if schema_version < latest_schema_version():
+            app.logger.warning(
+                "database schema is at v%s but the code expects v%s - run `flask db-upgrade`",
+                schema_version, latest_schema_version(),
+            )
+    timings["bootstrap"] = (time.perf_counter() - started) * 1000
 
+    step = time.perf_counter()
     register_routes(app)
     register_cli(app)
+    timings["register"] = (time.perf_counter() - step) * 1000
+    timings["create_app"] = (time.perf_counter() - started) * 1000
+
+    app.config["STARTUP_TIMINGS_MS"] = {k: round(v, 1) for k, v in timings.items()}
+    app.logger.info("startup timings (ms): %s", app.config["STARTUP_TIMINGS_MS"])
 
     return app
 
 
+# -----------------------------------------------------------------------------
+# Fixed-point money
+# -----------------------------------------------------------------------------
+# Money is stored as integer paise and rates as integer rupees x 10^4, so SQL
+# SUM()s are exact and balances compare without float drift. Models keep the
+# old float names as accessors over the integer columns; raw SQL reads the
+# integer columns and divides at the end.
+PAISE = 100
+RATE_SCALE = 10_000
+
+
+def to_paise(amount) -> int:
+    return int(round(float(amount or 0.0) * PAISE))
+
+
+def to_rate_e4(rate) -> int:
+    return int(round(float(rate or 0.0) * RATE_SCALE))
+
+
+def scaled_accessor(column: str, scale: int) -> hybrid_property:
+    """Float view of an integer column: reads divide by `scale`, writes round into it."""
+    def fget(self):
+        value = getattr(self, column)
+        return None if value is None else value / scale
+
+    def fset(self, value):
+        setattr(self, column, None if value is None else int(round(float(value) * scale)))
+
+    def expr(cls):
+        return getattr(cls, column) / float(scale)
+
+    return hybrid_property(fget, fset, expr=expr)
+
+
+def _paise_columns(*names) -> dict:
+    return {n: (f"{n}_paise", PAISE) for n in names}
+
+
+# Old float column -> (integer column, scale), per table. Used by scaled_row()
+# for Core / bulk inserts keyed by the old names; the v19 and v23 migrations
+# keep their own copy of the columns they convert.
+SCALED_COLUMNS = {
+    "client": _paise_columns("opening_balance"),
+    "sale": _paise_columns("freight", "subtotal", "cgst_amount", "sgst_amount", "igst_amount",
+                           "misc_amount", "grand_total"),
+    "sale_item": {"cost_rate_per_kg": ("cost_rate_e4", RATE_SCALE),
+                  "selling_rate_per_kg": ("selling_rate_e4", RATE_SCALE)},
+    "sale_payment": _paise_columns("amount"),
+    "client_collection": _paise_columns("amount"),
+    "purchase": _paise_columns("freight", "subtotal", "cgst_amount", "sgst_amount", "igst_amount",
+                               "grand_total"),
+    "purchase_item": {"rate_per_kg": ("rate_e4", RATE_SCALE)},
+    "purchase_payment": _paise_columns("amount"),
+    "vendor_collection": _paise_columns("amount"),
+    "expense": _paise_columns("amount"),
+    "product": {"valuation_rate": ("valuation_rate_e4", RATE_SCALE)},
+    # Added by v23
+    "employee": _paise_columns("monthly_salary"),
+    "bottle_type": dict(_paise_columns("can_price", "box_cost", "selling_price_per_batch"),
+                        price_per_kg=("price_per_kg_e4", RATE_SCALE)),
+    "loan": _paise_columns("principal"),
+    "loan_repayment": _paise_columns("amount"),
+}
+
+
+def scaled_row(table: str, row: dict) -> dict:
+    """A row keyed by the old float names -> the stored integer columns."""
+    cols = SCALED_COLUMNS.get(table)
+    if not cols:
+        return row
+    out = dict(row)
+    for name, (column, scale) in cols.items():
+        if name in out:
+            value = out.pop(name)
+            out[column] = None if value is None else int(round(float(value) * scale))
+    return out
+
+
 # -----------------------------------------------------------------------------
 # Models
 # -----------------------------------------------------------------------------
+class AppMeta(db.Model):
+    """Small key/value store for app-level bookkeeping (bootstrap version etc.)."""
+    __tablename__ = "app_meta"
+
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.String(255), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class SchemaVersion(db.Model):
+    __tablename__ = "schema_version"
+
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    name = db.Column(db.String(120), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+    duration_ms = db.Column(db.Float, nullable=True)
+
+
 class ExpenseCategory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False, unique=True)
@@ -107,30 +377,41 @@ class Client(db.Model):
     address = db.Column(db.Text, nullable=True)
     gst = db.Column(db.String(32), nullable=True)
     phone = db.Column(db.String(20), nullable=True)
-    opening_balance = db.Column(db.Float, nullable=False, default=0.0)
+    opening_balance_paise = db.Column(db.Integer, nullable=False, default=0)
+    opening_balance = scaled_accessor("opening_balance_paise", PAISE)
 
     def __repr__(self) -> str:
         return f"<Client {self.name}>"
 
 
 class Sale(db.Model):
+    __table_args__ = (db.Index("ix_sale_client_date", "client_name", "date"),)
+
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.Date, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
     client_name = db.Column(db.String(160), nullable=False)
-    freight = db.Column(db.Float, nullable=False, default=0.0)
+    freight_paise = db.Column(db.Integer, nullable=False, default=0)
     quantity_kg = db.Column(db.Float, nullable=False, default=0.0, server_default="0.0")
     sale_type = db.Column(db.String(16), nullable=False, default="bill")
 
     gst_percent = db.Column(db.Float, nullable=False, default=0.0)
 
-    subtotal = db.Column(db.Float, nullable=False, default=0.0)
-    cgst_amount = db.Column(db.Float, nullable=False, default=0.0)
-    sgst_amount = db.Column(db.Float, nullable=False, default=0.0)
-    igst_amount = db.Column(db.Float, nullable=False, default=0.0)
+    subtotal_paise = db.Column(db.Integer, nullable=False, default=0)
+    cgst_amount_paise = db.Column(db.Integer, nullable=False, default=0)
+    sgst_amount_paise = db.Column(db.Integer, nullable=False, default=0)
+    igst_amount_paise = db.Column(db.Integer, nullable=False, default=0)
+
+    misc_amount_paise = db.Column(db.Integer, nullable=False, default=0)
 
-    misc_amount = db.Column(db.Float, nullable=False, default=0.0)
+    grand_total_paise = db.Column(db.Integer, nullable=False, default=0)
 
-    grand_total = db.Column(db.Float, nullable=False, default=0.0)
+    freight = scaled_accessor("freight_paise", PAISE)
+    subtotal = scaled_accessor("subtotal_paise", PAISE)
+    cgst_amount = scaled_accessor("cgst_amount_paise", PAISE)
+    sgst_amount = scaled_accessor("sgst_amount_paise", PAISE)
+    igst_amount = scaled_accessor("igst_amount_paise", PAISE)
+    misc_amount = scaled_accessor("misc_amount_paise", PAISE)
+    grand_total = scaled_accessor("grand_total_paise", PAISE)
 
     items = db.relationship("SaleItem", backref="sale", cascade="all, delete-orphan")
     payments = db.relationship("SalePayment", backref="sale_ref", cascade="all, delete-orphan")
@@ -153,9 +434,12 @@ class Sale(db.Model):
 
     # alias for reports and payments
     def total_amount(self):
-        if self.grand_total and self.grand_total > 0:
-            return round(self.grand_total, 2)
-        return self.total_sp()
+        return self.total_amount_paise() / PAISE
+
+    def total_amount_paise(self) -> int:
+        if self.grand_total_paise and self.grand_total_paise > 0:
+            return self.grand_total_paise
+        return to_paise(self.total_sp())
 
     def pl(self) -> float:
         # P/L = Selling Subtotal - (Raw Cost + Freight + Misc)
@@ -165,15 +449,21 @@ class Sale(db.Model):
         return round(self.total_sp() - (raw_cp + (self.freight or 0.0) + (self.misc_amount or 0.0)), 2)
 
     def total_received(self):
-        return round(sum(p.amount for p in self.payments), 2)
+        return self.total_received_paise() / PAISE
+
+    def total_received_paise(self) -> int:
+        return sum(p.amount_paise or 0 for p in self.payments)
 
     def balance_due(self):
-        return round(self.total_amount() - self.total_received(), 2)
+        return self.balance_due_paise() / PAISE
+
+    def balance_due_paise(self) -> int:
+        return self.total_amount_paise() - self.total_received_paise()
 
     def payment_status(self):
-        if self.total_received() == 0:
+        if self.total_received_paise() == 0:
             return "Unpaid"
-        elif self.balance_due() > 0:
+        elif self.balance_due_paise() > 0:
             return "Partial"
         else:
             return "Paid"
@@ -181,18 +471,20 @@ class Sale(db.Model):
 class Employee(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False, unique=True)
-    monthly_salary = db.Column(db.Float, nullable=False, default=0.0)
+    monthly_salary_paise = db.Column(db.Integer, nullable=False, default=0)
+    monthly_salary = scaled_accessor("monthly_salary_paise", PAISE)
 
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('employee.id'), nullable=True)
 
-    date = db.Column(db.Date, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
 
     category = db.Column(db.String(120), nullable=False)
     description = db.Column(db.String(300))
 
-    amount = db.Column(db.Float, nullable=False)
+    amount_paise = db.Column(db.Integer, nullable=False)
+    amount = scaled_accessor("amount_paise", PAISE)
 
     mode = db.Column(db.String(50))   # Cash / Bank / UPI
 
@@ -207,14 +499,21 @@ class Expense(db.Model):
 
 class SaleItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    sale_id = db.Column(db.Integer, db.ForeignKey("sale.id"), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=True)
+    sale_id = db.Column(db.Integer, db.ForeignKey("sale.id"), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=True, index=True)
     bottle_type_id = db.Column(db.Integer, db.ForeignKey("bottle_type.id"), nullable=True) 
     quantity_kg = db.Column(db.Float, nullable=False, default=0.0)  # for bottles = num_batches
-    cost_rate_per_kg = db.Column(db.Float, nullable=False, default=0.0)
-    selling_rate_per_kg = db.Column(db.Float, nullable=True, default=0.0)
+    cost_rate_e4 = db.Column(db.Integer, nullable=False, default=0)
+    selling_rate_e4 = db.Column(db.Integer, nullable=True, default=0)
     gst_percent = db.Column(db.Float, nullable=False, default=0.0, server_default="0.0")
 
+    bottle_type = db.relationship("BottleType")
+    # Lots the costing engine took this line from (FIFO / weighted-average products)
+    lots = db.relationship("SaleItemLot", cascade="all, delete-orphan")
+
+    cost_rate_per_kg = scaled_accessor("cost_rate_e4", RATE_SCALE)
+    selling_rate_per_kg = scaled_accessor("selling_rate_e4", RATE_SCALE)
+
     def __repr__(self) -> str:
         prod_info = f" product={self.product_id}" if self.product_id else ""
         return f"<SaleItem {self.quantity_kg}kg cost={self.cost_rate_per_kg} sp={self.selling_rate_per_kg}{prod_info}>"
@@ -226,11 +525,13 @@ class SalePayment(db.Model):
     sale_id = db.Column(
         db.Integer,
         db.ForeignKey("sale.id"),
-        nullable=False
+        nullable=False,
+        index=True
     )
 
-    date = db.Column(db.Date, nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
+    amount_paise = db.Column(db.Integer, nullable=False)
+    amount = scaled_accessor("amount_paise", PAISE)
 
     mode = db.Column(db.String(50))   # Cash / Bank / UPI
     notes = db.Column(db.String(250))
@@ -242,10 +543,13 @@ class SalePayment(db.Model):
     )
 
 class ClientCollection(db.Model):
+    __table_args__ = (db.Index("ix_client_collection_client_date", "client_id", "date"),)
+
     id = db.Column(db.Integer, primary_key=True)
     client_id = db.Column(db.Integer, db.ForeignKey("client.id"), nullable=False)
     date = db.Column(db.Date, nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount_paise = db.Column(db.Integer, nullable=False)
+    amount = scaled_accessor("amount_paise", PAISE)
     mode = db.Column(db.String(50))   # Cash / Bank / UPI
     notes = db.Column(db.String(250))
 
@@ -254,10 +558,13 @@ class ClientCollection(db.Model):
 
 
 class VendorCollection(db.Model):
+    __table_args__ = (db.Index("ix_vendor_collection_vendor_date", "vendor_name", "date"),)
+
     id = db.Column(db.Integer, primary_key=True)
     vendor_name = db.Column(db.String(160), nullable=False)
     date = db.Column(db.Date, nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount_paise = db.Column(db.Integer, nullable=False)
+    amount = scaled_accessor("amount_paise", PAISE)
     mode = db.Column(db.String(50))   # Cash / Bank / UPI
     notes = db.Column(db.String(250))
 
@@ -265,34 +572,44 @@ class VendorCollection(db.Model):
 
 
 class Purchase(db.Model):
+    __table_args__ = (db.Index("ix_purchase_vendor_date", "vendor_name", "date"),)
+
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.Date, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
     vendor_name = db.Column(db.String(160), nullable=False)
-    freight = db.Column(db.Float, nullable=False, default=0.0)
+    freight_paise = db.Column(db.Integer, nullable=False, default=0)
 
     gst_percent = db.Column(db.Float, nullable=False, default=0.0)
-    subtotal = db.Column(db.Float, nullable=False, default=0.0)
-    cgst_amount = db.Column(db.Float, nullable=False, default=0.0)
-    sgst_amount = db.Column(db.Float, nullable=False, default=0.0)
-    igst_amount = db.Column(db.Float, nullable=False, default=0.0)
-    grand_total = db.Column(db.Float, nullable=False, default=0.0)
+    subtotal_paise = db.Column(db.Integer, nullable=False, default=0)
+    cgst_amount_paise = db.Column(db.Integer, nullable=False, default=0)
+    sgst_amount_paise = db.Column(db.Integer, nullable=False, default=0)
+    igst_amount_paise = db.Column(db.Integer, nullable=False, default=0)
+    grand_total_paise = db.Column(db.Integer, nullable=False, default=0)
+
+    freight = scaled_accessor("freight_paise", PAISE)
+    subtotal = scaled_accessor("subtotal_paise", PAISE)
+    cgst_amount = scaled_accessor("cgst_amount_paise", PAISE)
+    sgst_amount = scaled_accessor("sgst_amount_paise", PAISE)
+    igst_amount = scaled_accessor("igst_amount_paise", PAISE)
+    grand_total = scaled_accessor("grand_total_paise", PAISE)
 
     items = db.relationship("PurchaseItem", backref="purchase", cascade="all, delete-orphan")
     payments = db.relationship("PurchasePayment", backref="purchase_ref", cascade="all, delete-orphan")
 
     def total_cost(self):
+        return self.total_cost_paise() / PAISE
+
+    def total_cost_paise(self) -> int:
         # If GST-based total exists, use it
-        if self.grand_total and self.grand_total > 0:
-            return round(self.grand_total, 2)
+        if self.grand_total_paise and self.grand_total_paise > 0:
+            return self.grand_total_paise
 
         # Fallback for old purchases
         total = sum(
             (i.rate_per_kg or 0.0) * (i.quantity_kg or 0.0)
             for i in self.items
         )
-        total += (self.freight or 0.0)
-
-        return round(total, 2)
+        return to_paise(total) + (self.freight_paise or 0)
     
     def total_quantity(self):
         return round(sum(i.quantity_kg or 0 for i in self.items), 2)
@@ -314,15 +631,21 @@ class Purchase(db.Model):
         return round(total_value / total_qty, 2)
 
     def total_paid(self):
-        return round(sum(p.amount for p in self.payments), 2)
+        return self.total_paid_paise() / PAISE
+
+    def total_paid_paise(self) -> int:
+        return sum(p.amount_paise or 0 for p in self.payments)
 
     def balance_due(self):
-        return round(self.total_cost() - self.total_paid(), 2)
+        return self.balance_due_paise() / PAISE
+
+    def balance_due_paise(self) -> int:
+        return self.total_cost_paise() - self.total_paid_paise()
 
     def payment_status(self):
-        if self.total_paid() == 0:
+        if self.total_paid_paise() == 0:
             return "Unpaid"
-        elif self.balance_due() > 0:
+        elif self.balance_due_paise() > 0:
             return "Partial"
         else:
             return "Paid"
@@ -331,11 +654,13 @@ class Purchase(db.Model):
 
 class PurchaseItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    purchase_id = db.Column(db.Integer, db.ForeignKey("purchase.id"), nullable=False)
-    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=True)
+    purchase_id = db.Column(db.Integer, db.ForeignKey("purchase.id"), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=True, index=True)
 
     quantity_kg = db.Column(db.Float, nullable=False, default=0.0)
-    rate_per_kg = db.Column(db.Float, nullable=False, default=0.0)
+    rate_e4 = db.Column(db.Integer, nullable=False, default=0)
+
+    rate_per_kg = scaled_accessor("rate_e4", RATE_SCALE)
 
 
 class PurchasePayment(db.Model):
@@ -344,11 +669,13 @@ class PurchasePayment(db.Model):
     purchase_id = db.Column(
         db.Integer,
         db.ForeignKey("purchase.id"),
-        nullable=False
+        nullable=False,
+        index=True
     )
 
-    date = db.Column(db.Date, nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    date = db.Column(db.Date, nullable=False, index=True)
+    amount_paise = db.Column(db.Integer, nullable=False)
+    amount = scaled_accessor("amount_paise", PAISE)
 
     mode = db.Column(db.String(50))   # Cash / Bank / UPI
     notes = db.Column(db.String(250))
@@ -369,10 +696,15 @@ class BottleType(db.Model):
     label = db.Column(db.String(64), nullable=False, unique=True)
     quantity_ltr = db.Column(db.Float, nullable=False, default=0.0)
     bottles_in_batch = db.Column(db.Integer, nullable=False, default=1)
-    can_price = db.Column(db.Float, nullable=False, default=0.0)
-    price_per_kg = db.Column(db.Float, nullable=False, default=0.0)
-    box_cost = db.Column(db.Float, nullable=False, default=0.0)
-    selling_price_per_batch = db.Column(db.Float, nullable=False, default=0.0)
+    can_price_paise = db.Column(db.Integer, nullable=False, default=0)
+    price_per_kg_e4 = db.Column(db.Integer, nullable=False, default=0)
+    box_cost_paise = db.Column(db.Integer, nullable=False, default=0)
+    selling_price_per_batch_paise = db.Column(db.Integer, nullable=False, default=0)
+
+    can_price = scaled_accessor("can_price_paise", PAISE)
+    price_per_kg = scaled_accessor("price_per_kg_e4", RATE_SCALE)
+    box_cost = scaled_accessor("box_cost_paise", PAISE)
+    selling_price_per_batch = scaled_accessor("selling_price_per_batch_paise", PAISE)
 
     def __repr__(self) -> str:
         return f"<BottleType {self.label} x{self.bottles_in_batch}>"
@@ -391,45 +723,403 @@ class Product(db.Model):
     name = db.Column(db.String(160), nullable=False, unique=True)
     current_stock_kg = db.Column(db.Float, nullable=False, default=0.0)
     min_stock_kg = db.Column(db.Float, nullable=False, default=0.0)
-    valuation_rate = db.Column(db.Float, nullable=False, default=0.0)
+    valuation_rate_e4 = db.Column(db.Integer, nullable=False, default=0)
+    valuation_rate = scaled_accessor("valuation_rate_e4", RATE_SCALE)
+    # "manual", "fifo" or "wavg" (COSTING_METHODS)
+    costing_method = db.Column(db.String(8), nullable=False, default="manual", server_default="manual")
+    # Sum of batch kg x rate, kept up to date with every batch change
+    stock_value_paise = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    stock_value = scaled_accessor("stock_value_paise", PAISE)
     
     def change_stock(self, amount):
-        self.current_stock_kg = round((self.current_stock_kg or 0.0) + amount, 2)
+        # Added inside SQLite, not read-add-write, so concurrent workers
+        # can't lose each other's change
+        db.session.execute(
+            update(Product)
+            .where(Product.id == self.id)
+            .values(current_stock_kg=func.round(func.coalesce(Product.current_stock_kg, 0.0) + amount, 2))
+        )
 
     def __repr__(self) -> str:
         return f"<Product {self.name} {self.current_stock_kg}kg>"
 
+# Receipt date of stock no purchase accounts for (opening stock, batches
+# seeded from the valuation rate): it sorts before every dated lot
+OPENING_STOCK_DATE = date.min
+
+
 class ProductBatch(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
-    rate = db.Column(db.Float, nullable=False, default=0.0)
+    # Rate x 10^4, the same scale as the item rate_e4 / cost_rate_e4 columns,
+    # so a line resolves to its batch by integer equality
+    rate_key = db.Column(db.Integer, nullable=False, default=0)
+    rate = scaled_accessor("rate_key", RATE_SCALE)
     quantity_kg = db.Column(db.Float, nullable=False, default=0.0)
+    # First receipt into this batch; FIFO takes the oldest lots first.
+    # OPENING_STOCK_DATE when no purchase is behind it
+    received_on = db.Column(db.Date, nullable=True)
 
     product = db.relationship("Product", backref=db.backref("batches", cascade="all, delete-orphan"))
 
+    __table_args__ = (
+        # One batch per (product, rate_key); the ON CONFLICT upserts below rely on it
+        db.Index("ux_product_batch_product_rate_key", "product_id", "rate_key", unique=True),
+        db.Index("ix_product_batch_fifo", "product_id", "received_on", "id"),
+    )
+
     def __repr__(self) -> str:
         return f"<ProductBatch product={self.product_id} rate={self.rate} qty={self.quantity_kg}>"
 
+
+class SaleItemLot(db.Model):
+    """kg a sale line took from one batch, so an edit / delete can put it back."""
+    __tablename__ = "sale_item_lot"
+
+    id = db.Column(db.Integer, primary_key=True)
+    sale_item_id = db.Column(db.Integer, db.ForeignKey("sale_item.id"), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey("product.id"), nullable=False)
+    rate_key = db.Column(db.Integer, nullable=False)
+    quantity_kg = db.Column(db.Float, nullable=False)
+
+    def __repr__(self) -> str:
+        return f"<SaleItemLot item={self.sale_item_id} rate={self.rate_key / RATE_SCALE} qty={self.quantity_kg}>"
+
+
+def _upsert_batches(rows, received_on: Optional[date] = None) -> None:
+    """
+    Adds kg to (product_id, rate_key) batches, creating missing ones, in a
+    single INSERT .. ON CONFLICT DO UPDATE. The addition happens inside
+    SQLite, so two workers moving the same batch can't overwrite each
+    other's change. rows: [(product_id, rate_key, kg)]. `received_on` is
+    the receipt date for purchases: new batches get it (others get today)
+    and a batch refilled after running out is dated again.
+    """
+    stmt = sqlite_insert(ProductBatch).values([
+        {"product_id": pid, "rate_key": key, "quantity_kg": round(kg, 2),
+         "received_on": received_on or date.today()}
+        for pid, key, kg in rows
+    ])
+    set_ = {"quantity_kg": func.round(ProductBatch.quantity_kg + stmt.excluded.quantity_kg, 2)}
+    if received_on:
+        set_["received_on"] = case(
+            (and_(ProductBatch.quantity_kg <= 0, stmt.excluded.quantity_kg > 0), stmt.excluded.received_on),
+            else_=ProductBatch.received_on,
+        )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ProductBatch.product_id, ProductBatch.rate_key],
+        set_=set_,
+    )
+    # RETURNING refreshes batches already loaded in this session
+    db.session.scalars(stmt.returning(ProductBatch), execution_options={"populate_existing": True}).all()
+
+    product_ids = {pid for pid, _, _ in rows}
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, Product) and obj.id in product_ids:
+            db.session.expire(obj, ["batches"])
+
+
+def _sync_product_totals(product_ids) -> None:
+    """
+    Sets current_stock_kg and stock_value_paise to the sums over the
+    product's batches in one UPDATE, so reading either is a column read.
+    """
+    total = (
+        select(func.round(func.coalesce(func.sum(ProductBatch.quantity_kg), 0.0), 2))
+        .where(ProductBatch.product_id == Product.id)
+        .scalar_subquery()
+    )
+    # kg x (rupees x 10^4) / 100 = paise
+    value = (
+        select(func.cast(func.round(func.coalesce(
+            func.sum(ProductBatch.quantity_kg * ProductBatch.rate_key), 0) / 100.0), db.Integer))
+        .where(ProductBatch.product_id == Product.id)
+        .scalar_subquery()
+    )
+    db.session.execute(
+        update(Product).where(Product.id.in_(list(product_ids)))
+        .values(current_stock_kg=total, stock_value_paise=value),
+        execution_options={"synchronize_session": "fetch"},
+    )
+
+
 def adjust_batch_stock(product_id, rate, amount):
     """
     Adjusts the stock of a specific product batch (rate-based).
     If the batch doesn't exist, it creates a new one.
     """
-    rate = round(float(rate or 0.0), 4)
-    batch = ProductBatch.query.filter_by(product_id=product_id, rate=rate).first()
-    if not batch:
-        batch = ProductBatch(product_id=product_id, rate=rate, quantity_kg=0.0)
-        db.session.add(batch)
-    batch.quantity_kg = round((batch.quantity_kg or 0.0) + amount, 2)
+    _upsert_batches([(product_id, to_rate_e4(rate), amount)])
+
 
 def sync_product_total_stock(product_id):
     """
     Synchronizes a product's current_stock_kg to be the sum of all its batches.
     """
-    prod = Product.query.get(product_id)
-    if prod:
-        total_stock = sum(b.quantity_kg for b in prod.batches)
-        prod.current_stock_kg = round(total_stock, 2)
+    _sync_product_totals([product_id])
+
+
+def apply_stock_deltas(deltas, received_on: Optional[date] = None) -> None:
+    """
+    Applies {(product_id, rate_key): kg} in one pass: one upsert for the
+    affected batches, one UPDATE for the product totals. Same result as
+    calling adjust_batch_stock + sync_product_total_stock for every line.
+    Batches this creates are stamped `received_on` (the purchase date).
+    """
+    net = {}
+    for (product_id, rate_key), amount in deltas.items():
+        if product_id and amount:
+            key = (product_id, rate_key or 0)
+            net[key] = net.get(key, 0.0) + amount
+    if not net:
+        return
+
+    _upsert_batches([(pid, key, kg) for (pid, key), kg in sorted(net.items())], received_on)
+    _sync_product_totals({pid for pid, _ in net})
+
+
+def _sync_line_items(items, item_cls, lines, fields, rate_field, sign) -> dict:
+    """
+    Brings the `items` collection in line with the submitted `lines` (dicts
+    of item fields; "id" set for lines that already exist). Unchanged lines
+    are left alone, edited ones updated in place, new ones added and missing
+    ones deleted (delete-orphan). Returns the net stock change per
+    (product_id, rate_key) for apply_stock_deltas(); `rate_field` is the
+    item's integer rate column, `sign` is -1 for lines that take stock out
+    (sales) and +1 for lines that bring it in (purchases).
+    """
+    deltas = {}
+
+    def move(product_id, rate_key, qty):
+        if product_id:
+            key = (product_id, rate_key or 0)
+            deltas[key] = deltas.get(key, 0.0) + sign * (qty or 0.0)
+
+    existing = {item.id: item for item in items}
+    kept = set()
+    for line in lines:
+        item = existing.get(line.get("id"))
+        if item is None or item.id in kept:
+            item = item_cls()
+            items.append(item)
+        else:
+            kept.add(item.id)
+            move(item.product_id, getattr(item, rate_field), -item.quantity_kg)
+        for f in fields:
+            value = line.get(f)
+            if getattr(item, f) != value:
+                setattr(item, f, value)
+        move(item.product_id, getattr(item, rate_field), item.quantity_kg)
+
+    for item_id, item in existing.items():
+        if item_id not in kept:
+            move(item.product_id, getattr(item, rate_field), -item.quantity_kg)
+            items.remove(item)
+
+    return {k: v for k, v in deltas.items() if abs(v) > 1e-9}
+
+
+def sync_sale_items(sale, lines) -> dict:
+    """
+    Diffs sale.items against the form lines; stock moves at the cost rate,
+    except for FIFO / weighted-average products, whose lines are costed from
+    their lots by the costing engine (the typed cost rate is ignored).
+    """
+    product_ids = {i.product_id for i in sale.items} | {l.get("product_id") for l in lines}
+    costed = costing_methods(product_ids)
+    old = {i.id: i for i in sale.items if i.id is not None}
+    before = {i.id: (i.product_id, i.quantity_kg, i.cost_rate_e4) for i in old.values()}
+    # Read the allocations before the diff: a later autoflush deletes removed lines
+    held = {item_id: [(l.product_id, l.rate_key, l.quantity_kg) for l in old[item_id].lots]
+            for item_id in _items_with_lots(old)}
+    for line in lines:
+        if line.get("product_id") in costed:
+            item = old.get(line.get("id"))
+            line["cost_rate_per_kg"] = item.cost_rate_per_kg if item is not None else 0.0
+
+    deltas = _sync_line_items(
+        sale.items, SaleItem, lines,
+        ("product_id", "bottle_type_id", "quantity_kg", "cost_rate_per_kg",
+         "selling_rate_per_kg", "gst_percent"),
+        "cost_rate_e4", -1,
+    )
+    if not costed and not old:
+        return deltas
+
+    def undo(product_id, rate_key, qty):
+        # Cancel a cost-rate move _sync_line_items made for an engine-managed line
+        if product_id:
+            key = (product_id, rate_key or 0)
+            deltas[key] = deltas.get(key, 0.0) + qty
+
+    # Lines that lost or changed their allocation put their lots back
+    current = {i.id for i in sale.items}
+    reprice = [i for i in sale.items if i.id is None]
+    for item_id, (product_id, qty, rate_key) in before.items():
+        item = old[item_id]
+        changed = item_id not in current or (item.product_id, item.quantity_kg) != (product_id, qty)
+        if not changed:
+            continue
+        if item_id in held:
+            undo(product_id, rate_key, -(qty or 0.0))
+            for lot_product, lot_key, kg in held[item_id]:
+                deltas[(lot_product, lot_key)] = deltas.get((lot_product, lot_key), 0.0) + kg
+            if item_id in current:
+                item.lots = []
+        if item_id in current:
+            reprice.append(item)
+
+    reprice = [i for i in reprice if i.product_id in costed and i.quantity_kg]
+    for item in reprice:
+        undo(item.product_id, item.cost_rate_e4, item.quantity_kg)
+    if reprice:
+        lots = load_lots({i.product_id for i in reprice})
+        for item in reprice:
+            method, fallback = costed[item.product_id]
+            taken = allocate_lots(lots.get(item.product_id, []), item.quantity_kg, method, fallback,
+                                  deltas, item.product_id)
+            item.lots = [SaleItemLot(product_id=item.product_id, rate_key=k, quantity_kg=kg) for k, kg in taken]
+            item.cost_rate_e4 = lots_cost_rate(taken, item.quantity_kg)
+    return {k: v for k, v in deltas.items() if abs(v) > 1e-9}
+
+
+def sync_purchase_items(purchase, lines) -> dict:
+    """Diffs purchase.items against the form lines; stock moves at the purchase rate."""
+    return _sync_line_items(
+        purchase.items, PurchaseItem, lines,
+        ("product_id", "quantity_kg", "rate_per_kg"),
+        "rate_e4", +1,
+    )
+
+
+# -----------------------------------------------------------------------------
+# Costing engine
+# -----------------------------------------------------------------------------
+# Products on "manual" costing keep the old behaviour: the cost rate typed on
+# the sale line picks the batch. FIFO products take from their oldest lots
+# first (ix_product_batch_fifo); weighted-average products take from every
+# lot in proportion to what it holds, which charges exactly the moving
+# average and leaves the remaining lots at their own rates. Either way the
+# line's cost rate is the kg-weighted rate of what it took, and the lots are
+# kept in sale_item_lot so an edit or delete puts them back.
+COSTING_METHODS = {
+    "manual": "Manual (typed cost rate)",
+    "fifo": "FIFO (oldest lot first)",
+    "wavg": "Weighted average",
+}
+
+
+def costing_methods(product_ids) -> dict:
+    """{product_id: (method, valuation rate_key)} for the products not on manual costing."""
+    ids = [pid for pid in product_ids if pid]
+    if not ids:
+        return {}
+    rows = db.session.execute(
+        select(Product.id, Product.costing_method, Product.valuation_rate_e4)
+        .where(Product.id.in_(ids), Product.costing_method != "manual")
+    ).all()
+    return {pid: (method, valuation or 0) for pid, method, valuation in rows}
+
+
+def load_lots(product_ids) -> dict:
+    """{product_id: [[rate_key, kg], ...]} oldest lot first."""
+    lots = {}
+    rows = db.session.execute(
+        select(ProductBatch.product_id, ProductBatch.rate_key, ProductBatch.quantity_kg)
+        .where(ProductBatch.product_id.in_(list(product_ids)))
+        .order_by(ProductBatch.product_id, ProductBatch.received_on, ProductBatch.id)
+    ).all()
+    for pid, rate_key, qty in rows:
+        lots.setdefault(pid, []).append([rate_key, qty or 0.0])
+    return lots
+
+
+def allocate_lots(lots: list, qty: float, method: str, fallback_key: int,
+                  deltas: dict, product_id: int) -> list:
+    """
+    Takes `qty` kg from `lots` ([rate_key, kg] oldest first, net of the
+    moves already in `deltas`) and returns [(rate_key, kg)]. The take is
+    added to `deltas` as negative kg so later lines see what is left. What
+    the lots can't cover comes from the newest lot (or a batch at the
+    valuation rate when there are none) and shows as negative stock there.
+    """
+    on_hand = [(key, round(kg + deltas.get((product_id, key), 0.0), 2)) for key, kg in lots]
+    on_hand = [(key, kg) for key, kg in on_hand if kg > 0]
+    taken = []
+    if method == "fifo":
+        remaining = qty
+        for key, kg in on_hand:
+            if remaining <= 0:
+                break
+            take = round(min(kg, remaining), 2)
+            taken.append((key, take))
+            remaining = round(remaining - take, 2)
+    else:
+        available = sum(kg for _key, kg in on_hand)
+        share = min(qty, available)
+        if share > 0:
+            taken = [(key, round(share * kg / available, 2)) for key, kg in on_hand]
+            # Rounding leftovers go to the biggest lot
+            biggest = max(range(len(taken)), key=lambda i: taken[i][1])
+            taken[biggest] = (taken[biggest][0], round(taken[biggest][1] + share - sum(kg for _k, kg in taken), 2))
+            taken = [(key, kg) for key, kg in taken if kg > 0]
+
+    short = round(qty - sum(kg for _key, kg in taken), 2)
+    if short > 0:
+        key = lots[-1][0] if lots else fallback_key
+        for i, (k, kg) in enumerate(taken):
+            if k == key:
+                taken[i] = (k, round(kg + short, 2))
+                break
+        else:
+            taken.append((key, short))
+
+    for key, kg in taken:
+        deltas[(product_id, key)] = deltas.get((product_id, key), 0.0) - kg
+    return taken
+
+
+def lots_cost_rate(taken: list, qty: float) -> int:
+    """kg-weighted rate_key of an allocation (the line's cost rate x 10^4)."""
+    if not qty:
+        return 0
+    return int(round(sum(key * kg for key, kg in taken) / qty))
+
+
+def cost_new_sale_items(items: list, deltas: dict) -> tuple:
+    """
+    Costs sale item rows about to be bulk-inserted (dicts with product_id,
+    quantity_kg and cost_rate_e4, already counted in `deltas` at that rate).
+    Lines of FIFO / weighted-average products are moved onto the lots they
+    take and get the lots' cost rate. Returns (deltas, [(row index, taken)]).
+    """
+    costed = costing_methods({row.get("product_id") for row in items})
+    todo = [(i, row) for i, row in enumerate(items)
+            if row.get("product_id") in costed and row.get("quantity_kg")]
+    if not todo:
+        return deltas, []
+    deltas = dict(deltas)
+    for _i, row in todo:
+        key = (row["product_id"], row.get("cost_rate_e4") or 0)
+        deltas[key] = deltas.get(key, 0.0) + row["quantity_kg"]
+    lots = load_lots({row["product_id"] for _i, row in todo})
+    allocations = []
+    for i, row in todo:
+        method, fallback = costed[row["product_id"]]
+        taken = allocate_lots(lots.get(row["product_id"], []), row["quantity_kg"], method, fallback,
+                              deltas, row["product_id"])
+        row["cost_rate_e4"] = lots_cost_rate(taken, row["quantity_kg"])
+        allocations.append((i, taken))
+    return {k: v for k, v in deltas.items() if abs(v) > 1e-9}, allocations
+
+
+def _items_with_lots(item_ids) -> set:
+    ids = [i for i in item_ids if i is not None]
+    if not ids:
+        return set()
+    return set(db.session.scalars(
+        select(SaleItemLot.sale_item_id).where(SaleItemLot.sale_item_id.in_(ids)).distinct()
+    ))
+
 
 class Location(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -449,6 +1139,7 @@ class Lead(db.Model):
     comments = db.Column(db.Text, nullable=True)
     address = db.Column(db.String(1024), nullable=True)           # <-- NEW
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)
 
     location = db.relationship("Location", backref=db.backref("leads", cascade="all, delete-orphan"))
 
@@ -463,17 +1154,46 @@ class Lead(db.Model):
             "comments": self.comments,
             "address": self.address,
             "created_at": self.created_at.isoformat() if self.created_at else None,
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
 
     def __repr__(self) -> str:
         return f"<Lead {self.name} @ {self.location_id}>"
 
 
+class LeadTombstone(db.Model):
+    """Ids of deleted leads, so delta syncs (/api/leads?updated_since=) can drop them."""
+    __tablename__ = "lead_tombstone"
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    deleted_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+
+@event.listens_for(Lead, "after_delete")
+def _lead_tombstone(mapper, connection, target):
+    # Also fires for leads removed through the Location cascade
+    connection.execute(
+        text("INSERT OR REPLACE INTO lead_tombstone (id, deleted_at) VALUES (:id, :now)"),
+        {"id": target.id, "now": datetime.utcnow()},
+    )
+
+
+@event.listens_for(Location, "after_update")
+def _location_renamed(mapper, connection, target):
+    # Leads carry location_name, so a rename is a change to each of them
+    if inspect(target).attrs.name.history.has_changes():
+        connection.execute(
+            text("UPDATE lead SET updated_at = :now WHERE location_id = :id"),
+            {"id": target.id, "now": datetime.utcnow()},
+        )
+
+
 class Loan(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     loan_type = db.Column(db.String(16), nullable=False)          # "given" or "taken"
     party_name = db.Column(db.String(200), nullable=False)
-    principal = db.Column(db.Float, nullable=False, default=0.0)
+    principal_paise = db.Column(db.Integer, nullable=False, default=0)
+    principal = scaled_accessor("principal_paise", PAISE)
     interest_rate = db.Column(db.Float, nullable=False, default=0.0)   # % per year
     date_issued = db.Column(db.Date, nullable=False)
     due_date = db.Column(db.Date, nullable=True)
@@ -484,14 +1204,16 @@ class Loan(db.Model):
     repayments = db.relationship("LoanRepayment", backref="loan", cascade="all, delete-orphan", order_by="LoanRepayment.date")
 
     def total_repaid(self):
-        return round(sum(r.amount for r in self.repayments), 2)
+        return sum(r.amount_paise for r in self.repayments) / PAISE
 
-    def interest_accrued(self):
-        """Simple interest accrued from issue date to today (or due_date if closed)."""
+    def interest_accrued(self, as_of=None):
+        """Simple interest accrued from issue date to today (or due_date if closed), capped at `as_of`."""
         if not self.interest_rate or self.interest_rate == 0:
             return 0.0
         from datetime import date as date_cls
         end = self.due_date if (self.is_closed and self.due_date) else date_cls.today()
+        if as_of is not None:
+            end = min(end, as_of)
         days = (end - self.date_issued).days
         if days <= 0:
             return 0.0
@@ -519,7 +1241,8 @@ class LoanRepayment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     loan_id = db.Column(db.Integer, db.ForeignKey("loan.id"), nullable=False)
     date = db.Column(db.Date, nullable=False)
-    amount = db.Column(db.Float, nullable=False)
+    amount_paise = db.Column(db.Integer, nullable=False)
+    amount = scaled_accessor("amount_paise", PAISE)
     mode = db.Column(db.String(50), nullable=True)     # Cash / Bank / UPI
     notes = db.Column(db.String(250), nullable=True)
 
@@ -527,6 +1250,674 @@ class LoanRepayment(db.Model):
         return f"<LoanRepayment loan={self.loan_id} ₹{self.amount}>"
 
 
+class PeriodClose(db.Model):
+    """A closed period: everything dated on or before `as_of` is frozen into closing_balance."""
+    __tablename__ = "period_close"
+
+    id = db.Column(db.Integer, primary_key=True)
+    as_of = db.Column(db.Date, nullable=False, unique=True)
+    notes = db.Column(db.String(250), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    balances = db.relationship("ClosingBalance", backref="period_close", cascade="all, delete-orphan")
+
+    def __repr__(self) -> str:
+        return f"<PeriodClose {self.as_of}>"
+
+
+class ClosingBalance(db.Model):
+    """
+    One carried-forward figure per close: client receivable / vendor payable
+    (party), product and batch stock (ref_id = product id, rate_key for
+    batches) and loan outstanding (ref_id = loan id). Amounts in paise.
+    """
+    __tablename__ = "closing_balance"
+    __table_args__ = (
+        db.Index("ix_closing_balance_close_kind_party", "close_id", "kind", "party"),
+        db.Index("ix_closing_balance_close_kind_ref", "close_id", "kind", "ref_id"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    close_id = db.Column(db.Integer, db.ForeignKey("period_close.id"), nullable=False)
+    kind = db.Column(db.String(8), nullable=False)     # client / vendor / product / batch / loan
+    party = db.Column(db.String(200), nullable=True)
+    ref_id = db.Column(db.Integer, nullable=True)
+    rate_key = db.Column(db.Integer, nullable=True)
+    quantity_kg = db.Column(db.Float, nullable=True)
+    amount_paise = db.Column(db.Integer, nullable=False, default=0)
+    amount = scaled_accessor("amount_paise", PAISE)
+
+    def __repr__(self) -> str:
+        return f"<ClosingBalance {self.kind} {self.party or self.ref_id} {self.amount_paise}>"
+
+
+
+class DataVersion(db.Model):
+    """Change counter per entity group, bumped in the same transaction as the write."""
+    __tablename__ = "data_version"
+
+    grp = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=True)
+
+
+class BackgroundJob(db.Model):
+    """A report/export rendered off the request path; see submit_job()."""
+    __tablename__ = "background_job"
+
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    kind = db.Column(db.String(64), nullable=False)          # endpoint name, e.g. "export_csv"
+    url = db.Column(db.String(1024), nullable=False)
+    cache_key = db.Column(db.String(64), nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False, default="queued")  # queued / running / done / failed
+    result_path = db.Column(db.String(512), nullable=True)
+    mimetype = db.Column(db.String(64), nullable=True)
+    download_name = db.Column(db.String(255), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "error": self.error,
+            "result_url": url_for("job_result", job_id=self.id) if self.status == "done" else None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class PriceRollup(db.Model):
+    """
+    Per (side, product, party, period) price aggregates, maintained by SQLite
+    triggers on sale/sale_item and purchase/purchase_item (see price rollups).
+    """
+    __tablename__ = "price_rollup"
+    __table_args__ = (
+        db.UniqueConstraint("side", "product_id", "party", "period", "period_start", name="uq_price_rollup_key"),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    side = db.Column(db.String(8), nullable=False)          # sale / purchase
+    product_id = db.Column(db.Integer, nullable=False)
+    party = db.Column(db.String(160), nullable=False)       # client_name / vendor_name
+    period = db.Column(db.String(8), nullable=False)        # month / week
+    period_start = db.Column(db.Date, nullable=False)
+    n_lines = db.Column(db.Integer, nullable=False, default=0)
+    qty_kg = db.Column(db.Float, nullable=False, default=0.0)
+    amount = db.Column(db.Float, nullable=False, default=0.0)       # sum(rate * kg)
+    cost_amount = db.Column(db.Float, nullable=False, default=0.0)  # sum(cost rate * kg)
+    min_rate = db.Column(db.Float, nullable=True)
+    max_rate = db.Column(db.Float, nullable=True)
+    sum_rate = db.Column(db.Float, nullable=False, default=0.0)
+
+
+class LastRate(db.Model):
+    """Most recent sale/purchase line per (side, party, product); trigger-maintained."""
+    __tablename__ = "last_rate"
+
+    side = db.Column(db.String(8), primary_key=True)           # sale / purchase
+    party = db.Column(db.String(160), primary_key=True)        # client_name / vendor_name
+    product_id = db.Column(db.Integer, primary_key=True)
+    rate = db.Column(db.Float, nullable=False, default=0.0)    # selling rate (sale) / rate (purchase)
+    cost_rate = db.Column(db.Float, nullable=True)
+    qty_kg = db.Column(db.Float, nullable=False, default=0.0)
+    date = db.Column(db.Date, nullable=False)
+    head_id = db.Column(db.Integer, nullable=False)            # sale.id / purchase.id
+    item_id = db.Column(db.Integer, nullable=False, index=True)
+
+    def to_dict(self):
+        return {
+            "product_id": self.product_id,
+            "rate": self.rate,
+            "cost_rate": self.cost_rate,
+            "qty": self.qty_kg,
+            "date": self.date.isoformat() if self.date else None,
+            "id": self.head_id,
+        }
+
+
+# -----------------------------------------------------------------------------
+# One-time bootstrap
+# -----------------------------------------------------------------------------
+# Bump when bootstrap_db() gains a new step that existing databases need.
+BOOTSTRAP_VERSION = 1
+
+
+def _scalar_or_none(sql: str):
+    try:
+        return db.session.execute(text(sql)).scalar()
+    except OperationalError:
+        # table does not exist yet -> brand new (or pre-bootstrap) database
+        db.session.rollback()
+        return None
+
+
+def db_boot_state() -> tuple:
+    """(bootstrap_version, schema_version) recorded in the database, 0 if missing."""
+    boot = _scalar_or_none("SELECT value FROM app_meta WHERE key = 'bootstrap_version'")
+    schema = _scalar_or_none("SELECT MAX(version) FROM schema_version")
+    return _to_int(boot, 0), _to_int(schema, 0)
+
+
+def bootstrap_db() -> dict:
+    """
+    Creates tables and seeds master data, then records BOOTSTRAP_VERSION in
+    app_meta so later boots skip all of it. Returns per-step timings (ms).
+    """
+    timings = {}
+    fresh = not inspect(db.engine).has_table("sale")
+
+    step = time.perf_counter()
+    db.create_all()
+    timings["create_all"] = (time.perf_counter() - step) * 1000
+
+    step = time.perf_counter()
+    # Seed ExpenseCategory if empty
+    if ExpenseCategory.query.count() == 0:
+        for cat_name in EXPENSE_CATEGORIES:
+            db.session.add(ExpenseCategory(name=cat_name))
+
+    # Seed ProductBatch for existing products if ProductBatch is empty
+    if _scalar_or_none("SELECT COUNT(*) FROM product_batch") == 0:
+        # Files older than v19 / v20 still carry the float valuation_rate / rate
+        rate = "valuation_rate_e4 / 10000.0" if _has_integer_money("product") else "valuation_rate"
+        column, value = (
+            ("rate_key", f"CAST(ROUND(COALESCE({rate}, 0.0) * {RATE_SCALE}) AS INTEGER)")
+            if _column_exists("product_batch", "rate_key")
+            else ("rate", f"ROUND(COALESCE({rate}, 0.0), 4)")
+        )
+        received_col, received_val = (
+            (", received_on", f", '{OPENING_STOCK_DATE.isoformat()}'")
+            if _column_exists("product_batch", "received_on") else ("", "")
+        )
+        db.session.execute(text(f"""
+            INSERT INTO product_batch (product_id, {column}, quantity_kg{received_col})
+            SELECT id, {value}, current_stock_kg{received_val}
+            FROM product
+            WHERE current_stock_kg != 0
+        """))
+    timings["seed"] = (time.perf_counter() - step) * 1000
+
+    set_meta("bootstrap_version", BOOTSTRAP_VERSION)
+    db.session.commit()
+
+    if fresh:
+        # Nothing to back up or backfill; this just installs the non-model
+        # schema objects and stamps schema_version.
+        step = time.perf_counter()
+        upgrade_db(backup=False, fresh=True)
+        timings["migrations"] = (time.perf_counter() - step) * 1000
+    return timings
+
+
+def get_meta(key: str, default=None):
+    row = AppMeta.query.get(key)
+    return row.value if row else default
+
+
+def set_meta(key: str, value) -> None:
+    row = AppMeta.query.get(key)
+    if not row:
+        row = AppMeta(key=key)
+        db.session.add(row)
+    row.value = str(value)
+    row.updated_at = datetime.utcnow()
+
+
+# -----------------------------------------------------------------------------
+# Schema migrations (flask db-upgrade)
+# -----------------------------------------------------------------------------
+# Every schema change is a numbered function in MIGRATIONS. Steps must be
+# idempotent (check before altering) so a half-finished upgrade can simply be
+# re-run; each applied version is recorded in schema_version.
+MIGRATIONS = []
+MIGRATION_BATCH_SIZE = 2000
+
+
+def migration(version: int, name: str):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return register
+
+
+def _column_exists(table: str, column: str) -> bool:
+    rows = db.session.execute(text(f"PRAGMA table_info({table})")).all()
+    return any(r[1] == column for r in rows)
+
+
+def _add_column(table: str, column: str, ddl: str) -> bool:
+    """ALTER TABLE ... ADD COLUMN unless the column is already there."""
+    if _column_exists(table, column):
+        return False
+    db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return True
+
+
+def _has_integer_money(table: str) -> bool:
+    """True once `table` stores money / rates as integers (v19, or created from the current models)."""
+    column, _scale = next(iter(SCALED_COLUMNS[table].values()))
+    return _column_exists(table, column)
+
+
+def backfill_in_batches(table: str, set_sql: str, where_sql: str = "1 = 1",
+                        params: Optional[dict] = None,
+                        batch_size: Optional[int] = None) -> int:
+    """
+    Runs UPDATE <table> SET <set_sql> over id ranges, committing after every
+    chunk so the write lock is released between batches and the app keeps
+    serving writes during a long upgrade.
+    """
+    batch_size = batch_size or MIGRATION_BATCH_SIZE
+    lo, hi = db.session.execute(text(f"SELECT MIN(id), MAX(id) FROM {table}")).first()
+    if lo is None:
+        return 0
+    updated = 0
+    for start in range(lo, hi + 1, batch_size):
+        res = db.session.execute(
+            text(f"UPDATE {table} SET {set_sql} WHERE id >= :_lo AND id < :_hi AND ({where_sql})"),
+            {"_lo": start, "_hi": start + batch_size, **(params or {})},
+        )
+        db.session.commit()
+        updated += res.rowcount or 0
+    return updated
+
+
+def sqlite_db_path() -> Optional[str]:
+    url = db.engine.url
+    if url.get_backend_name() != "sqlite" or not url.database or url.database == ":memory:":
+        return None
+    return url.database
+
+
+def backup_sqlite(dest_path: str, pages: int = 1024) -> str:
+    """
+    Online copy through the sqlite3 backup API. Copying `pages` pages per
+    step lets writers get in between steps instead of waiting on a file copy.
+    """
+    src_path = sqlite_db_path()
+    if not src_path:
+        raise RuntimeError("backup_sqlite() only works for file-based SQLite databases")
+    os.makedirs(os.path.dirname(os.path.abspath(dest_path)), exist_ok=True)
+    with sqlite3.connect(src_path) as src, sqlite3.connect(dest_path) as dst:
+        src.backup(dst, pages=pages, sleep=0.005)
+    return dest_path
+
+
+def pending_migrations() -> list:
+    try:
+        done = {r[0] for r in db.session.execute(text("SELECT version FROM schema_version")).all()}
+    except OperationalError:
+        db.session.rollback()
+        done = set()
+    return [m for m in MIGRATIONS if m[0] not in done]
+
+
+def upgrade_db(backup: bool = True, log=lambda msg: None, fresh: Optional[bool] = None) -> list:
+    """
+    Applies pending migrations in order. Returns the versions applied.
+
+    A new file (no tables before the call, or `fresh` from bootstrap_db) gets
+    the current schema from the models and is stamped at every version
+    instead: released migrations are never edited, so they only make sense
+    replayed over the schema they were written against.
+    """
+    if fresh is None:
+        fresh = not inspect(db.engine).has_table("sale")
+    db.create_all()  # new tables (incl. schema_version) come from the models
+    todo = pending_migrations()
+    if not todo:
+        return []
+
+    if fresh:
+        # The FTS table and the derived-table triggers are all the models lack
+        rebuild_derived_tables()
+        for version, name, _fn in todo:
+            db.session.add(SchemaVersion(version=version, name=name, duration_ms=0.0))
+        db.session.commit()
+        log(f"New database, stamped at v{todo[-1][0]:03d}")
+        return [version for version, _name, _fn in todo]
+
+    if backup and sqlite_db_path():
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        dest = os.path.join(os.path.dirname(sqlite_db_path()), "backups", f"pre_upgrade_{stamp}.db")
+        backup_sqlite(dest)
+        log(f"Backup created -> {dest}")
+
+    applied = []
+    for version, name, fn in todo:
+        started = time.perf_counter()
+        fn()
+        db.session.add(SchemaVersion(
+            version=version,
+            name=name,
+            duration_ms=round((time.perf_counter() - started) * 1000, 1),
+        ))
+        db.session.commit()
+        applied.append(version)
+        log(f"v{version:03d} {name} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+    return applied
+
+
+@migration(1, "client_phone")
+def _m001_client_phone():
+    _add_column("client", "phone", "VARCHAR(20)")
+
+
+@migration(2, "client_opening_balance")
+def _m002_client_opening_balance():
+    _add_column("client", "opening_balance", "FLOAT NOT NULL DEFAULT 0.0")
+
+
+@migration(3, "sale_payment_collection_id")
+def _m003_sale_payment_collection_id():
+    _add_column("sale_payment", "collection_id", "INTEGER REFERENCES client_collection(id)")
+
+
+@migration(4, "sale_gst_split_and_totals")
+def _m004_sale_gst_split_and_totals():
+    added = False
+    for col in ("cgst_amount", "sgst_amount", "igst_amount"):
+        added = _add_column("sale", col, "FLOAT DEFAULT 0.0") or added
+    db.session.commit()
+    if added:
+        # Settlement (grand total) = raw selling subtotal + GST
+        backfill_in_batches("sale", """
+            subtotal = ROUND(COALESCE((SELECT SUM(selling_rate_per_kg * quantity_kg)
+                                       FROM sale_item WHERE sale_item.sale_id = sale.id), 0), 2),
+            grand_total = ROUND(COALESCE((SELECT SUM(selling_rate_per_kg * quantity_kg)
+                                          FROM sale_item WHERE sale_item.sale_id = sale.id), 0)
+                                + COALESCE(cgst_amount, 0) + COALESCE(sgst_amount, 0)
+                                + COALESCE(igst_amount, 0), 2)
+        """)
+
+
+@migration(5, "sale_item_gst_percent")
+def _m005_sale_item_gst_percent():
+    _add_column("sale_item", "gst_percent", "REAL NOT NULL DEFAULT 0.0")
+    db.session.commit()
+    # Copy the old invoice-level GST rate onto each line
+    backfill_in_batches(
+        "sale_item",
+        "gst_percent = COALESCE((SELECT gst_percent FROM sale WHERE sale.id = sale_item.sale_id), 0.0)",
+        "gst_percent = 0.0 OR gst_percent IS NULL",
+    )
+
+
+@migration(6, "item_product_links")
+def _m006_item_product_links():
+    _add_column("sale_item", "product_id", "INTEGER REFERENCES product(id)")
+    _add_column("purchase_item", "product_id", "INTEGER REFERENCES product(id)")
+
+
+@migration(7, "product_valuation_rate")
+def _m007_product_valuation_rate():
+    _add_column("product", "valuation_rate", "FLOAT DEFAULT 0.0 NOT NULL")
+
+
+@migration(8, "expense_employee_id")
+def _m008_expense_employee_id():
+    _add_column("expense", "employee_id", "INTEGER REFERENCES employee(id)")
+
+
+@migration(9, "purchase_payment_collection_id")
+def _m009_purchase_payment_collection_id():
+    _add_column("purchase_payment", "collection_id", "INTEGER REFERENCES vendor_collection(id)")
+
+
+@migration(10, "background_job")
+def _m010_background_job():
+    BackgroundJob.__table__.create(db.engine, checkfirst=True)
+
+
+@migration(11, "data_version")
+def _m011_data_version():
+    DataVersion.__table__.create(db.engine, checkfirst=True)
+
+
+@migration(12, "lead_updated_at")
+def _m012_lead_updated_at():
+    _add_column("lead", "updated_at", "DATETIME")
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_lead_updated_at ON lead (updated_at)"))
+    db.session.commit()
+    LeadTombstone.__table__.create(db.engine, checkfirst=True)
+    backfill_in_batches("lead", "updated_at = COALESCE(created_at, CURRENT_TIMESTAMP)", "updated_at IS NULL")
+
+
+@migration(13, "search_index")
+def _m013_search_index():
+    ensure_search_index(rebuild=True)
+
+
+@migration(14, "price_rollup")
+def _m014_price_rollup():
+    # Bucket recomputes walk party/date -> items; names match the model indexes
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS ix_sale_item_sale_id ON sale_item (sale_id)",
+        "CREATE INDEX IF NOT EXISTS ix_sale_item_product_id ON sale_item (product_id)",
+        "CREATE INDEX IF NOT EXISTS ix_purchase_item_purchase_id ON purchase_item (purchase_id)",
+        "CREATE INDEX IF NOT EXISTS ix_purchase_item_product_id ON purchase_item (product_id)",
+        "CREATE INDEX IF NOT EXISTS ix_sale_client_date ON sale (client_name, date)",
+        "CREATE INDEX IF NOT EXISTS ix_purchase_vendor_date ON purchase (vendor_name, date)",
+    ):
+        db.session.execute(text(ddl))
+    db.session.commit()
+    ensure_price_rollup(rebuild=True)
+
+
+@migration(15, "last_rate")
+def _m015_last_rate():
+    ensure_last_rate(rebuild=True)
+
+
+@migration(16, "payment_indexes")
+def _m016_payment_indexes():
+    # Open-balance sums and the statement "already posted" check
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS ix_sale_payment_sale_id ON sale_payment (sale_id)",
+        "CREATE INDEX IF NOT EXISTS ix_purchase_payment_purchase_id ON purchase_payment (purchase_id)",
+        "CREATE INDEX IF NOT EXISTS ix_client_collection_client_date ON client_collection (client_id, date)",
+        "CREATE INDEX IF NOT EXISTS ix_vendor_collection_vendor_date ON vendor_collection (vendor_name, date)",
+    ):
+        db.session.execute(text(ddl))
+    db.session.commit()
+
+
+@migration(17, "expense_date_index")
+def _m017_expense_date_index():
+    db.session.execute(text("CREATE INDEX IF NOT EXISTS ix_expense_date ON expense (date)"))
+    db.session.commit()
+
+
+@migration(18, "product_batch_unique")
+def _m018_product_batch_unique():
+    # Older code could leave two batches for one (product, rate), e.g. rates
+    # differing past the 4th decimal. Fold them into the lowest id (product
+    # totals don't change), then make the pair unique for the upserts.
+    for sql in (
+        "UPDATE product_batch SET rate = ROUND(rate, 4) WHERE rate != ROUND(rate, 4)",
+        """
+        UPDATE product_batch SET quantity_kg = (
+            SELECT ROUND(SUM(b.quantity_kg), 2) FROM product_batch b
+            WHERE b.product_id = product_batch.product_id AND b.rate = product_batch.rate)
+        WHERE id IN (SELECT MIN(id) FROM product_batch GROUP BY product_id, rate HAVING COUNT(*) > 1)
+        """,
+        "DELETE FROM product_batch WHERE id NOT IN (SELECT MIN(id) FROM product_batch GROUP BY product_id, rate)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_product_batch_product_rate ON product_batch (product_id, rate)",
+    ):
+        db.session.execute(text(sql))
+    db.session.commit()
+
+
+@migration(19, "integer_money")
+def _m019_integer_money():
+    # Float money / rate columns -> integer paise / rate x 10^4. New columns
+    # are backfilled in id batches, then the old ones dropped, which needs
+    # ALTER TABLE .. DROP COLUMN (SQLite 3.35+). The column list is the one
+    # this version shipped with; later conversions are their own migrations.
+    paise, rate = PAISE, RATE_SCALE
+    columns = {
+        "client": {"opening_balance": ("opening_balance_paise", paise)},
+        "sale": {name: (f"{name}_paise", paise) for name in (
+            "freight", "subtotal", "cgst_amount", "sgst_amount", "igst_amount", "misc_amount", "grand_total")},
+        "sale_item": {"cost_rate_per_kg": ("cost_rate_e4", rate), "selling_rate_per_kg": ("selling_rate_e4", rate)},
+        "sale_payment": {"amount": ("amount_paise", paise)},
+        "client_collection": {"amount": ("amount_paise", paise)},
+        "purchase": {name: (f"{name}_paise", paise) for name in (
+            "freight", "subtotal", "cgst_amount", "sgst_amount", "igst_amount", "grand_total")},
+        "purchase_item": {"rate_per_kg": ("rate_e4", rate)},
+        "purchase_payment": {"amount": ("amount_paise", paise)},
+        "vendor_collection": {"amount": ("amount_paise", paise)},
+        "expense": {"amount": ("amount_paise", paise)},
+        "product": {"valuation_rate": ("valuation_rate_e4", rate)},
+    }
+    todo = [(table, name, column, scale)
+            for table, cols in columns.items()
+            for name, (column, scale) in cols.items()
+            if _column_exists(table, name)]
+    if not todo:
+        return
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        raise RuntimeError(f"SQLite {sqlite3.sqlite_version} cannot drop columns; v19 needs 3.35 or newer")
+
+    # The rollup / last-rate triggers read the old rate columns and would
+    # block DROP COLUMN; search triggers would fire on every backfilled row.
+    drop_derived_triggers()
+    for table, name, column, scale in todo:
+        nullable = table == "sale_item" and name == "selling_rate_per_kg"
+        _add_column(table, column, "INTEGER" if nullable else "INTEGER NOT NULL DEFAULT 0")
+        db.session.commit()
+        value = name if nullable else f"COALESCE({name}, 0)"
+        backfill_in_batches(table, f"{column} = CAST(ROUND({value} * {scale}) AS INTEGER)")
+    for table, name, _column, _scale in todo:
+        db.session.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+    db.session.commit()
+
+    ensure_search_index()
+    ensure_price_rollup(rebuild=True)
+    ensure_last_rate(rebuild=True)
+
+
+@migration(20, "product_batch_rate_key")
+def _m020_product_batch_rate_key():
+    # Float batch rate -> integer rate_key (rate x 10^4, the item rate_e4
+    # scale), unique per product. Keys that collide after scaling are folded
+    # into the lowest id like v18 did.
+    if not _column_exists("product_batch", "rate"):
+        return
+    _add_column("product_batch", "rate_key", "INTEGER NOT NULL DEFAULT 0")
+    db.session.commit()
+    backfill_in_batches("product_batch", f"rate_key = CAST(ROUND(COALESCE(rate, 0) * {RATE_SCALE}) AS INTEGER)")
+    for sql in (
+        """
+        UPDATE product_batch SET quantity_kg = (
+            SELECT ROUND(SUM(b.quantity_kg), 2) FROM product_batch b
+            WHERE b.product_id = product_batch.product_id AND b.rate_key = product_batch.rate_key)
+        WHERE id IN (SELECT MIN(id) FROM product_batch GROUP BY product_id, rate_key HAVING COUNT(*) > 1)
+        """,
+        "DELETE FROM product_batch WHERE id NOT IN (SELECT MIN(id) FROM product_batch GROUP BY product_id, rate_key)",
+        "DROP INDEX IF EXISTS ux_product_batch_product_rate",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_product_batch_product_rate_key ON product_batch (product_id, rate_key)",
+        "ALTER TABLE product_batch DROP COLUMN rate",
+    ):
+        db.session.execute(text(sql))
+    db.session.commit()
+
+
+@migration(21, "costing_engine")
+def _m021_costing_engine():
+    # Per-product costing method, a stored stock value and FIFO receipt dates
+    # on the batches (sale_item_lot itself comes from create_all).
+    _add_column("product", "costing_method", "VARCHAR(8) NOT NULL DEFAULT 'manual'")
+    _add_column("product", "stock_value_paise", "INTEGER NOT NULL DEFAULT 0")
+    _add_column("product_batch", "received_on", "DATE")
+    db.session.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_product_batch_fifo ON product_batch (product_id, received_on, id)"
+    ))
+    db.session.commit()
+    # A batch was first received with the earliest purchase line at its rate
+    backfill_in_batches("product_batch", """
+        received_on = (SELECT MIN(p.date) FROM purchase_item i JOIN purchase p ON p.id = i.purchase_id
+                       WHERE i.product_id = product_batch.product_id AND i.rate_e4 = product_batch.rate_key)
+    """, "received_on IS NULL")
+    db.session.execute(text("""
+        UPDATE product SET stock_value_paise = COALESCE((
+            SELECT CAST(ROUND(SUM(quantity_kg * rate_key) / 100.0) AS INTEGER)
+            FROM product_batch WHERE product_id = product.id), 0)
+    """))
+    db.session.commit()
+
+
+@migration(22, "period_close")
+def _m022_period_close():
+    PeriodClose.__table__.create(db.engine, checkfirst=True)
+    ClosingBalance.__table__.create(db.engine, checkfirst=True)
+    # Open-period scans start at the close date for every party at once
+    for ddl in (
+        "CREATE INDEX IF NOT EXISTS ix_sale_date ON sale (date)",
+        "CREATE INDEX IF NOT EXISTS ix_purchase_date ON purchase (date)",
+        "CREATE INDEX IF NOT EXISTS ix_sale_payment_date ON sale_payment (date)",
+        "CREATE INDEX IF NOT EXISTS ix_purchase_payment_date ON purchase_payment (date)",
+    ):
+        db.session.execute(text(ddl))
+    db.session.commit()
+
+
+@migration(23, "integer_money_masters")
+def _m023_integer_money_masters():
+    # v19's conversion for the money it left as floats: salaries, bottle type
+    # prices and loans
+    columns = {
+        "employee": {"monthly_salary": ("monthly_salary_paise", PAISE)},
+        "bottle_type": {"can_price": ("can_price_paise", PAISE), "box_cost": ("box_cost_paise", PAISE),
+                        "selling_price_per_batch": ("selling_price_per_batch_paise", PAISE),
+                        "price_per_kg": ("price_per_kg_e4", RATE_SCALE)},
+        "loan": {"principal": ("principal_paise", PAISE)},
+        "loan_repayment": {"amount": ("amount_paise", PAISE)},
+    }
+    todo = [(table, name, column, scale)
+            for table, cols in columns.items()
+            for name, (column, scale) in cols.items()
+            if _column_exists(table, name)]
+    if not todo:
+        return
+    if sqlite3.sqlite_version_info < (3, 35, 0):
+        raise RuntimeError(f"SQLite {sqlite3.sqlite_version} cannot drop columns; v23 needs 3.35 or newer")
+
+    for table, name, column, scale in todo:
+        _add_column(table, column, "INTEGER NOT NULL DEFAULT 0")
+        db.session.commit()
+        backfill_in_batches(table, f"{column} = CAST(ROUND(COALESCE({name}, 0) * {scale}) AS INTEGER)")
+    for table, name, _column, _scale in todo:
+        db.session.execute(text(f"ALTER TABLE {table} DROP COLUMN {name}"))
+    db.session.commit()
+
+
+@migration(24, "batch_received_on_fallback")
+def _m024_batch_received_on_fallback():
+    # v21 dated a batch by the earliest purchase line at its rate and left the
+    # rest NULL. Those are opening stock: give them OPENING_STOCK_DATE so FIFO
+    # order is (received_on, id) with them first, by rule rather than by how
+    # SQLite happens to sort NULLs.
+    backfill_in_batches("product_batch", "received_on = :opening", "received_on IS NULL",
+                        {"opening": OPENING_STOCK_DATE.isoformat()})
+
+
+@migration(25, "search_label_triggers")
+def _m025_search_label_triggers():
+    # Renaming a sale's client, a purchase's vendor, a client or a location
+    # now re-labels the documents under it; re-index the labels left stale.
+    ensure_search_index(rebuild=True)
+
+
+def latest_schema_version() -> int:
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
 
 # -----------------------------------------------------------------------------
 # Small helpers
@@ -543,7 +1934,8 @@ def sale_item_actual_kg(item: SaleItem) -> float:
 
     # Bottle sale
     if item.bottle_type_id:
-        bt = BottleType.query.get(item.bottle_type_id)
+        # Many-to-one: served from the identity map / joinedload, no query per row
+        bt = item.bottle_type
         if not bt:
             return 0.0
         return (
@@ -564,79 +1956,1869 @@ def _to_float(value, default: float = 0.0) -> float:
         return default
 
 
-def _to_int(value, default: int = 0) -> int:
+def _to_int(value, default: int = 0) -> int:
+    try:
+        return int(float(value))
+    except Exception:
+        return default
+
+
+def _parse_date(date_str: str) -> datetime.date:
+    return datetime.strptime(date_str, "%Y-%m-%d").date()
+
+
+def _as_date(value) -> date:
+    # Raw text() queries hand SQLite dates back as strings
+    return value if isinstance(value, date) else datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def to_kg(quantity: float, unit: str) -> float:
+    q = _to_float(quantity, 0.0)
+    if (unit or "").strip().lower() == "ton":
+        return q * KG_PER_TON
+    return q
+
+
+def commit_or_rollback():
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def purchase_form_lines(form) -> list:
+    """PurchaseItem field dicts from the purchase form; rows without qty or rate are skipped."""
+    qty_list = form.getlist("quantity[]")
+    rate_list = form.getlist("rate[]")
+    prod_id_list = form.getlist("product_id[]")
+    line_id_list = form.getlist("line_id[]")
+
+    lines = []
+    for i in range(min(len(qty_list), len(rate_list))):
+        q = qty_list[i]
+        r = rate_list[i]
+        p_id = prod_id_list[i] if i < len(prod_id_list) else ""
+        if q and r:
+            lines.append({
+                "id": _to_int(line_id_list[i] if i < len(line_id_list) else "", 0) or None,
+                "product_id": int(p_id) if (p_id and p_id.strip()) else None,
+                "quantity_kg": float(q),
+                "rate_per_kg": float(r),
+            })
+    return lines
+
+
+# Per-invoice totals in SQL, mirroring Sale.total_amount() / Purchase.total_cost()
+# (grand_total when set, else the item sum) and total_received() / total_paid().
+# Sums run on the integer columns; total / paid are rupees for display and
+# total_paise / paid_paise are what balances and statuses compare.
+SALE_TOTALS_SQL = """
+    SELECT id, party, date, total_paise / 100.0 AS total, paid_paise / 100.0 AS paid,
+           total_paise, paid_paise
+    FROM (
+        SELECT s.id, s.client_name AS party, s.date,
+               CASE WHEN s.grand_total_paise > 0 THEN s.grand_total_paise
+                    ELSE COALESCE(it.sp, 0) END AS total_paise,
+               COALESCE(pay.paid, 0) AS paid_paise
+        FROM sale s
+        LEFT JOIN (SELECT sale_id, CAST(ROUND(SUM(COALESCE(selling_rate_e4, 0) * quantity_kg) / 100.0) AS INTEGER) AS sp
+                   FROM sale_item GROUP BY sale_id) it ON it.sale_id = s.id
+        LEFT JOIN (SELECT sale_id, SUM(amount_paise) AS paid
+                   FROM sale_payment GROUP BY sale_id) pay ON pay.sale_id = s.id
+    )
+"""
+PURCHASE_TOTALS_SQL = """
+    SELECT id, party, date, total_paise / 100.0 AS total, paid_paise / 100.0 AS paid,
+           total_paise, paid_paise
+    FROM (
+        SELECT p.id, p.vendor_name AS party, p.date,
+               CASE WHEN p.grand_total_paise > 0 THEN p.grand_total_paise
+                    ELSE COALESCE(it.cost, 0) + p.freight_paise END AS total_paise,
+               COALESCE(pay.paid, 0) AS paid_paise
+        FROM purchase p
+        LEFT JOIN (SELECT purchase_id, CAST(ROUND(SUM(rate_e4 * quantity_kg) / 100.0) AS INTEGER) AS cost
+                   FROM purchase_item GROUP BY purchase_id) it ON it.purchase_id = p.id
+        LEFT JOIN (SELECT purchase_id, SUM(amount_paise) AS paid
+                   FROM purchase_payment GROUP BY purchase_id) pay ON pay.purchase_id = p.id
+    )
+"""
+
+# Purchases older than this many days with a balance count as overdue.
+VENDOR_CREDIT_DAYS = int(os.environ.get("VENDOR_CREDIT_DAYS", "30"))
+
+
+def purchase_balances(vendors=None, status: Optional[str] = None) -> list:
+    """
+    One row per purchase (newest first) with total, paid, balance and
+    status - Purchase.payment_status() without loading items / payments.
+    `status` is "paid", "unpaid", "partial" or "pending" (unpaid + partial).
+    """
+    sql = f"SELECT * FROM ({PURCHASE_TOTALS_SQL}) t"
+    where, params = [], {}
+    if vendors:
+        names = list(vendors)
+        where.append("party IN (" + ", ".join(f":v{i}" for i in range(len(names))) + ")")
+        params.update({f"v{i}": n for i, n in enumerate(names)})
+    status_sql = {
+        "paid": "paid_paise != 0 AND total_paise <= paid_paise",
+        "unpaid": "paid_paise = 0",
+        "partial": "paid_paise != 0 AND total_paise > paid_paise",
+        "pending": "(paid_paise = 0 OR total_paise > paid_paise)",
+    }.get(status)
+    if status_sql:
+        where.append(status_sql)
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY date DESC, id DESC"
+
+    rows = []
+    for r in db.session.execute(text(sql), params).mappings():
+        balance = r["total_paise"] - r["paid_paise"]
+        rows.append({
+            "id": r["id"], "vendor_name": r["party"], "date": _as_date(r["date"]),
+            "total": r["total"], "paid": r["paid"], "balance": balance / PAISE,
+            "status": "Unpaid" if r["paid_paise"] == 0 else ("Partial" if balance > 0 else "Paid"),
+        })
+    return rows
+
+
+def vendor_balances(vendors=None, as_of: Optional[date] = None, overdue_days: int = VENDOR_CREDIT_DAYS) -> dict:
+    """
+    {vendor: {brought_forward, total_purchase, total_paid, unallocated,
+    balance, overdue, open_bills}} sorted by vendor name. Only rows dated
+    after the last period close are read; what was owed at the close comes
+    in as brought_forward (see close_period).
+
+    Matches the vendor ledger: paid is direct purchase payments plus every
+    VendorCollection in full, so collection money not yet linked to a bill
+    (unallocated) still reduces what we owe. Unallocated credit is set
+    against the oldest dues first when working out the overdue amount; the
+    brought-forward payable, less what has since been paid on bills from
+    before the close, counts as overdue once the close is older than the
+    credit window.
+    """
+    as_of = as_of or date.today()
+    cutoff = as_of - timedelta(days=overdue_days)
+    names = list(vendors) if vendors else None
+    close = last_close()
+    since = close.as_of if close else None
+
+    def vendor_filter(col):
+        if not names:
+            return "", {}
+        return (f" AND {col} IN (" + ", ".join(f":v{i}" for i in range(len(names))) + ")",
+                {f"v{i}": n for i, n in enumerate(names)})
+
+    report = {}
+
+    def entry(vendor):
+        return report.setdefault(vendor, {
+            "brought_forward": 0, "total_purchase": 0, "total_paid": 0, "unallocated": 0,
+            "balance": 0, "overdue": 0, "open_bills": 0,
+        })
+
+    for vendor, amount in closing_amounts(close, "vendor", names).items():
+        entry(vendor)["brought_forward"] = amount
+    for vendor, (billed, paid) in party_movements("vendor", since, parties=names).items():
+        e = entry(vendor)
+        e["total_purchase"] = billed
+        e["total_paid"] = paid
+
+    cond, params = vendor_filter("party")
+    for vendor, open_bills, overdue in db.session.execute(text(f"""
+        SELECT party, SUM(CASE WHEN total_paise > paid_paise THEN 1 ELSE 0 END),
+               SUM(CASE WHEN date <= :cutoff AND total_paise > paid_paise THEN total_paise - paid_paise ELSE 0 END)
+        FROM ({_BILL_SQL['vendor']}) t WHERE 1 = 1{cond}
+        GROUP BY party
+    """), dict(params, cutoff=cutoff.isoformat(), **_period_params(since))):
+        e = entry(vendor)
+        e["open_bills"] = open_bills or 0
+        e["overdue"] = overdue or 0
+
+    # Collections: the part not linked to any purchase payment is credit on account
+    cond, params = vendor_filter("vc.vendor_name")
+    for vendor, amount, allocated in db.session.execute(text(f"""
+        SELECT vc.vendor_name, SUM(vc.amount_paise), SUM(COALESCE(linked.amount, 0))
+        FROM vendor_collection vc
+        LEFT JOIN (SELECT collection_id, SUM(amount_paise) AS amount FROM purchase_payment
+                   WHERE collection_id IS NOT NULL GROUP BY collection_id) linked
+               ON linked.collection_id = vc.id
+        WHERE vc.date > :since{cond}
+        GROUP BY vc.vendor_name
+    """), dict(params, **_period_params(since))):
+        entry(vendor)["unallocated"] = (amount or 0) - (allocated or 0)
+
+    # Payments since the close on bills from before it settle brought_forward
+    settled = {}
+    if close:
+        cond, params = vendor_filter("p.vendor_name")
+        settled = dict(db.session.execute(text(f"""
+            SELECT p.vendor_name, SUM(pp.amount_paise)
+            FROM purchase_payment pp JOIN purchase p ON p.id = pp.purchase_id
+            WHERE pp.date > :since AND p.date <= :since{cond}
+            GROUP BY p.vendor_name
+        """), dict(params, **_period_params(since))).all())
+
+    # Everything above is paise; convert once at the end
+    for vendor, e in report.items():
+        e["balance"] = e["brought_forward"] + e["total_purchase"] - e["total_paid"]
+        if close and close.as_of <= cutoff:
+            e["overdue"] += max(e["brought_forward"] - (settled.get(vendor) or 0), 0)
+        e["overdue"] = min(max(e["overdue"] - max(e["unallocated"], 0), 0), max(e["balance"], 0))
+        for k in ("brought_forward", "total_purchase", "total_paid", "unallocated", "balance", "overdue"):
+            e[k] = e[k] / PAISE
+    return dict(sorted(report.items()))
+
+
+def get_vendor_dues():
+    return vendor_balances()
+
+
+def get_sales_outstanding():
+    """
+    {client: {brought_forward, total_sales, total_received, balance, phone,
+    opening_balance}} for clients with a balance, from the last close on.
+    Received is direct receipts plus every collection in full, as in the
+    client ledger.
+    """
+    close = last_close()
+    carried = closing_amounts(close, "client")
+    moves = party_movements("client", close.as_of if close else None)
+    report = {}
+
+    for c in Client.query.order_by(Client.name).all():
+        billed, received = moves.get(c.name, (0, 0))
+        brought_forward = carried.get(c.name, 0)
+        # Balance = Opening Balance + B/F + Sales - Received (positive is receivable)
+        balance = (c.opening_balance_paise or 0) + brought_forward + billed - received
+
+        if balance != 0:
+            report[c.name] = {
+                "brought_forward": brought_forward / PAISE,
+                "total_sales": billed / PAISE,
+                "total_received": received / PAISE,
+                "balance": round(balance / PAISE, 2),
+                "phone": c.phone,
+                "opening_balance": c.opening_balance
+            }
+
+    return report
+
+# -----------------------------------------------------------------------------
+# Period close (carry-forward balances)
+# -----------------------------------------------------------------------------
+# close_period(as_of) freezes everything dated on or before `as_of` into
+# closing_balance rows: client receivable and vendor payable per party,
+# stock per product and batch, and loan outstanding. The party ledger, the
+# product stock ledger and the balance queries start from the last close and
+# only read rows dated after it, so their cost follows the open period, not
+# the whole history. Party figures leave out the client opening balance,
+# which stays a live undated field. Writes dated into a closed period are
+# refused at flush time, which keeps the carried figures true.
+
+
+class PeriodClosedError(ValueError):
+    """A write touched a row dated on or before the last period close."""
+
+
+# Per-bill total and paid, bills dated in (:since, :until]; lookups per bill
+# instead of SALE_TOTALS_SQL's whole-table GROUP BYs
+_BILL_SQL = {
+    "client": """
+        SELECT s.id, s.client_name AS party, s.date,
+               CASE WHEN s.grand_total_paise > 0 THEN s.grand_total_paise
+                    ELSE COALESCE((SELECT CAST(ROUND(SUM(COALESCE(i.selling_rate_e4, 0) * i.quantity_kg) / 100.0) AS INTEGER)
+                                   FROM sale_item i WHERE i.sale_id = s.id), 0) END AS total_paise,
+               COALESCE((SELECT SUM(amount_paise) FROM sale_payment WHERE sale_id = s.id), 0) AS paid_paise
+        FROM sale s WHERE s.date > :since AND s.date <= :until
+    """,
+    "vendor": """
+        SELECT p.id, p.vendor_name AS party, p.date,
+               CASE WHEN p.grand_total_paise > 0 THEN p.grand_total_paise
+                    ELSE COALESCE((SELECT CAST(ROUND(SUM(i.rate_e4 * i.quantity_kg) / 100.0) AS INTEGER)
+                                   FROM purchase_item i WHERE i.purchase_id = p.id), 0) + p.freight_paise END AS total_paise,
+               COALESCE((SELECT SUM(amount_paise) FROM purchase_payment WHERE purchase_id = p.id), 0) AS paid_paise
+        FROM purchase p WHERE p.date > :since AND p.date <= :until
+    """,
+}
+
+# Money in against a party: payments not made through a collection, and
+# collections in full (dated rows only, like the bills above)
+_RECEIPTS_SQL = {
+    "client": """
+        SELECT s.client_name AS party, sp.amount_paise AS amount
+        FROM sale_payment sp JOIN sale s ON s.id = sp.sale_id
+        WHERE sp.collection_id IS NULL AND sp.date > :since AND sp.date <= :until
+        UNION ALL
+        SELECT c.name, cc.amount_paise
+        FROM client_collection cc JOIN client c ON c.id = cc.client_id
+        WHERE cc.date > :since AND cc.date <= :until
+    """,
+    "vendor": """
+        SELECT p.vendor_name AS party, pp.amount_paise AS amount
+        FROM purchase_payment pp JOIN purchase p ON p.id = pp.purchase_id
+        WHERE pp.collection_id IS NULL AND pp.date > :since AND pp.date <= :until
+        UNION ALL
+        SELECT vc.vendor_name, vc.amount_paise
+        FROM vendor_collection vc
+        WHERE vc.date > :since AND vc.date <= :until
+    """,
+}
+
+
+def _period_params(since: Optional[date] = None, until: Optional[date] = None) -> dict:
+    # Dates are ISO text in SQLite; "" sorts before every date
+    return {"since": since.isoformat() if since else "", "until": (until or date.max).isoformat()}
+
+
+def last_close(before: Optional[date] = None) -> Optional[PeriodClose]:
+    """The latest close, or the latest one dated before `before` (a report window's start)."""
+    query = PeriodClose.query
+    if before is not None:
+        query = query.filter(PeriodClose.as_of < before)
+    return query.order_by(PeriodClose.as_of.desc()).first()
+
+
+def closed_through(session=None) -> Optional[date]:
+    """Date of the last close (None if the books were never closed)."""
+    try:
+        value = (session or db.session).execute(text("SELECT MAX(as_of) FROM period_close")).scalar()
+    except OperationalError:
+        return None   # before v22
+    return _as_date(value) if value else None
+
+
+def closing_amounts(close: Optional[PeriodClose], kind: str, parties=None) -> dict:
+    """{party: paise} carried forward by `close` for "client" or "vendor"."""
+    if close is None:
+        return {}
+    query = db.session.query(ClosingBalance.party, ClosingBalance.amount_paise).filter_by(close_id=close.id, kind=kind)
+    if parties:
+        query = query.filter(ClosingBalance.party.in_(list(parties)))
+    return dict(query.all())
+
+
+def party_movements(kind: str, since: Optional[date] = None, until: Optional[date] = None, parties=None) -> dict:
+    """
+    {party: (billed, paid)} in paise over rows dated in (since, until] -
+    the same figures the party ledger shows for those dates. `kind` is
+    "client" or "vendor".
+    """
+    names = list(parties) if parties else []
+    cond = ""
+    if names:
+        cond = " AND party IN (" + ", ".join(f":p{i}" for i in range(len(names))) + ")"
+    sql = f"""
+        SELECT party, SUM(billed), SUM(paid) FROM (
+            SELECT party, total_paise AS billed, 0 AS paid FROM ({_BILL_SQL[kind]})
+            UNION ALL
+            SELECT party, 0, amount FROM ({_RECEIPTS_SQL[kind]})
+        ) m WHERE 1 = 1{cond}
+        GROUP BY party
+    """
+    params = dict(_period_params(since, until), **{f"p{i}": n for i, n in enumerate(names)})
+    return {party: (billed or 0, paid or 0) for party, billed, paid in db.session.execute(text(sql), params)}
+
+
+def stock_as_of(as_of: date) -> dict:
+    """
+    {(product_id, rate_key): kg} held at the end of `as_of`: today's batches
+    with the purchase and sale lines dated after it taken back out. Sale
+    lines the costing engine allocated go back to the lots they took.
+    """
+    held = {(pid, key): kg for pid, key, kg in
+            db.session.query(ProductBatch.product_id, ProductBatch.rate_key, ProductBatch.quantity_kg)}
+    params = {"as_of": as_of.isoformat()}
+    moves = (
+        (-1, """SELECT i.product_id, i.rate_e4, SUM(i.quantity_kg)
+                FROM purchase_item i JOIN purchase p ON p.id = i.purchase_id
+                WHERE p.date > :as_of AND i.product_id IS NOT NULL GROUP BY 1, 2"""),
+        (+1, """SELECT i.product_id, i.cost_rate_e4, SUM(i.quantity_kg)
+                FROM sale_item i JOIN sale s ON s.id = i.sale_id
+                WHERE s.date > :as_of AND i.product_id IS NOT NULL
+                  AND NOT EXISTS (SELECT 1 FROM sale_item_lot l WHERE l.sale_item_id = i.id)
+                GROUP BY 1, 2"""),
+        (+1, """SELECT l.product_id, l.rate_key, SUM(l.quantity_kg)
+                FROM sale_item_lot l JOIN sale_item i ON i.id = l.sale_item_id JOIN sale s ON s.id = i.sale_id
+                WHERE s.date > :as_of GROUP BY 1, 2"""),
+    )
+    for sign, sql in moves:
+        for pid, key, kg in db.session.execute(text(sql), params):
+            held[(pid, key or 0)] = held.get((pid, key or 0), 0.0) + sign * (kg or 0.0)
+    return {k: round(kg, 4) for k, kg in held.items() if abs(kg) > 1e-9}
+
+
+def close_period(as_of: date, notes: Optional[str] = None) -> PeriodClose:
+    """
+    Closes the books up to and including `as_of`. Party balances roll on
+    from the previous close, reading only the rows in between; stock is
+    worked back from the live batches (stock_as_of). The caller commits.
+    """
+    prev = last_close()
+    if prev and as_of <= prev.as_of:
+        raise PeriodClosedError(f"Books are already closed up to {prev.as_of:%d-%b-%Y}")
+    if as_of >= date.today():
+        raise ValueError("Only a date before today can be closed")
+
+    close = PeriodClose(as_of=as_of, notes=notes or None)
+    db.session.add(close)
+
+    for kind in ("client", "vendor"):
+        amounts = closing_amounts(prev, kind)
+        for party, (billed, paid) in party_movements(kind, prev.as_of if prev else None, as_of).items():
+            amounts[party] = amounts.get(party, 0) + billed - paid
+        close.balances.extend(ClosingBalance(kind=kind, party=party, amount_paise=amount)
+                              for party, amount in sorted(amounts.items()) if amount)
+
+    products = {}
+    for (pid, key), kg in sorted(stock_as_of(as_of).items()):
+        # kg x (rupees x 10^4) / 100 = paise, as in _sync_product_totals
+        value = round(kg * key / 100)
+        close.balances.append(ClosingBalance(kind="batch", ref_id=pid, rate_key=key,
+                                             quantity_kg=kg, amount_paise=value))
+        qty, total = products.get(pid, (0.0, 0))
+        products[pid] = (qty + kg, total + value)
+    close.balances.extend(ClosingBalance(kind="product", ref_id=pid, quantity_kg=round(qty, 4), amount_paise=total)
+                          for pid, (qty, total) in products.items())
+
+    repaid = dict(db.session.execute(text(
+        "SELECT loan_id, SUM(amount_paise) FROM loan_repayment WHERE date <= :as_of GROUP BY loan_id"
+    ), {"as_of": as_of.isoformat()}).all())
+    for loan in Loan.query.filter(Loan.date_issued <= as_of).order_by(Loan.id):
+        outstanding = loan.principal_paise + to_paise(loan.interest_accrued(as_of)) - (repaid.get(loan.id) or 0)
+        if outstanding:
+            close.balances.append(ClosingBalance(kind="loan", ref_id=loan.id, party=loan.party_name,
+                                                 amount_paise=outstanding))
+
+    # Ledgers and balances change shape (b/f rows) even though no row did
+    bump_data_version(db.session, ["sales", "purchases", "stock", "loans"])
+    return close
+
+
+def reopen_last_close() -> Optional[PeriodClose]:
+    """Drops the latest close (its period opens for edits again). The caller commits."""
+    close = last_close()
+    if close is not None:
+        db.session.delete(close)
+        bump_data_version(db.session, ["sales", "purchases", "stock", "loans"])
+    return close
+
+
+# Dated rows decide their own period; lines follow their bill
+_CLOSED_PERIOD_PARENTS = {SaleItem: (Sale, "sale_id", "sale"), PurchaseItem: (Purchase, "purchase_id", "purchase")}
+_CLOSED_PERIOD_DATED = (Sale, Purchase, SalePayment, PurchasePayment,
+                        ClientCollection, VendorCollection, LoanRepayment)
+
+
+def _closed_period_targets(session, obj) -> list:
+    """The dated rows a pending change to `obj` belongs to."""
+    if type(obj) not in _CLOSED_PERIOD_PARENTS:
+        return [obj]
+    parent_model, fk, rel = _CLOSED_PERIOD_PARENTS[type(obj)]
+    # A line dropped from its bill (delete-orphan) has lost the relationship
+    # but still carries the key; a line moved between bills counts for both
+    ids = {i for i in (getattr(obj, fk), *inspect(obj).attrs[fk].history.deleted) if i}
+    parents = [session.get(parent_model, i) for i in ids]
+    return [p for p in parents + [getattr(obj, rel)] if p is not None]
+
+
+@event.listens_for(OrmSession, "before_flush")
+def _refuse_closed_period_writes(session, flush_context, instances):
+    dates = []
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if obj in session.dirty and not session.is_modified(obj, include_collections=False):
+            continue
+        for target in _closed_period_targets(session, obj):
+            if isinstance(target, _CLOSED_PERIOD_DATED):
+                # A date moved out of (or into) a closed period counts on both sides
+                dates.extend(d for d in (target.date, *inspect(target).attrs.date.history.deleted) if d)
+    if not dates:
+        return
+    through = closed_through(session)
+    if through and min(_as_date(d) for d in dates) <= through:
+        raise PeriodClosedError(
+            f"Books are closed up to {through:%d-%b-%Y}; entries dated on or before it can't be changed"
+        )
+
+# -----------------------------------------------------------------------------
+# Expense analysis (grouped SQL)
+# -----------------------------------------------------------------------------
+# One GROUP BY (month, category, mode) over an ix_expense_date range scan
+# feeds the whole report; the month list is a DISTINCT over the same index.
+# Nothing here loads Expense rows.
+EXPENSE_MAX_MONTHS = 24
+
+
+def _month_start(ym: str) -> date:
+    return datetime.strptime(ym, "%Y-%m").date()
+
+
+def _shift_month(ym: str, n: int) -> str:
+    d = _month_start(ym)
+    y, m = divmod(d.year * 12 + d.month - 1 + n, 12)
+    return f"{y:04d}-{m + 1:02d}"
+
+
+def expense_months() -> list:
+    """Distinct YYYY-MM values with expenses, newest first."""
+    return db.session.execute(text(
+        "SELECT DISTINCT substr(date, 1, 7) AS m FROM expense ORDER BY m DESC"
+    )).scalars().all()
+
+
+def expense_summary(month_from: str, month_to: Optional[str] = None) -> dict:
+    """
+    Category totals / counts / mode splits for month_from..month_to, each
+    category's change against the previous period of the same length, and
+    a month x category grid with month-over-month deltas.
+    """
+    month_to = month_to or month_from
+    if _month_start(month_to) < _month_start(month_from):
+        month_from, month_to = month_to, month_from
+    month_from = max(month_from, _shift_month(month_to, 1 - EXPENSE_MAX_MONTHS))
+    months = [month_from]
+    while months[-1] < month_to:
+        months.append(_shift_month(months[-1], 1))
+    prev_from = _shift_month(month_from, -len(months))
+
+    rows = db.session.execute(text("""
+        SELECT substr(date, 1, 7) AS month, category, COALESCE(NULLIF(mode, ''), 'Other') AS mode,
+               SUM(amount_paise) AS amount, COUNT(*) AS n
+        FROM expense
+        WHERE date >= :lo AND date < :hi
+        GROUP BY month, category, mode
+    """), {
+        "lo": _month_start(prev_from).isoformat(),
+        "hi": _month_start(_shift_month(month_to, 1)).isoformat(),
+    }).all()
+
+    # Sums are kept in paise and converted to rupees on the way out
+    categories, modes, grid = {}, {}, {}
+    prev_total = 0
+    for month, category, mode, amount, n in rows:
+        amount = amount or 0
+        grid.setdefault(category, {})
+        grid[category][month] = grid[category].get(month, 0) + amount
+        if month < month_from:
+            prev_total += amount
+            categories.setdefault(category, {"amount": 0, "count": 0, "prev_amount": 0, "modes": {}})
+            categories[category]["prev_amount"] += amount
+            continue
+        c = categories.setdefault(category, {"amount": 0, "count": 0, "prev_amount": 0, "modes": {}})
+        c["amount"] += amount
+        c["count"] += n
+        c["modes"][mode] = c["modes"].get(mode, 0) + amount
+        modes[mode] = modes.get(mode, 0) + amount
+
+    total = sum(c["amount"] for c in categories.values())
+    for c in categories.values():
+        c["pct"] = (c["amount"] / total * 100) if total > 0 else 0
+        c["delta_pct"] = ((c["amount"] - c["prev_amount"]) / c["prev_amount"] * 100) if c["prev_amount"] else None
+        c["delta"] = (c["amount"] - c["prev_amount"]) / PAISE
+        c["amount"] /= PAISE
+        c["prev_amount"] /= PAISE
+        c["modes"] = {k: v / PAISE for k, v in c["modes"].items()}
+    report = dict(sorted(
+        ((k, v) for k, v in categories.items() if v["amount"] or v["prev_amount"]),
+        key=lambda kv: (-kv[1]["amount"], -kv[1]["prev_amount"], kv[0]),
+    ))
+
+    # Month x category, each cell with its change from the month before
+    # (the month before month_from is already in `grid`).
+    monthly = {}
+    for category in report:
+        cells = []
+        for m in months:
+            amount = grid.get(category, {}).get(m, 0)
+            before = grid.get(category, {}).get(_shift_month(m, -1), 0)
+            cells.append({"month": m, "amount": amount / PAISE, "delta": (amount - before) / PAISE})
+        monthly[category] = cells
+    month_totals = []
+    for m in months:
+        amount = sum(g.get(m, 0) for g in grid.values())
+        before = sum(g.get(_shift_month(m, -1), 0) for g in grid.values())
+        month_totals.append({"month": m, "amount": amount / PAISE, "delta": (amount - before) / PAISE})
+
+    return {
+        "months": months,
+        "report": report,
+        "total": total / PAISE,
+        "prev_from": prev_from,
+        "prev_to": _shift_month(month_from, -1),
+        "prev_total": prev_total / PAISE,
+        "modes": {k: v / PAISE for k, v in sorted(modes.items(), key=lambda kv: -kv[1])},
+        "monthly": monthly,
+        "month_totals": month_totals,
+    }
+
+
+# -----------------------------------------------------------------------------
+# Data versions + conditional GET (ETag / 304)
+# -----------------------------------------------------------------------------
+# Table -> entity group. Any committed write to a table bumps its group's
+# counter, and cached pages are keyed on the counters of the groups they read.
+DATA_GROUPS = {
+    "client": "sales",
+    "sale": "sales",
+    "sale_item": "sales",
+    "sale_payment": "sales",
+    "client_collection": "sales",
+    "purchase": "purchases",
+    "purchase_item": "purchases",
+    "purchase_payment": "purchases",
+    "vendor_collection": "purchases",
+    "product": "stock",
+    "product_batch": "stock",
+    "sale_item_lot": "stock",
+    "expense": "expenses",
+    "expense_category": "expenses",
+    "employee": "expenses",
+    "lead": "leads",
+    "location": "leads",
+    "loan": "loans",
+    "loan_repayment": "loans",
+    "bottle_type": "masters",
+}
+
+_BUMP_SQL = text("""
+    INSERT INTO data_version (grp, version, updated_at) VALUES (:grp, 1, :now)
+    ON CONFLICT(grp) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at
+""")
+
+
+def bump_data_version(session, groups) -> None:
+    now = datetime.utcnow()
+    conn = session.connection()
+    for grp in sorted(set(groups)):
+        conn.execute(_BUMP_SQL, {"grp": grp, "now": now})
+
+
+@event.listens_for(OrmSession, "after_flush")
+def _bump_versions_on_flush(session, flush_context):
+    touched = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, "__tablename__", None)
+        if table in DATA_GROUPS and (obj not in session.dirty or session.is_modified(obj)):
+            touched.add(DATA_GROUPS[table])
+    if touched:
+        bump_data_version(session, touched)
+
+
+@event.listens_for(OrmSession, "do_orm_execute")
+def _bump_versions_on_bulk(orm_execute_state):
+    # Query.delete() / update() and insert() upserts skip the flush, so catch them here.
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    mapper = orm_execute_state.bind_mapper
+    table = mapper.local_table.name if mapper is not None else None
+    if table in DATA_GROUPS:
+        bump_data_version(orm_execute_state.session, [DATA_GROUPS[table]])
+
+
+def data_versions(groups) -> list:
+    rows = DataVersion.query.filter(DataVersion.grp.in_(list(groups))).all()
+    return sorted((r.grp, r.version, r.updated_at) for r in rows)
+
+
+def conditional_get(*groups):
+    """
+    Wraps a GET view with a strong ETag built from the data versions of
+    `groups`, the full URL and today's date (aging / interest depend on it).
+    A matching If-None-Match gets a 304 before the view runs at all.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            # Pages carrying one-off flash messages must always render
+            if request.method != "GET" or session.get("_flashes"):
+                return view(*args, **kwargs)
+
+            versions = data_versions(groups)
+            etag = hashlib.sha1(repr((
+                request.full_path,
+                [(g, v) for g, v, _ in versions],
+                date.today().isoformat(),
+            )).encode()).hexdigest()
+            last_modified = max((u for _, _, u in versions if u), default=None)
+
+            if request.if_none_match.contains(etag):
+                resp = make_response("", 304)
+            else:
+                resp = make_response(view(*args, **kwargs))
+                if resp.status_code != 200:
+                    return resp
+            resp.set_etag(etag)
+            if last_modified:
+                resp.last_modified = last_modified
+            resp.cache_control.private = True
+            resp.cache_control.no_cache = True
+            return resp
+
+        wrapper.data_groups = groups
+        return wrapper
+    return decorator
+
+
+# -----------------------------------------------------------------------------
+# Full-text search (SQLite FTS5)
+# -----------------------------------------------------------------------------
+# One FTS5 table over leads, clients and payment / collection notes, kept in
+# sync by triggers. rowid = source id * 8 + kind code, so a trigger replaces a
+# document with a rowid lookup instead of scanning the index.
+SEARCH_KINDS = {
+    1: "lead",
+    2: "client",
+    3: "sale_payment",
+    4: "purchase_payment",
+    5: "client_collection",
+    6: "vendor_collection",
+}
+SEARCH_KIND_CODES = {v: k for k, v in SEARCH_KINDS.items()}
+
+# kind -> (title, body, label) SQL expressions over the source row `r`
+_SEARCH_SOURCES = {
+    "lead": (
+        "r.name",
+        "COALESCE(r.comments, '') || ' ' || COALESCE(r.address, '')",
+        "(SELECT name FROM location WHERE id = r.location_id)",
+    ),
+    "client": (
+        "r.name",
+        "COALESCE(r.address, '') || ' ' || COALESCE(r.gst, '') || ' ' || COALESCE(r.phone, '')",
+        "NULL",
+    ),
+    "sale_payment": ("''", "r.notes", "(SELECT client_name FROM sale WHERE id = r.sale_id)"),
+    "purchase_payment": ("''", "r.notes", "(SELECT vendor_name FROM purchase WHERE id = r.purchase_id)"),
+    "client_collection": ("''", "r.notes", "(SELECT name FROM client WHERE id = r.client_id)"),
+    "vendor_collection": ("''", "r.notes", "r.vendor_name"),
+}
+# kind -> (parent table, column shown as the label, foreign key on the kind)
+_SEARCH_PARENTS = {
+    "lead": ("location", "name", "location_id"),
+    "sale_payment": ("sale", "client_name", "sale_id"),
+    "purchase_payment": ("purchase", "vendor_name", "purchase_id"),
+    "client_collection": ("client", "name", "client_id"),
+}
+# Payments only get a document when they carry notes
+_SEARCH_WHERE = {k: "COALESCE(r.notes, '') <> ''" for k in _SEARCH_SOURCES if k not in ("lead", "client")}
+
+_SEARCH_HL = ("\x02", "\x03")   # highlight markers, swapped for <mark> after escaping
+
+
+def _search_insert_sql(kind: str, row: str) -> str:
+    title, body, label = (e.replace("r.", f"{row}.") for e in _SEARCH_SOURCES[kind])
+    where = _SEARCH_WHERE.get(kind, "1 = 1").replace("r.", f"{row}.")
+    code = SEARCH_KIND_CODES[kind]
+    select = f"SELECT {row}.id * 8 + {code}, {title}, {body}, {label}, {code}, {row}.id"
+    if row == "r":
+        return f"INSERT INTO search_index (rowid, title, body, label, kind, ref_id) {select} FROM {kind} r WHERE {where}"
+    return f"INSERT INTO search_index (rowid, title, body, label, kind, ref_id) {select} WHERE {where}"
+
+
+def ensure_search_index(rebuild: bool = False) -> None:
+    """Creates the FTS5 table and its triggers; `rebuild` re-indexes every row."""
+    db.session.execute(text("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+            title, body, label UNINDEXED, kind UNINDEXED, ref_id UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    """))
+    for kind, code in SEARCH_KIND_CODES.items():
+        delete = f"DELETE FROM search_index WHERE rowid = old.id * 8 + {code};"
+        db.session.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS {kind}_search_ai AFTER INSERT ON {kind} BEGIN
+                {_search_insert_sql(kind, "new")};
+            END
+        """))
+        db.session.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS {kind}_search_au AFTER UPDATE ON {kind} BEGIN
+                {delete}
+                {_search_insert_sql(kind, "new")};
+            END
+        """))
+        db.session.execute(text(f"""
+            CREATE TRIGGER IF NOT EXISTS {kind}_search_ad AFTER DELETE ON {kind} BEGIN
+                {delete}
+            END
+        """))
+        if kind in _SEARCH_PARENTS:
+            # A renamed parent re-labels its children's documents
+            parent, column, fk = _SEARCH_PARENTS[kind]
+            db.session.execute(text(f"""
+                CREATE TRIGGER IF NOT EXISTS {kind}_label_search_au AFTER UPDATE OF {column} ON {parent}
+                WHEN old.{column} IS NOT new.{column} BEGIN
+                    DELETE FROM search_index WHERE rowid IN (SELECT id * 8 + {code} FROM {kind} WHERE {fk} = new.id);
+                    {_search_insert_sql(kind, "r")} AND r.{fk} = new.id;
+                END
+            """))
+    if rebuild:
+        db.session.execute(text("DELETE FROM search_index"))
+        for kind in SEARCH_KIND_CODES:
+            db.session.execute(text(_search_insert_sql(kind, "r")))
+        db.session.execute(text("INSERT INTO search_index (search_index) VALUES ('optimize')"))
+    db.session.commit()
+
+
+def fts_query(q: str) -> Optional[str]:
+    """User input -> FTS5 MATCH string: every word must match as a prefix."""
+    words = re.findall(r"\w+", q or "")
+    if not words:
+        return None
+    return " ".join('"' + w.replace('"', '""') + '"*' for w in words)
+
+
+def _search_markup(s: Optional[str]) -> str:
+    return str(escape(s or "")).replace(_SEARCH_HL[0], "<mark>").replace(_SEARCH_HL[1], "</mark>")
+
+
+def search_index_ids(q: str, kind: str, limit: int = 500) -> Optional[list]:
+    """Ranked source ids of `kind` matching q, or None when q has no words."""
+    match = fts_query(q)
+    if match is None:
+        return None
+    rows = db.session.execute(text("""
+        SELECT ref_id FROM search_index
+        WHERE search_index MATCH :m AND kind = :k
+        ORDER BY bm25(search_index, 10.0, 1.0) LIMIT :limit
+    """), {"m": match, "k": SEARCH_KIND_CODES[kind], "limit": limit}).scalars().all()
+    return list(rows)
+
+
+def search_all(q: str, kinds=None, limit: int = 20) -> list:
+    """Best `limit` hits across kinds: dicts with kind, id, label and highlighted markup."""
+    match = fts_query(q)
+    if match is None:
+        return []
+    params = {"m": match, "limit": limit, "a": _SEARCH_HL[0], "b": _SEARCH_HL[1]}
+    kind_sql = ""
+    if kinds:
+        codes = [SEARCH_KIND_CODES[k] for k in kinds if k in SEARCH_KIND_CODES]
+        kind_sql = " AND kind IN (%s)" % ",".join(str(c) for c in codes or [0])
+    rows = db.session.execute(text(f"""
+        SELECT kind, ref_id, label,
+               highlight(search_index, 0, :a, :b) AS title,
+               snippet(search_index, 1, :a, :b, '…', 12) AS snippet,
+               bm25(search_index, 10.0, 1.0) AS rank
+        FROM search_index
+        WHERE search_index MATCH :m{kind_sql}
+        ORDER BY rank LIMIT :limit
+    """), params).mappings().all()
+    return [
+        {
+            "kind": SEARCH_KINDS[r["kind"]],
+            "id": r["ref_id"],
+            "label": r["label"],
+            "title": _search_markup(r["title"]),
+            "snippet": _search_markup(r["snippet"]),
+            "rank": round(r["rank"], 4),
+        }
+        for r in rows
+    ]
+
+
+# -----------------------------------------------------------------------------
+# Price rollups (price_rollup maintained by triggers)
+# -----------------------------------------------------------------------------
+# New item rows are folded into their month and week buckets with an upsert.
+# Deletes, edits and header changes (date / party) recompute only the buckets
+# they touch, because min/max cannot be un-applied.
+_PRICE_SIDES = {
+    "sale": {
+        "item": "sale_item", "head": "sale", "fk": "sale_id", "party": "client_name",
+        "kg": "(CASE WHEN i.bottle_type_id IS NOT NULL THEN COALESCE(bt.quantity_ltr, 0) * COALESCE(bt.bottles_in_batch, 0) * COALESCE(i.quantity_kg, 0) ELSE COALESCE(i.quantity_kg, 0) END)",
+        "rate": "COALESCE(i.selling_rate_e4, 0) / 10000.0",
+        "cost": "COALESCE(i.cost_rate_e4, 0) / 10000.0",
+        "join": "LEFT JOIN bottle_type bt ON bt.id = i.bottle_type_id",
+        "item_cols": "product_id, sale_id, bottle_type_id, quantity_kg, cost_rate_e4, selling_rate_e4",
+    },
+    "purchase": {
+        "item": "purchase_item", "head": "purchase", "fk": "purchase_id", "party": "vendor_name",
+        "kg": "COALESCE(i.quantity_kg, 0)",
+        "rate": "COALESCE(i.rate_e4, 0) / 10000.0",
+        "cost": "COALESCE(i.rate_e4, 0) / 10000.0",
+        "join": "",
+        "item_cols": "product_id, purchase_id, quantity_kg, rate_e4",
+    },
+}
+PRICE_PERIODS = ("month", "week")
+_PERIODS_SQL = "(SELECT 'month' AS period UNION ALL SELECT 'week')"
+_ROLLUP_COLS = "side, product_id, party, period, period_start, n_lines, qty_kg, amount, cost_amount, min_rate, max_rate, sum_rate"
+
+
+def _bucket_sql(date_expr: str, period_expr: str = "p.period") -> str:
+    # Weeks start on Monday
+    return (f"(CASE {period_expr} WHEN 'month' THEN date({date_expr}, 'start of month') "
+            f"ELSE date({date_expr}, '-6 days', 'weekday 1') END)")
+
+
+def _rollup_aggregates(c: dict) -> str:
+    return (f"COUNT(*), SUM({c['kg']}), SUM({c['rate']} * {c['kg']}), SUM({c['cost']} * {c['kg']}), "
+            f"MIN({c['rate']}), MAX({c['rate']}), SUM({c['rate']})")
+
+
+def _rollup_recompute_sql(side: str, keys_sql: str) -> str:
+    """Rebuilds the buckets listed by keys_sql (product_id, party, period, period_start)."""
+    c = _PRICE_SIDES[side]
+    return f"""
+        DELETE FROM price_rollup WHERE side = '{side}'
+            AND (product_id, party, period, period_start) IN (SELECT product_id, party, period, period_start FROM ({keys_sql}));
+        INSERT INTO price_rollup ({_ROLLUP_COLS})
+        SELECT '{side}', k.product_id, k.party, k.period, k.period_start, {_rollup_aggregates(c)}
+        FROM (SELECT DISTINCT product_id, party, period, period_start FROM ({keys_sql})) k
+        JOIN {c['head']} h ON h.{c['party']} = k.party AND h.date >= k.period_start
+            AND h.date < (CASE k.period WHEN 'month' THEN date(k.period_start, '+1 month') ELSE date(k.period_start, '+7 days') END)
+        JOIN {c['item']} i ON i.{c['fk']} = h.id AND i.product_id = k.product_id
+        {c['join']}
+        GROUP BY k.product_id, k.party, k.period, k.period_start;
+    """
+
+
+def _rollup_item_keys_sql(side: str, row: str) -> str:
+    c = _PRICE_SIDES[side]
+    return (f"SELECT {row}.product_id AS product_id, h.{c['party']} AS party, p.period AS period, "
+            f"{_bucket_sql('h.date')} AS period_start FROM {c['head']} h, {_PERIODS_SQL} p "
+            f"WHERE h.id = {row}.{c['fk']} AND {row}.product_id IS NOT NULL")
+
+
+def _rollup_trigger_sql(side: str) -> list:
+    c = _PRICE_SIDES[side]
+    item, head, party = c["item"], c["head"], c["party"]
+    upsert = f"""
+        INSERT INTO price_rollup ({_ROLLUP_COLS})
+        SELECT '{side}', i.product_id, h.{party}, p.period, {_bucket_sql('h.date')},
+               1, {c['kg']}, {c['rate']} * {c['kg']}, {c['cost']} * {c['kg']}, {c['rate']}, {c['rate']}, {c['rate']}
+        FROM {item} i JOIN {head} h ON h.id = i.{c['fk']} {c['join']} CROSS JOIN {_PERIODS_SQL} p
+        WHERE i.id = new.id AND i.product_id IS NOT NULL
+        ON CONFLICT(side, product_id, party, period, period_start) DO UPDATE SET
+            n_lines = n_lines + excluded.n_lines,
+            qty_kg = qty_kg + excluded.qty_kg,
+            amount = amount + excluded.amount,
+            cost_amount = cost_amount + excluded.cost_amount,
+            min_rate = MIN(COALESCE(min_rate, excluded.min_rate), excluded.min_rate),
+            max_rate = MAX(COALESCE(max_rate, excluded.max_rate), excluded.max_rate),
+            sum_rate = sum_rate + excluded.sum_rate;
+    """
+    head_keys = (
+        f"SELECT i.product_id AS product_id, x.party AS party, p.period AS period, "
+        f"{_bucket_sql('x.d')} AS period_start FROM {item} i, "
+        f"(SELECT old.{party} AS party, old.date AS d UNION SELECT new.{party}, new.date) x, {_PERIODS_SQL} p "
+        f"WHERE i.{c['fk']} = new.id AND i.product_id IS NOT NULL"
+    )
+    item_update_keys = f"{_rollup_item_keys_sql(side, 'old')} UNION {_rollup_item_keys_sql(side, 'new')}"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {item}_rollup_ai AFTER INSERT ON {item} BEGIN {upsert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {item}_rollup_ad AFTER DELETE ON {item} BEGIN "
+        f"{_rollup_recompute_sql(side, _rollup_item_keys_sql(side, 'old'))} END",
+        f"CREATE TRIGGER IF NOT EXISTS {item}_rollup_au AFTER UPDATE OF {c['item_cols']} ON {item} BEGIN "
+        f"{_rollup_recompute_sql(side, item_update_keys)} END",
+        f"CREATE TRIGGER IF NOT EXISTS {head}_rollup_au AFTER UPDATE OF date, {party} ON {head} "
+        f"WHEN old.date IS NOT new.date OR old.{party} IS NOT new.{party} BEGIN "
+        f"{_rollup_recompute_sql(side, head_keys)} END",
+    ]
+
+
+def ensure_price_rollup(rebuild: bool = False) -> None:
+    """Creates price_rollup and its triggers; `rebuild` recomputes every bucket."""
+    if not _has_integer_money("sale_item"):
+        return   # v14 on a file below v19: the rates are still floats, v19 builds it
+    PriceRollup.__table__.create(db.engine, checkfirst=True)
+    for side in _PRICE_SIDES:
+        for ddl in _rollup_trigger_sql(side):
+            db.session.execute(text(ddl))
+    if rebuild:
+        db.session.execute(text("DELETE FROM price_rollup"))
+        for side, c in _PRICE_SIDES.items():
+            db.session.execute(text(f"""
+                INSERT INTO price_rollup ({_ROLLUP_COLS})
+                SELECT '{side}', i.product_id, h.{c['party']}, p.period, {_bucket_sql('h.date')} AS bucket,
+                       {_rollup_aggregates(c)}
+                FROM {c['item']} i JOIN {c['head']} h ON h.id = i.{c['fk']} {c['join']}
+                CROSS JOIN {_PERIODS_SQL} p
+                WHERE i.product_id IS NOT NULL
+                GROUP BY i.product_id, h.{c['party']}, p.period, bucket
+            """))
+    db.session.commit()
+
+
+def price_series(product_id: int, period: str = "month", sides=("sale", "purchase"),
+                 client_name: Optional[str] = None, vendor_name: Optional[str] = None,
+                 start: Optional[date] = None, end: Optional[date] = None) -> list:
+    """Per-period min/avg/max/volume-weighted rates for a product, summed over parties."""
+    q = db.session.query(
+        PriceRollup.side,
+        PriceRollup.period_start,
+        func.sum(PriceRollup.n_lines),
+        func.sum(PriceRollup.qty_kg),
+        func.sum(PriceRollup.amount),
+        func.sum(PriceRollup.cost_amount),
+        func.min(PriceRollup.min_rate),
+        func.max(PriceRollup.max_rate),
+        func.sum(PriceRollup.sum_rate),
+    ).filter(
+        PriceRollup.product_id == product_id,
+        PriceRollup.period == period,
+        PriceRollup.side.in_(list(sides)),
+    )
+    if client_name:
+        q = q.filter(db.or_(PriceRollup.side != "sale", PriceRollup.party == client_name))
+    if vendor_name:
+        q = q.filter(db.or_(PriceRollup.side != "purchase", PriceRollup.party == vendor_name))
+    if start:
+        q = q.filter(PriceRollup.period_start >= start)
+    if end:
+        q = q.filter(PriceRollup.period_start <= end)
+    rows = q.group_by(PriceRollup.side, PriceRollup.period_start).order_by(PriceRollup.period_start).all()
+    return [
+        {
+            "side": side,
+            "period_start": ps.isoformat(),
+            "lines": n,
+            "qty": round(qty or 0.0, 2),
+            "min": round(lo, 2) if lo is not None else None,
+            "max": round(hi, 2) if hi is not None else None,
+            "avg": round(sum_rate / n, 2) if n else None,
+            "vwap": round(amount / qty, 2) if qty else None,
+            "cost_vwap": round(cost / qty, 2) if qty else None,
+        }
+        for side, ps, n, qty, amount, cost, lo, hi, sum_rate in rows
+    ]
+
+
+# -----------------------------------------------------------------------------
+# Last-rate lookup (last_rate maintained by triggers)
+# -----------------------------------------------------------------------------
+# New lines replace the stored row when they are at least as recent. Deleting
+# or editing the current last line, or moving its header to another date or
+# party, re-derives just those (party, product) keys from the indexed items.
+_LAST_RATE_COLS = "side, party, product_id, rate, cost_rate, qty_kg, date, head_id, item_id"
+
+
+def _last_rate_values(side: str) -> str:
+    c = _PRICE_SIDES[side]
+    return (f"'{side}', h.{c['party']}, i.product_id, {c['rate']}, {c['cost']}, {c['kg']}, "
+            f"h.date, h.id, i.id")
+
+
+def _last_rate_recompute_sql(side: str, keys_sql: str) -> str:
+    """Re-derives the rows for keys_sql (party, product_id) from the latest line."""
+    c = _PRICE_SIDES[side]
+    return f"""
+        DELETE FROM last_rate WHERE side = '{side}'
+            AND (party, product_id) IN (SELECT party, product_id FROM ({keys_sql}));
+        INSERT INTO last_rate ({_LAST_RATE_COLS})
+        SELECT {_last_rate_values(side)}
+        FROM (SELECT DISTINCT party, product_id FROM ({keys_sql})) k
+        JOIN {c['item']} i ON i.id = (
+            SELECT i2.id FROM {c['head']} h2
+            JOIN {c['item']} i2 ON i2.{c['fk']} = h2.id AND i2.product_id = k.product_id
+            WHERE h2.{c['party']} = k.party
+            ORDER BY h2.date DESC, i2.id DESC LIMIT 1
+        )
+        JOIN {c['head']} h ON h.id = i.{c['fk']}
+        {c['join']};
+    """
+
+
+def _last_rate_trigger_sql(side: str) -> list:
+    c = _PRICE_SIDES[side]
+    item, head, party, fk = c["item"], c["head"], c["party"], c["fk"]
+
+    def item_keys(row):
+        return (f"SELECT h.{party} AS party, {row}.product_id AS product_id FROM {head} h "
+                f"WHERE h.id = {row}.{fk} AND {row}.product_id IS NOT NULL")
+
+    upsert = f"""
+        INSERT INTO last_rate ({_LAST_RATE_COLS})
+        SELECT {_last_rate_values(side)}
+        FROM {item} i JOIN {head} h ON h.id = i.{fk} {c['join']}
+        WHERE i.id = new.id AND i.product_id IS NOT NULL
+        ON CONFLICT(side, party, product_id) DO UPDATE SET
+            rate = excluded.rate, cost_rate = excluded.cost_rate, qty_kg = excluded.qty_kg,
+            date = excluded.date, head_id = excluded.head_id, item_id = excluded.item_id
+        WHERE excluded.date > last_rate.date
+           OR (excluded.date = last_rate.date AND excluded.item_id >= last_rate.item_id);
+    """
+    head_keys = (
+        f"SELECT x.party AS party, i.product_id AS product_id FROM {item} i, "
+        f"(SELECT old.{party} AS party UNION SELECT new.{party}) x "
+        f"WHERE i.{fk} = new.id AND i.product_id IS NOT NULL"
+    )
+    is_last = f"EXISTS (SELECT 1 FROM last_rate WHERE side = '{side}' AND item_id = old.id)"
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {item}_last_rate_ai AFTER INSERT ON {item} BEGIN {upsert} END",
+        f"CREATE TRIGGER IF NOT EXISTS {item}_last_rate_ad AFTER DELETE ON {item} WHEN {is_last} BEGIN "
+        f"{_last_rate_recompute_sql(side, item_keys('old'))} END",
+        f"CREATE TRIGGER IF NOT EXISTS {item}_last_rate_au AFTER UPDATE OF {c['item_cols']} ON {item} BEGIN "
+        f"{_last_rate_recompute_sql(side, item_keys('old') + ' UNION ' + item_keys('new'))} END",
+        f"CREATE TRIGGER IF NOT EXISTS {head}_last_rate_au AFTER UPDATE OF date, {party} ON {head} "
+        f"WHEN old.date IS NOT new.date OR old.{party} IS NOT new.{party} BEGIN "
+        f"{_last_rate_recompute_sql(side, head_keys)} END",
+    ]
+
+
+def ensure_last_rate(rebuild: bool = False) -> None:
+    """Creates last_rate and its triggers; `rebuild` re-derives every row."""
+    if not _has_integer_money("sale_item"):
+        return   # v15 on a file below v19, as in ensure_price_rollup
+    LastRate.__table__.create(db.engine, checkfirst=True)
+    for side in _PRICE_SIDES:
+        for ddl in _last_rate_trigger_sql(side):
+            db.session.execute(text(ddl))
+    if rebuild:
+        db.session.execute(text("DELETE FROM last_rate"))
+        for side, c in _PRICE_SIDES.items():
+            # One windowed pass instead of a per-key lookup
+            db.session.execute(text(f"""
+                INSERT INTO last_rate ({_LAST_RATE_COLS})
+                SELECT {_LAST_RATE_COLS} FROM (
+                    SELECT '{side}' AS side, h.{c['party']} AS party, i.product_id AS product_id,
+                           {c['rate']} AS rate, {c['cost']} AS cost_rate, {c['kg']} AS qty_kg,
+                           h.date AS date, h.id AS head_id, i.id AS item_id,
+                           ROW_NUMBER() OVER (PARTITION BY h.{c['party']}, i.product_id
+                                              ORDER BY h.date DESC, i.id DESC) AS rn
+                    FROM {c['item']} i JOIN {c['head']} h ON h.id = i.{c['fk']} {c['join']}
+                    WHERE i.product_id IS NOT NULL
+                ) WHERE rn = 1
+            """))
+    db.session.commit()
+
+
+def last_rates(side: str, party: str, product_ids) -> dict:
+    """{product_id: LastRate} for one party, in a single primary-key range lookup."""
+    rows = LastRate.query.filter(
+        LastRate.side == side,
+        LastRate.party == party,
+        LastRate.product_id.in_(list(product_ids)),
+    ).all()
+    return {r.product_id: r for r in rows}
+
+
+# -----------------------------------------------------------------------------
+# Bulk import (sales / purchases from CSV or XLSX)
+# -----------------------------------------------------------------------------
+# One row per line item. Rows sharing an `invoice` value - or, without one,
+# the same date and party - become one Sale / Purchase. Masters are loaded
+# once, every row is validated before anything is written, headers and items
+# go in with bulk_insert_mappings and stock moves are netted per
+# (product, rate) and applied once at the end. Bill-mode sales only; bottle
+# (cash) sales still go through the form.
+IMPORT_KINDS = ("sale", "purchase")
+
+# Normalised header -> field. Headers are lower-cased with spaces / dashes
+# turned into underscores; columns not listed here are ignored, so the
+# sales export (/export.csv) imports back as-is.
+IMPORT_HEADER_ALIASES = {
+    "invoice": "invoice", "invoice_no": "invoice", "bill_no": "invoice", "ref": "invoice",
+    "date": "date",
+    "party": "party", "client": "party", "client_name": "party", "vendor": "party", "vendor_name": "party",
+    "product": "product", "product_name": "product", "product_id": "product",
+    "quantity": "quantity", "qty": "quantity", "quantity_kg": "quantity", "quantity_(kg)": "quantity",
+    "unit": "unit",
+    "cost_rate": "cost_rate", "cost_rate_per_kg": "cost_rate", "rate/_kg_(cost)": "cost_rate",
+    "sell_rate": "sell_rate", "selling_rate_per_kg": "sell_rate", "selling_rate/kg": "sell_rate",
+    "rate": "rate", "rate_per_kg": "rate",
+    "gst_percent": "gst_percent", "gst": "gst_percent", "gst_%": "gst_percent",
+    "freight": "freight",
+    "misc_amount": "misc_amount", "misc": "misc_amount",
+}
+IMPORT_REQUIRED = {
+    "sale": ("date", "party", "quantity", "sell_rate"),
+    "purchase": ("date", "party", "quantity", "rate"),
+}
+IMPORT_DATE_FORMATS = ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y", "%d-%m-%y", "%d/%m/%y",
+                       "%d-%b-%Y", "%d %b %Y", "%d-%b-%y", "%d %b %y")
+IMPORT_MAX_ERRORS = 200
+# Saved previews nobody confirmed are swept on the next upload
+IMPORT_UPLOAD_TTL = timedelta(hours=int(os.environ.get("IMPORT_UPLOAD_TTL_HOURS", "12")))
+
+
+def _discard_upload(path: Optional[str]) -> None:
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+def _prune_uploads(upload_dir: str) -> None:
+    """Deletes saved uploads older than IMPORT_UPLOAD_TTL."""
+    if not os.path.isdir(upload_dir):
+        return
+    cutoff = time.time() - IMPORT_UPLOAD_TTL.total_seconds()
+    for name in os.listdir(upload_dir):
+        path = os.path.join(upload_dir, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass  # already taken by a concurrent confirm
+
+
+def _import_cell(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.date().isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def read_import_file(stream, filename: str, aliases: Optional[dict] = None):
+    """
+    Returns (fields, rows) for a CSV / XLSX upload: the recognised field per
+    column (via `aliases`, IMPORT_HEADER_ALIASES by default) and a lazy
+    iterator of (line_no, {field: value}).
+    """
+    aliases = aliases or IMPORT_HEADER_ALIASES
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext in (".xlsx", ".xlsm"):
+        try:
+            import openpyxl
+        except ImportError:
+            raise ValueError("Excel import needs openpyxl (pip install openpyxl); or save the sheet as CSV")
+        sheet = openpyxl.load_workbook(stream, read_only=True, data_only=True).active
+        raw_rows = sheet.iter_rows(values_only=True)
+    elif ext == ".csv":
+        raw_rows = csv.reader(io.TextIOWrapper(stream, encoding="utf-8-sig", newline=""))
+    else:
+        raise ValueError("Upload a .csv or .xlsx file")
+
+    numbered = enumerate(raw_rows, start=1)
+    fields = []
+    for _line_no, raw in numbered:
+        cells = [_import_cell(v) for v in raw]
+        if any(cells):
+            fields = [aliases.get(re.sub(r"[\s\-]+", "_", c.lower())) for c in cells]
+            break
+
+    def rows():
+        for line_no, raw in numbered:
+            cells = [_import_cell(v) for v in raw]
+            if any(cells):
+                yield line_no, {f: v for f, v in zip(fields, cells) if f and v}
+
+    return fields, rows()
+
+
+def _import_date(value: str) -> date:
+    for fmt in IMPORT_DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"bad date {value!r}")
+
+
+def _import_number(row: dict, field: str, required: bool = False) -> float:
+    value = row.get(field, "").replace(",", "")
+    if not value:
+        if required:
+            raise ValueError(f"{field} is required")
+        return 0.0
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{field} {row[field]!r} is not a number")
+
+
+def plan_import(kind: str, fields, rows) -> dict:
+    """
+    Validates every row against cached masters and groups lines into
+    invoices. Nothing is written; the returned plan doubles as the dry-run
+    report (see apply_import).
+    """
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"kind must be one of {', '.join(IMPORT_KINDS)}")
+    missing = [f for f in IMPORT_REQUIRED[kind] if f not in fields]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+    parties = {name.lower(): name for name in db.session.execute(db.select(Client.name)).scalars()}
+    products = {}
+    for pid, name in db.session.execute(db.select(Product.id, Product.name)):
+        products[name.lower()] = products[str(pid)] = (pid, name)
+    closed = closed_through()
+
+    invoices = {}
+    errors = []
+    n_errors = 0
+    new_parties = set()
+    n_rows = 0
+    for line_no, row in rows:
+        n_rows += 1
+        try:
+            day = _import_date(row.get("date", ""))
+            if closed and day <= closed:
+                raise ValueError(f"date {day} is in a closed period (books closed up to {closed})")
+            raw_party = row.get("party", "")
+            if not raw_party:
+                raise ValueError("party is required")
+            party = parties.get(raw_party.lower())
+            if party is None:
+                party = raw_party
+                new_parties.add(raw_party)
+
+            product_id = None
+            if row.get("product"):
+                match = products.get(row["product"].lower())
+                if match is None:
+                    raise ValueError(f"unknown product {row['product']!r}")
+                product_id = match[0]
+
+            unit = (row.get("unit") or "kg").lower()
+            if unit not in ("kg", "ton"):
+                raise ValueError(f"unit must be kg or ton, not {row['unit']!r}")
+            qty_kg = to_kg(_import_number(row, "quantity", required=True), unit)
+            if qty_kg <= 0:
+                raise ValueError("quantity must be positive")
+
+            if kind == "sale":
+                line = {
+                    "product_id": product_id,
+                    "quantity_kg": qty_kg,
+                    "cost_rate_per_kg": _import_number(row, "cost_rate"),
+                    "selling_rate_per_kg": _import_number(row, "sell_rate", required=True),
+                    "gst_percent": _import_number(row, "gst_percent"),
+                }
+            else:
+                line = {
+                    "product_id": product_id,
+                    "quantity_kg": qty_kg,
+                    "rate_per_kg": _import_number(row, "rate", required=True),
+                }
+
+            key = row.get("invoice") or (day, party.lower())
+            inv = invoices.get(key)
+            if inv is None:
+                inv = invoices[key] = {
+                    "line": line_no, "invoice": row.get("invoice", ""), "date": day, "party": party,
+                    "freight": _import_number(row, "freight"),
+                    "misc_amount": _import_number(row, "misc_amount"),
+                    "gst_percent": _import_number(row, "gst_percent"),
+                    "items": [],
+                }
+            elif inv["date"] != day or inv["party"].lower() != party.lower():
+                raise ValueError(f"invoice {key!r} already started on line {inv['line']} "
+                                 f"with a different date / party")
+            inv["items"].append(line)
+        except ValueError as exc:
+            n_errors += 1
+            if len(errors) < IMPORT_MAX_ERRORS:
+                errors.append((line_no, str(exc)))
+
+    invoices = list(invoices.values())
+    stock = {}
+    for inv in invoices:
+        _import_totals(kind, inv)
+        for item in inv["items"]:
+            if item["product_id"]:
+                rate = item["cost_rate_per_kg"] if kind == "sale" else item["rate_per_kg"]
+                sign = -1 if kind == "sale" else 1
+                key = (item["product_id"], to_rate_e4(rate))
+                stock[key] = stock.get(key, 0.0) + sign * item["quantity_kg"]
+
+    return {
+        "kind": kind,
+        "rows": n_rows,
+        "invoices": invoices,
+        "errors": errors,
+        "error_count": n_errors,
+        "new_parties": sorted(new_parties),
+        "stock": stock,
+        "duplicates": _import_duplicates(kind, invoices),
+        "stock_changes": _import_stock_report(stock, {pid: name for pid, name in products.values()}),
+        "lines": sum(len(inv["items"]) for inv in invoices),
+        "total": round(sum(inv["grand_total"] for inv in invoices), 2),
+        "date_from": min((inv["date"] for inv in invoices), default=None),
+        "date_to": max((inv["date"] for inv in invoices), default=None),
+    }
+
+
+def _import_totals(kind: str, inv: dict) -> None:
+    """Header totals computed the same way sales_form / new_purchase do."""
+    items = inv["items"]
+    if kind == "sale":
+        subtotal = sum(i["selling_rate_per_kg"] * i["quantity_kg"] for i in items)
+        gst_amount = sum(i["selling_rate_per_kg"] * i["quantity_kg"] * i["gst_percent"] / 100.0 for i in items)
+        inv["quantity_kg"] = sum(i["quantity_kg"] for i in items)
+    else:
+        subtotal = sum(i["rate_per_kg"] * i["quantity_kg"] for i in items) + inv["freight"]
+        gst_amount = subtotal * inv["gst_percent"] / 100
+    inv["subtotal"] = round(subtotal, 2)
+    inv["cgst_amount"] = round(gst_amount / 2, 2)
+    inv["sgst_amount"] = round(gst_amount / 2, 2)
+    inv["grand_total"] = round(subtotal + gst_amount, 2)
+
+
+def _import_duplicates(kind: str, invoices: list) -> list:
+    """Invoices whose (date, party, grand total) already exist - likely re-imports."""
+    if not invoices:
+        return []
+    model, party_col, total_col = (
+        (Sale, Sale.client_name, Sale.grand_total_paise) if kind == "sale"
+        else (Purchase, Purchase.vendor_name, Purchase.grand_total_paise)
+    )
+    lo = min(inv["date"] for inv in invoices)
+    hi = max(inv["date"] for inv in invoices)
+    existing = {
+        (d, (p or "").lower(), t or 0)
+        for d, p, t in db.session.query(model.date, party_col, total_col).filter(model.date.between(lo, hi))
+    }
+    return [inv for inv in invoices
+            if (inv["date"], inv["party"].lower(), to_paise(inv["grand_total"])) in existing]
+
+
+def _import_stock_report(stock: dict, product_names: dict) -> list:
+    """Per-product net change with current and resulting stock."""
+    per_product = {}
+    for (pid, _rate), qty in stock.items():
+        per_product[pid] = per_product.get(pid, 0.0) + qty
+    if not per_product:
+        return []
+    current = dict(db.session.query(Product.id, Product.current_stock_kg).filter(Product.id.in_(per_product)))
+    return sorted((
+        {
+            "product": product_names.get(pid, pid),
+            "batches": sum(1 for (p, _r) in stock if p == pid),
+            "change_kg": round(qty, 2),
+            "before_kg": round(current.get(pid) or 0.0, 2),
+            "after_kg": round((current.get(pid) or 0.0) + qty, 2),
+        }
+        for pid, qty in per_product.items()
+    ), key=lambda r: r["product"])
+
+
+def apply_import(plan: dict) -> dict:
+    """
+    Writes a validated plan in one transaction: headers and items via
+    bulk_insert_mappings, and the stock deltas netted per invoice date.
+    """
+    if plan["error_count"]:
+        raise ValueError(f"{plan['error_count']} row(s) have errors; nothing was imported")
+    # Bulk inserts skip the flush-time guard, and the books may have closed since the preview
+    closed = closed_through()
+    if closed and plan["date_from"] and plan["date_from"] <= closed:
+        raise PeriodClosedError(f"Books are closed up to {closed:%d-%b-%Y}; nothing was imported")
+    kind = plan["kind"]
+    head_model, item_model, fk, party_field = (
+        (Sale, SaleItem, "sale_id", "client_name") if kind == "sale"
+        else (Purchase, PurchaseItem, "purchase_id", "vendor_name")
+    )
+    heads = []
+    for inv in plan["invoices"]:
+        head = {
+            "date": inv["date"], party_field: inv["party"], "freight": inv["freight"],
+            "gst_percent": 0.0 if kind == "sale" else inv["gst_percent"],
+            "subtotal": inv["subtotal"], "cgst_amount": inv["cgst_amount"],
+            "sgst_amount": inv["sgst_amount"], "igst_amount": 0.0, "grand_total": inv["grand_total"],
+        }
+        if kind == "sale":
+            head.update(sale_type="bill", quantity_kg=inv["quantity_kg"], misc_amount=round(inv["misc_amount"], 2))
+        heads.append(scaled_row(head_model.__tablename__, head))
+
     try:
-        return int(float(value))
+        # return_defaults fetches the new ids with RETURNING, batched
+        db.session.bulk_insert_mappings(head_model, heads, return_defaults=True)
+        items, by_date = [], {}
+        for inv, head in zip(plan["invoices"], heads):
+            for item in inv["items"]:
+                by_date.setdefault(inv["date"], []).append(len(items))
+                items.append(scaled_row(item_model.__tablename__, dict(item, **{fk: head["id"]})))
+        # One stock pass per invoice date, oldest first: new batches are dated
+        # by their own receipt and sales take lots in the order they were made
+        rate_col, sign = ("cost_rate_e4", -1) if kind == "sale" else ("rate_e4", 1)
+        allocations = []
+        for day in sorted(by_date):
+            rows = [items[i] for i in by_date[day]]
+            deltas = {}
+            for row in rows:
+                if row["product_id"]:
+                    key = (row["product_id"], row.get(rate_col) or 0)
+                    deltas[key] = deltas.get(key, 0.0) + sign * row["quantity_kg"]
+            if kind == "sale":
+                deltas, taken = cost_new_sale_items(rows, deltas)
+                allocations.extend((by_date[day][i], lots) for i, lots in taken)
+            apply_stock_deltas(deltas, received_on=day)
+        # Lot rows need the item ids
+        db.session.bulk_insert_mappings(item_model, items, return_defaults=bool(allocations))
+        if allocations:
+            db.session.bulk_insert_mappings(SaleItemLot, [
+                {"sale_item_id": items[i]["id"], "product_id": items[i]["product_id"],
+                 "rate_key": key, "quantity_kg": kg}
+                for i, taken in allocations
+                for key, kg in taken
+            ])
+        # Bulk inserts skip the flush hooks
+        bump_data_version(db.session, [DATA_GROUPS[head_model.__tablename__], "stock"])
+        db.session.commit()
     except Exception:
-        return default
-
-
-def _parse_date(date_str: str) -> datetime.date:
-    return datetime.strptime(date_str, "%Y-%m-%d").date()
+        db.session.rollback()
+        raise
+    return {"invoices": len(heads), "lines": len(items)}
 
 
-def to_kg(quantity: float, unit: str) -> float:
-    q = _to_float(quantity, 0.0)
-    if (unit or "").strip().lower() == "ton":
-        return q * KG_PER_TON
-    return q
+def import_invoices(kind: str, stream, filename: str, dry_run: bool = True) -> dict:
+    """Reads, validates and (unless dry_run) writes one upload; returns the plan."""
+    fields, rows = read_import_file(stream, filename)
+    plan = plan_import(kind, fields, rows)
+    if not dry_run:
+        plan["written"] = apply_import(plan)
+    return plan
 
 
-def commit_or_rollback():
+# -----------------------------------------------------------------------------
+# Bank statement reconciliation
+# -----------------------------------------------------------------------------
+# Credits are matched against open sales, debits against open purchases.
+# Open balances are loaded with one grouped query per side and indexed in
+# memory by (party, balance in paise) and by balance alone; a statement line
+# looks up its bucket and takes the oldest invoice inside the date window,
+# falling back to oldest-first allocation across the party's open bills.
+# Accepted lines become ClientCollection / VendorCollection rows with linked
+# payments, exactly what the collection forms create, in one transaction.
+BANK_HEADER_ALIASES = {
+    "date": "date", "txn_date": "date", "transaction_date": "date", "value_date": "date", "tran_date": "date",
+    "description": "description", "narration": "description", "particulars": "description",
+    "remarks": "description", "details": "description", "transaction_remarks": "description",
+    "credit": "credit", "deposit": "credit", "deposits": "credit", "cr": "credit", "deposit_amt.": "credit",
+    "credit_amount": "credit", "deposit_amount": "credit",
+    "debit": "debit", "withdrawal": "debit", "withdrawals": "debit", "dr": "debit", "withdrawal_amt.": "debit",
+    "debit_amount": "debit", "withdrawal_amount": "debit",
+    "amount": "amount",
+    "party": "party", "name": "party", "client": "party", "vendor": "party",
+    "ref": "ref", "ref_no": "ref", "ref_no.": "ref", "reference": "ref", "chq./ref.no.": "ref",
+    "cheque_no": "ref", "utr": "ref",
+}
+BANK_MATCH_WINDOW_DAYS = 180
+BANK_SIDES = {
+    # side -> open-balance query and already-posted collections
+    "sale": {
+        "open_sql": f"SELECT id, party, date, (total_paise - paid_paise) / 100.0 AS balance FROM ({SALE_TOTALS_SQL}) t WHERE date <= :hi",
+        "posted_sql": """
+            SELECT c.name, cc.date, cc.amount_paise / 100.0 FROM client_collection cc
+            JOIN client c ON c.id = cc.client_id WHERE cc.date BETWEEN :lo AND :hi
+        """,
+    },
+    "purchase": {
+        "open_sql": f"SELECT id, party, date, (total_paise - paid_paise) / 100.0 AS balance FROM ({PURCHASE_TOTALS_SQL}) t WHERE date <= :hi",
+        "posted_sql": """
+            SELECT vendor_name, date, amount_paise / 100.0 FROM vendor_collection WHERE date BETWEEN :lo AND :hi
+        """,
+    },
+}
+
+
+def read_bank_statement(stream, filename: str) -> dict:
+    """Statement lines as {line, date, description, ref, party, side, amount}; rows without a date are skipped."""
+    fields, rows = read_import_file(stream, filename, BANK_HEADER_ALIASES)
+    if "date" not in fields or not {"credit", "debit", "amount"} & set(fields):
+        raise ValueError("Statement needs a date column and credit / debit (or amount) columns")
+    lines, skipped = [], []
+    for line_no, row in rows:
+        try:
+            day = _import_date(row.get("date", ""))
+            credit = _import_number(row, "credit")
+            debit = _import_number(row, "debit")
+            signed = _import_number(row, "amount")
+        except ValueError as exc:
+            skipped.append((line_no, str(exc)))
+            continue
+        net = round(signed or (credit - debit), 2)
+        if not net:
+            continue
+        lines.append({
+            "line": line_no, "date": day, "description": row.get("description", ""),
+            "ref": row.get("ref", ""), "party_hint": row.get("party", ""),
+            "side": "sale" if net > 0 else "purchase", "amount": abs(net),
+        })
+    return {"lines": lines, "skipped": skipped}
+
+
+def _open_invoice_index(side: str, hi: date) -> dict:
+    """Open balances for one side, indexed by party, (party, paise) and paise."""
+    by_party, by_key, by_amount = {}, {}, {}
+    rows = db.session.execute(text(BANK_SIDES[side]["open_sql"]), {"hi": hi.isoformat()}).all()
+    for inv_id, party, inv_date, balance in rows:
+        if balance is None or balance < 0.005:
+            continue
+        inv = {"id": inv_id, "party": party, "date": _as_date(inv_date), "balance": round(balance, 2)}
+        by_party.setdefault(party.lower(), []).append(inv)
+        by_key.setdefault((party.lower(), to_paise(balance)), []).append(inv)
+        by_amount.setdefault(to_paise(balance), []).append(inv)
+    for bucket in (by_party, by_key, by_amount):
+        for invs in bucket.values():
+            invs.sort(key=lambda i: (i["date"], i["id"]))
+    return {"by_party": by_party, "by_key": by_key, "by_amount": by_amount}
+
+
+def _party_pattern(names):
+    """One alternation over all party names (longest first) to spot them in narrations."""
+    names = sorted({n for n in names if n and len(n) >= 3}, key=len, reverse=True)
+    if not names:
+        return None
+    return re.compile(r"\b(" + "|".join(re.escape(n) for n in names) + r")\b", re.IGNORECASE)
+
+
+def match_statement(lines: list, overrides: Optional[dict] = None,
+                    window_days: int = BANK_MATCH_WINDOW_DAYS) -> list:
+    """
+    Proposes an allocation for every statement line (in date order, so two
+    lines never claim the same balance). Each line gains party, status
+    (exact / fifo / amount / on_account / posted / unmatched), allocations
+    [(invoice_id, invoice_date, amount)], unallocated and accept.
+    `overrides` maps line number -> party name chosen on the review screen.
+    """
+    overrides = overrides or {}
+    if not lines:
+        return lines
+    lo = min(l["date"] for l in lines)
+    hi = max(l["date"] for l in lines)
+    window = timedelta(days=window_days)
+
+    client_names = {n.lower(): n for n in db.session.execute(db.select(Client.name)).scalars()}
+    closed = closed_through()
+    indexes, posted, patterns = {}, {}, {}
+    for side in BANK_SIDES:
+        indexes[side] = _open_invoice_index(side, hi)
+        rows = db.session.execute(text(BANK_SIDES[side]["posted_sql"]),
+                                  {"lo": lo.isoformat(), "hi": hi.isoformat()}).all()
+        posted[side] = {(p.lower(), _as_date(d), to_paise(a)) for p, d, a in rows}
+        known = dict(client_names)
+        # Parties already paid in the window too, or a re-imported line to a
+        # vendor with nothing left open would miss its "posted" check
+        known.update({p.lower(): p for p, _d, _a in rows})
+        known.update({invs[0]["party"].lower(): invs[0]["party"] for invs in indexes[side]["by_party"].values()})
+        patterns[side] = (_party_pattern(known.values()), known)
+
+    def in_window(inv, day):
+        return inv["balance"] >= 0.005 and inv["date"] <= day and day - inv["date"] <= window
+
+    def take(idx, inv, amount):
+        # Move the invoice to the bucket for its new balance
+        inv["balance"] = round(inv["balance"] - amount, 2)
+        idx["by_key"].setdefault((inv["party"].lower(), to_paise(inv["balance"])), []).append(inv)
+        idx["by_amount"].setdefault(to_paise(inv["balance"]), []).append(inv)
+
+    for l in sorted(lines, key=lambda l: (l["date"], l["line"])):
+        side, day, paise = l["side"], l["date"], to_paise(l["amount"])
+        idx = indexes[side]
+        pattern, known = patterns[side]
+        l.update(party=None, status="unmatched", allocations=[], unallocated=l["amount"], accept=False)
+        if closed and day <= closed:
+            l["status"] = "closed"
+            continue
+
+        hint = overrides.get(l["line"]) or l["party_hint"]
+        if hint:
+            l["party"] = known.get(hint.strip().lower())
+        elif pattern:
+            found = pattern.search(l["description"] or "")
+            l["party"] = known.get(found.group(1).lower()) if found else None
+
+        if l["party"] and (l["party"].lower(), day, paise) in posted[side]:
+            l["status"] = "posted"
+            continue
+
+        if l["party"]:
+            key = (l["party"].lower(), paise)
+            exact = next((inv for inv in idx["by_key"].get(key, ()) if to_paise(inv["balance"]) == paise
+                          and in_window(inv, day)), None)
+            if exact:
+                l.update(status="exact", allocations=[(exact["id"], exact["date"], l["amount"])],
+                         unallocated=0.0, accept=True)
+                take(idx, exact, l["amount"])
+                continue
+            remaining = l["amount"]
+            for inv in idx["by_party"].get(l["party"].lower(), ()):
+                if remaining < 0.005:
+                    break
+                if not in_window(inv, day):
+                    continue
+                amount = round(min(remaining, inv["balance"]), 2)
+                l["allocations"].append((inv["id"], inv["date"], amount))
+                take(idx, inv, amount)
+                remaining = round(remaining - amount, 2)
+            l.update(status="fifo" if l["allocations"] else "on_account", unallocated=remaining,
+                     accept=bool(l["allocations"]))
+            continue
+
+        candidates = [inv for inv in idx["by_amount"].get(paise, ()) if to_paise(inv["balance"]) == paise
+                      and in_window(inv, day)]
+        # Amount alone is only trusted when exactly one party has such a bill
+        if len({inv["party"].lower() for inv in candidates}) == 1:
+            inv = candidates[0]
+            l.update(party=inv["party"], status="amount",
+                     allocations=[(inv["id"], inv["date"], l["amount"])], unallocated=0.0)
+            take(idx, inv, l["amount"])
+    return lines
+
+
+def post_bank_matches(lines: list) -> dict:
+    """
+    Writes every accepted line as a collection (Mode "Bank") plus its
+    invoice payments, with batched inserts in a single transaction.
+    """
+    accepted = [l for l in lines if l["accept"] and l["party"] and l["status"] not in ("posted", "closed")]
+    # Bulk inserts skip the flush-time guard, so check the close here
+    closed = closed_through()
+    if closed and any(l["date"] <= closed for l in accepted):
+        raise PeriodClosedError(f"Books are closed up to {closed:%d-%b-%Y}; lines dated on or before it can't be posted")
+    client_ids = {n.lower(): i for i, n in db.session.execute(db.select(Client.id, Client.name))}
+    written = {"sale": 0, "purchase": 0, "payments": 0}
     try:
+        for side, coll_model, pay_model, fk in (
+            ("sale", ClientCollection, SalePayment, "sale_id"),
+            ("purchase", VendorCollection, PurchasePayment, "purchase_id"),
+        ):
+            todo = [l for l in accepted if l["side"] == side]
+            collections = []
+            for l in todo:
+                notes = " ".join(x for x in ("Bank:", l["description"], f"[{l['ref']}]" if l["ref"] else "") if x)
+                row = {"date": l["date"], "amount": l["amount"], "mode": "Bank", "notes": notes[:250]}
+                if side == "sale":
+                    if l["party"].lower() not in client_ids:
+                        raise ValueError(f"{l['party']} is not in Parties (line {l['line']})")
+                    row["client_id"] = client_ids[l["party"].lower()]
+                else:
+                    row["vendor_name"] = l["party"]
+                collections.append(scaled_row(coll_model.__tablename__, row))
+            if not collections:
+                continue
+            db.session.bulk_insert_mappings(coll_model, collections, return_defaults=True)
+            label = "Collection" if side == "sale" else "VendorCollection"
+            payments = [
+                {fk: inv_id, "date": l["date"], "amount_paise": to_paise(amount), "mode": "Bank",
+                 "notes": f"Bulk Payment via {label} #{c['id']}", "collection_id": c["id"]}
+                for l, c in zip(todo, collections)
+                for inv_id, _inv_date, amount in l["allocations"]
+            ]
+            db.session.bulk_insert_mappings(pay_model, payments)
+            written[side] = len(collections)
+            written["payments"] += len(payments)
+        # Bulk inserts skip the flush hooks
+        bump_data_version(db.session, ["sales", "purchases"])
         db.session.commit()
     except Exception:
         db.session.rollback()
         raise
+    return written
 
 
-def get_vendor_dues():
-
-    purchases = Purchase.query.all()
-    report = {}
+# -----------------------------------------------------------------------------
+# Background jobs (heavy reports / exports)
+# -----------------------------------------------------------------------------
+# GET endpoints that may be rendered off the request path. A job replays the
+# normal view inside a synthetic request and stores the response body as a
+# file, so the report code itself stays unchanged.
+JOB_ENDPOINTS = {
+    "export_csv",
+    "monthly_performance_report",
+    "product_stock_ledger",
+    "party_ledger",
+    "combined_party_ledger",
+}
+JOB_RESULT_TTL = timedelta(hours=int(os.environ.get("JOB_RESULT_TTL_HOURS", "12")))
+JOB_TIMEOUT = timedelta(minutes=int(os.environ.get("JOB_TIMEOUT_MINUTES", "15")))
+
+_job_executor = None
+_job_executor_pid = None
+
+
+def _executor() -> ThreadPoolExecutor:
+    # Created lazily in each process: threads do not survive gunicorn's fork.
+    global _job_executor, _job_executor_pid
+    if _job_executor is None or _job_executor_pid != os.getpid():
+        _job_executor = ThreadPoolExecutor(
+            max_workers=int(os.environ.get("JOB_WORKERS", "2")),
+            thread_name_prefix="job",
+        )
+        _job_executor_pid = os.getpid()
+    return _job_executor
 
-    for p in purchases:
-        vendor = p.vendor_name
 
-        if vendor not in report:
-            report[vendor] = {
-                "total_purchase": 0,
-                "total_paid": 0,
-                "balance": 0
-            }
+def job_cache_key(app: Flask, kind: str, url: str) -> str:
+    # Same data versions as the page's ETag: any write to the groups the
+    # report reads makes older results stale.
+    groups = getattr(app.view_functions[kind], "data_groups", ())
+    versions = [(g, v) for g, v, _ in data_versions(groups)]
+    return hashlib.sha1(f"{kind}|{url}|{versions}".encode()).hexdigest()
 
-        report[vendor]["total_purchase"] += p.total_cost()
-        report[vendor]["total_paid"] += p.total_paid()
-        report[vendor]["balance"] += p.balance_due()
 
-    return report
+def submit_job(app: Flask, kind: str, url: str) -> BackgroundJob:
+    """
+    Queues `url` (a GET route in JOB_ENDPOINTS) and returns its job. A finished
+    job for the same URL that is still fresh is returned instead of re-running.
+    """
+    key = job_cache_key(app, kind, url)
+    cached = (
+        BackgroundJob.query
+        .filter(
+            BackgroundJob.cache_key == key,
+            BackgroundJob.status.in_(["queued", "running", "done"]),
+            BackgroundJob.created_at >= datetime.utcnow() - JOB_RESULT_TTL,
+        )
+        .order_by(BackgroundJob.created_at.desc())
+        .first()
+    )
+    if cached and (cached.status != "done" or os.path.exists(cached.result_path or "")):
+        return cached
 
+    _prune_jobs()
+    job = BackgroundJob(kind=kind, url=url, cache_key=key)
+    db.session.add(job)
+    commit_or_rollback()
+    _executor().submit(_run_job, app, job.id)
+    return job
 
-def get_sales_outstanding():
-    clients = Client.query.order_by(Client.name).all()
-    report = {}
 
-    for c in clients:
-        # Sales for this client
-        sales = Sale.query.filter_by(client_name=c.name).all()
-        
-        total_sales = sum(s.total_amount() for s in sales)
-        total_received = sum(s.total_received() for s in sales)
-        
-        # Balance = Opening Balance + Total Sales - Total Received
-        # Opening balance is positive for receivable
-        balance = c.opening_balance + total_sales - total_received
-        
-        if balance != 0:
-            report[c.name] = {
-                "total_sales": total_sales,
-                "total_received": total_received,
-                "balance": round(balance, 2),
-                "phone": c.phone,
-                "opening_balance": c.opening_balance
+def _run_job(app: Flask, job_id: str) -> None:
+    # Status writes take the write lock up front (write_transaction): a plain
+    # BEGIN that read the job first can't wait for a busy database
+    with app.app_context():
+        with write_transaction():
+            job = db.session.get(BackgroundJob, job_id)
+            job.status = "running"
+            job.started_at = datetime.utcnow()
+            url = job.url
+        try:
+            path, _, query = url.partition("?")
+            with app.test_request_context(path, query_string=query):
+                endpoint, view_args = request.url_rule.endpoint, request.view_args
+                resp = app.make_response(app.view_functions[endpoint](**view_args))
+                resp.direct_passthrough = False  # send_file responses
+                body = resp.get_data()
+                disposition = resp.headers.get("Content-Disposition", "")
+
+            out_dir = os.path.join(app.instance_path, "job_results")
+            os.makedirs(out_dir, exist_ok=True)
+            ext = "csv" if resp.mimetype == "text/csv" else "html"
+            result_path = os.path.join(out_dir, f"{job_id}.{ext}")
+            with open(result_path, "wb") as f:
+                f.write(body)
+            outcome = {
+                "status": "done",
+                "result_path": result_path,
+                "mimetype": resp.mimetype,
+                "download_name": disposition.split("filename=")[-1].strip('"') if "filename=" in disposition else None,
             }
+        except Exception as exc:
+            db.session.rollback()
+            app.logger.exception("job %s (%s) failed", job_id, url)
+            outcome = {"status": "failed", "error": str(exc)}
+        with write_transaction():
+            job = db.session.get(BackgroundJob, job_id)
+            for field, value in outcome.items():
+                setattr(job, field, value)
+            job.finished_at = datetime.utcnow()
+        db.session.remove()
+
+
+def _prune_jobs() -> None:
+    old = BackgroundJob.query.filter(BackgroundJob.created_at < datetime.utcnow() - JOB_RESULT_TTL).all()
+    for job in old:
+        if job.result_path and os.path.exists(job.result_path):
+            os.remove(job.result_path)
+        db.session.delete(job)
 
-    return report
 
 # -----------------------------------------------------------------------------
 # Routes
@@ -685,6 +3867,30 @@ def register_routes(app: Flask) -> None:
         if not session.get("user"):
             return redirect(url_for("login"))
 
+    @app.before_request
+    def _write_transaction():
+        # Runs after the login check, so anonymous POSTs never take the lock
+        if request.method not in WRITE_METHODS or request.endpoint in {"login", "static"} | LATE_LOCK_ENDPOINTS:
+            return
+        try:
+            db.session.connection()   # BEGIN IMMEDIATE, see _sqlite_begin
+        except OperationalError as exc:
+            db.session.rollback()
+            if not is_locked_error(exc):
+                raise
+            if request.path.startswith("/api/"):
+                return jsonify({"error": WRITE_BUSY_MESSAGE}), 503
+            return make_response(WRITE_BUSY_MESSAGE, 503, {"Retry-After": "2"})
+
+    @app.errorhandler(PeriodClosedError)
+    def _period_closed(exc):
+        # Raised at flush time by any form that writes into a closed period
+        db.session.rollback()
+        if request.path.startswith("/api/"):
+            return jsonify({"error": str(exc)}), 409
+        flash(str(exc), "danger")
+        return redirect(request.referrer or url_for("index"))
+
     @app.route("/login", methods=["GET", "POST"])
     def login():
         if request.method == "POST":
@@ -724,14 +3930,14 @@ def register_routes(app: Flask) -> None:
                 ROUND(SUM(qty_kg),2) AS total_qty,
                 ROUND(SUM(sp),2) AS total_sp,
                 ROUND(SUM(cp),2) AS total_cp,
-                ROUND(SUM(freight),2) AS total_freight
+                ROUND(SUM(freight) / 100.0, 2) AS total_freight
             FROM (
                 SELECT
                     sale.id,
                     SUM(sale_item.quantity_kg) qty_kg,
-                    SUM(sale_item.selling_rate_per_kg * sale_item.quantity_kg) sp,
-                    SUM(sale_item.cost_rate_per_kg * sale_item.quantity_kg) cp,
-                    COALESCE(sale.freight,0) freight
+                    SUM(sale_item.selling_rate_e4 * sale_item.quantity_kg) / 10000.0 sp,
+                    SUM(sale_item.cost_rate_e4 * sale_item.quantity_kg) / 10000.0 cp,
+                    sale.freight_paise freight
                 FROM sale
                 JOIN sale_item ON sale_item.sale_id = sale.id
                 GROUP BY sale.id
@@ -753,15 +3959,15 @@ def register_routes(app: Flask) -> None:
                 ROUND(SUM(qty_kg),2) qty_kg,
                 ROUND(SUM(sp),2) sp,
                 ROUND(SUM(cp),2) cp,
-                ROUND(SUM(freight),2) freight
+                ROUND(SUM(freight) / 100.0, 2) freight
             FROM (
                 SELECT
                     strftime('%Y-%m', sale.date) ym,
                     sale.id,
                     SUM(sale_item.quantity_kg) qty_kg,
-                    SUM(sale_item.selling_rate_per_kg * sale_item.quantity_kg) sp,
-                    SUM(sale_item.cost_rate_per_kg * sale_item.quantity_kg) cp,
-                    COALESCE(sale.freight,0) freight
+                    SUM(sale_item.selling_rate_e4 * sale_item.quantity_kg) / 10000.0 sp,
+                    SUM(sale_item.cost_rate_e4 * sale_item.quantity_kg) / 10000.0 cp,
+                    sale.freight_paise freight
                 FROM sale
                 JOIN sale_item ON sale_item.sale_id = sale.id
                 GROUP BY sale.id
@@ -775,7 +3981,7 @@ def register_routes(app: Flask) -> None:
         expense_monthly = dict(
             db.session.query(
                 func.strftime('%Y-%m', Expense.date),
-                func.sum(Expense.amount)
+                func.sum(Expense.amount_paise) / 100.0
             )
             .group_by(func.strftime('%Y-%m', Expense.date))
             .all()
@@ -848,7 +4054,7 @@ def register_routes(app: Flask) -> None:
         purchases = Purchase.query.all()
 
         total_expense = db.session.query(
-            func.sum(Expense.amount)
+            func.sum(Expense.amount_paise) / 100.0
         ).scalar() or 0
 
         total_sale_pending = round(sum(s.balance_due() for s in sales), 2)
@@ -876,7 +4082,7 @@ def register_routes(app: Flask) -> None:
         employees = Employee.query.all()
         salary_paid_raw = db.session.query(
             Expense.employee_id,
-            func.sum(Expense.amount)
+            func.sum(Expense.amount_paise) / 100.0
         ).filter(
             Expense.employee_id.isnot(None),
             db.func.strftime('%Y-%m', Expense.date) == current_ym
@@ -921,7 +4127,13 @@ def register_routes(app: Flask) -> None:
         q = (request.args.get("q") or "").strip()
         query = Client.query
         if q:
-            query = query.filter(Client.name.ilike(f"%{q}%"))
+            ids = search_index_ids(q, "client")
+            if ids is None:
+                query = query.filter(Client.name.ilike(f"%{q}%"))
+            else:
+                # The index matches word prefixes (also in address / GST /
+                # phone); the name still matches anywhere, as it always did
+                query = query.filter(db.or_(Client.id.in_(ids), Client.name.ilike(f"%{q}%")))
         rows = query.order_by(Client.name.asc()).all()
 
         # Compute outstanding balance per client for display
@@ -1161,7 +4373,7 @@ def register_routes(app: Flask) -> None:
             current_date=collection.date.strftime("%Y-%m-%d")
         )
 
-    @app.route("/client/collection/<int:collection_id>/delete")
+    @app.route("/client/collection/<int:collection_id>/delete", methods=["POST"])
     def delete_client_collection(collection_id):
         collection = ClientCollection.query.get_or_404(collection_id)
         client_name = collection.client.name
@@ -1284,7 +4496,7 @@ def register_routes(app: Flask) -> None:
             current_date=collection.date.strftime("%Y-%m-%d")
         )
 
-    @app.route("/vendor/collection/<int:collection_id>/delete")
+    @app.route("/vendor/collection/<int:collection_id>/delete", methods=["POST"])
     def delete_vendor_collection(collection_id):
         collection = VendorCollection.query.get_or_404(collection_id)
         vendor_name = collection.vendor_name
@@ -1327,6 +4539,7 @@ def register_routes(app: Flask) -> None:
 
     
     @app.route("/ledger")
+    @conditional_get("sales")
     def ledger_list():
         # Just a redirect or a simple search page for parties
         q = (request.args.get("q") or "").strip()
@@ -1334,6 +4547,7 @@ def register_routes(app: Flask) -> None:
         return render_template("ledger_list.html", clients=clients, q=q)
 
     @app.route("/ledger/<party_type>/<path:name>")
+    @conditional_get("sales", "purchases")
     def party_ledger(party_type, name):
         # name can be a single name or a comma-separated list
         is_multi = request.args.get("multi") == "1"
@@ -1344,6 +4558,21 @@ def register_routes(app: Flask) -> None:
         total_paid = 0
         display_name = ", ".join(names) if len(names) > 1 else names[0]
 
+        month_filter = request.args.get("month")
+        if month_filter:
+            try:
+                filter_yr, filter_mo = map(int, month_filter.split("-"))
+                filter_start = date(filter_yr, filter_mo, 1)
+            except Exception:
+                filter_start = None
+        else:
+            filter_start = None
+
+        # Start from the last close before the window; only later rows are read
+        close = last_close(before=filter_start)
+        since = close.as_of if close else None
+        side = "client" if party_type == "client" else "vendor"
+
         for n in names:
             n = n.strip()
             # 1. Opening Balance
@@ -1360,9 +4589,29 @@ def register_routes(app: Flask) -> None:
                     "party_name": n
                 })
 
+            # 2. Balance brought forward from the close (receivable / payable)
+            carried = closing_amounts(close, side, [n]).get(n, 0) / PAISE
+            if carried:
+                owed_to_us = carried if side == "client" else -carried
+                transactions.append({
+                    "date": None,
+                    "desc": f"Balance b/f as of {close.as_of.strftime('%d-%b-%Y')}" + (f" ({n})" if is_multi else ""),
+                    "ref": "",
+                    "debit": max(0.0, owed_to_us),
+                    "credit": max(0.0, -owed_to_us),
+                    "party_name": n
+                })
+
             if party_type == "client":
-                sales = Sale.query.filter_by(client_name=n).all()
-                for s in sales:
+                sales = Sale.query.filter_by(client_name=n)
+                payments = (SalePayment.query.join(Sale, Sale.id == SalePayment.sale_id)
+                            .filter(Sale.client_name == n, SalePayment.collection_id.is_(None)))
+                collections = ClientCollection.query.filter_by(client_id=client_obj.id) if client_obj else None
+                if since:
+                    sales = sales.filter(Sale.date > since)
+                    payments = payments.filter(SalePayment.date > since)
+                    collections = collections.filter(ClientCollection.date > since) if collections else None
+                for s in sales.all():
                     amt = s.total_amount()
                     total_billed += amt
                     balance = s.balance_due()
@@ -1378,22 +4627,21 @@ def register_routes(app: Flask) -> None:
                         "payment_status": status,
                         "sale_id": s.id
                     })
-                    for p in s.payments:
-                        if p.collection_id:
-                            continue # Linked to a bulk payment, handled below
-                        total_paid += p.amount
-                        transactions.append({
-                            "date": p.date,
-                            "desc": f"Payment Recd (Inv #{s.id})",
-                            "ref": f"/sale/{s.id}/payments",
-                            "debit": 0,
-                            "credit": p.amount,
-                            "id_for_sort": p.id,
-                            "party_name": n
-                        })
+                # Payments linked to a bulk payment are handled with the collections below
+                for p in payments.all():
+                    total_paid += p.amount
+                    transactions.append({
+                        "date": p.date,
+                        "desc": f"Payment Recd (Inv #{p.sale_id})",
+                        "ref": f"/sale/{p.sale_id}/payments",
+                        "debit": 0,
+                        "credit": p.amount,
+                        "id_for_sort": p.id,
+                        "party_name": n
+                    })
                 # 3. Direct Collections (Account Payments)
-                if client_obj:
-                    for c in client_obj.collections:
+                if collections is not None:
+                    for c in collections.all():
                         total_paid += c.amount
                         # Grouped description
                         inv_ids = [str(p.sale_id) for p in c.payments]
@@ -1412,8 +4660,15 @@ def register_routes(app: Flask) -> None:
                             "collection_id": c.id
                         })
             else: # vendor
-                purchases = Purchase.query.filter_by(vendor_name=n).all()
-                for p_rec in purchases:
+                purchases = Purchase.query.filter_by(vendor_name=n)
+                payments = (PurchasePayment.query.join(Purchase, Purchase.id == PurchasePayment.purchase_id)
+                            .filter(Purchase.vendor_name == n, PurchasePayment.collection_id.is_(None)))
+                vendor_collections = VendorCollection.query.filter_by(vendor_name=n)
+                if since:
+                    purchases = purchases.filter(Purchase.date > since)
+                    payments = payments.filter(PurchasePayment.date > since)
+                    vendor_collections = vendor_collections.filter(VendorCollection.date > since)
+                for p_rec in purchases.all():
                     cost = p_rec.total_cost()
                     total_billed += cost
                     balance = p_rec.balance_due()
@@ -1429,23 +4684,21 @@ def register_routes(app: Flask) -> None:
                         "payment_status": status,
                         "purchase_id": p_rec.id
                     })
-                    for pay in p_rec.payments:
-                        if pay.collection_id:
-                            continue  # Handled as a bulk payment row below
-                        total_paid += pay.amount
-                        transactions.append({
-                            "date": pay.date,
-                            "desc": f"Payment Paid (Inv #{p_rec.id})",
-                            "ref": f"/purchase/{p_rec.id}/payments",
-                            "debit": pay.amount,
-                            "credit": 0,
-                            "id_for_sort": pay.id,
-                            "party_name": n
-                        })
+                # Payments linked to a bulk payment are handled as bulk payment rows below
+                for pay in payments.all():
+                    total_paid += pay.amount
+                    transactions.append({
+                        "date": pay.date,
+                        "desc": f"Payment Paid (Inv #{pay.purchase_id})",
+                        "ref": f"/purchase/{pay.purchase_id}/payments",
+                        "debit": pay.amount,
+                        "credit": 0,
+                        "id_for_sort": pay.id,
+                        "party_name": n
+                    })
 
                 # Vendor bulk payments
-                vendor_collections = VendorCollection.query.filter_by(vendor_name=n).all()
-                for vc in vendor_collections:
+                for vc in vendor_collections.all():
                     total_paid += vc.amount
                     inv_ids = [str(p.purchase_id) for p in vc.payments]
                     desc = f"Bulk Payment ({vc.mode or 'N/A'})"
@@ -1471,16 +4724,6 @@ def register_routes(app: Flask) -> None:
         transactions.sort(key=sort_key)
 
         # Apply Month Filter & Rolling Opening Balance
-        month_filter = request.args.get("month")
-        if month_filter:
-            try:
-                filter_yr, filter_mo = map(int, month_filter.split("-"))
-                filter_start = date(filter_yr, filter_mo, 1)
-            except Exception:
-                filter_start = None
-        else:
-            filter_start = None
-
         if filter_start:
             pre_txs = []
             selected_txs = []
@@ -1559,6 +4802,7 @@ def register_routes(app: Flask) -> None:
         )
 
     @app.route("/ledger/combined/<path:name>")
+    @conditional_get("sales", "purchases")
     def combined_party_ledger(name):
         """Combined client + vendor ledger for parties that wear both hats."""
         name = name.strip()
@@ -1775,29 +5019,11 @@ def register_routes(app: Flask) -> None:
         )
 
     @app.route("/reports/sales-outstanding")
+    @conditional_get("sales")
     def sales_outstanding_report():
-
-        sales = Sale.query.all()
-
-        report = {}
-
-        for s in sales:
-            client = s.client_name
-
-            if client not in report:
-                report[client] = {
-                    "total_sales": 0,
-                    "total_received": 0,
-                    "balance": 0
-                }
-
-            report[client]["total_sales"] += s.total_amount()
-            report[client]["total_received"] += s.total_received()
-            report[client]["balance"] += s.balance_due()
-
         return render_template(
             "sales_outstanding_report.html",
-            report=report
+            client_report=get_sales_outstanding()
         )
 
     # Sales - create/edit
@@ -1847,17 +5073,10 @@ def register_routes(app: Flask) -> None:
                     sale.client_name = chosen_name
                     sale.freight = freight
                     sale.sale_type = sale_type
-                    
-                    # Reverse stock for old items
-                    for old_item in sale.items:
-                        if old_item.product_id:
-                            prod = Product.query.get(old_item.product_id)
-                            if prod:
-                                prod.change_stock(old_item.quantity_kg)
-                                adjust_batch_stock(old_item.product_id, old_item.cost_rate_per_kg or 0.0, old_item.quantity_kg)
-                                sync_product_total_stock(old_item.product_id)
 
-                    SaleItem.query.filter_by(sale_id=sale.id).delete()
+                # Lines are matched to existing SaleItems by line_id[] so an
+                # edit only touches what changed (see sync_sale_items).
+                lines = []
 
                 # =====================================================
                 # CASH MODE (Bottle)
@@ -1868,10 +5087,9 @@ def register_routes(app: Flask) -> None:
                     batches_list = request.form.getlist("batches[]")
                     sp_overrides = request.form.getlist("sp_batch[]")
                     gst_percents_cash = request.form.getlist("gst_percent_cash[]")
+                    line_ids_cash = request.form.getlist("cash_line_id[]")
 
                     total_batches = 0
-                    any_added = False
-                    total_gst_val = 0.0
 
                     for i in range(len(bt_ids)):
 
@@ -1899,21 +5117,18 @@ def register_routes(app: Flask) -> None:
                         else:
                             chosen_sp = bt.sp_per_batch()
 
-                        item = SaleItem(
-                            sale_id=sale.id,
-                            bottle_type_id=bt.id,
-                            quantity_kg=float(num_batches),
-                            cost_rate_per_kg=float(bt.cp_per_batch()),
-                            selling_rate_per_kg=float(chosen_sp),
-                            gst_percent=_to_float(gst_percents_cash[i] if i < len(gst_percents_cash) else 0, 0.0)
-                        )
-                        total_gst_val += (item.selling_rate_per_kg * item.quantity_kg) * (item.gst_percent / 100.0)
-
-                        db.session.add(item)
+                        lines.append({
+                            "id": _to_int(line_ids_cash[i] if i < len(line_ids_cash) else "", 0) or None,
+                            "product_id": None,
+                            "bottle_type_id": bt.id,
+                            "quantity_kg": float(num_batches),
+                            "cost_rate_per_kg": float(bt.cp_per_batch()),
+                            "selling_rate_per_kg": float(chosen_sp),
+                            "gst_percent": _to_float(gst_percents_cash[i] if i < len(gst_percents_cash) else 0, 0.0),
+                        })
                         total_batches += num_batches
-                        any_added = True
 
-                    if not any_added:
+                    if not lines:
                         raise ValueError("At least one bottle line is required")
 
                     sale.quantity_kg = total_batches
@@ -1929,12 +5144,12 @@ def register_routes(app: Flask) -> None:
                     sell_rates = request.form.getlist("sell_rate[]")
                     prod_ids_bill = request.form.getlist("product_id[]")
                     gst_percents_bill = request.form.getlist("gst_percent[]")
+                    line_ids_bill = request.form.getlist("line_id[]")
 
                     if not quantities:
                         raise ValueError("At least one line item is required")
 
                     total_qty = 0
-                    total_gst_val = 0.0
 
                     for i in range(len(quantities)):
                         q_val = quantities[i]
@@ -1946,27 +5161,26 @@ def register_routes(app: Flask) -> None:
                         qty_kg = to_kg(q_val or 0, u_val or "kg")
                         total_qty += qty_kg
 
-                        item = SaleItem(
-                            sale_id=sale.id,
-                            quantity_kg=qty_kg,
-                            cost_rate_per_kg=_to_float(cr, 0.0),
-                            selling_rate_per_kg=_to_float(sr, 0.0),
-                            product_id=int(p_id) if (p_id and p_id.strip()) else None,
-                            gst_percent=_to_float(gst_percents_bill[i] if i < len(gst_percents_bill) else 0, 0.0)
-                        )
-                        total_gst_val += (item.selling_rate_per_kg * item.quantity_kg) * (item.gst_percent / 100.0)
-                        db.session.add(item)
-                        
-                        # Decrement stock if product linked
-                        if item.product_id:
-                            prod = Product.query.get(item.product_id)
-                            if prod:
-                                prod.change_stock(-qty_kg)
-                                adjust_batch_stock(item.product_id, item.cost_rate_per_kg or 0.0, -qty_kg)
-                                sync_product_total_stock(item.product_id)
+                        lines.append({
+                            "id": _to_int(line_ids_bill[i] if i < len(line_ids_bill) else "", 0) or None,
+                            "product_id": int(p_id) if (p_id and p_id.strip()) else None,
+                            "bottle_type_id": None,
+                            "quantity_kg": qty_kg,
+                            "cost_rate_per_kg": _to_float(cr, 0.0),
+                            "selling_rate_per_kg": _to_float(sr, 0.0),
+                            "gst_percent": _to_float(gst_percents_bill[i] if i < len(gst_percents_bill) else 0, 0.0),
+                        })
 
                     sale.quantity_kg = total_qty
 
+                total_gst_val = sum(
+                    (l["selling_rate_per_kg"] * l["quantity_kg"]) * (l["gst_percent"] / 100.0) for l in lines
+                )
+
+                # Net stock change per (product, cost rate) - old lines put
+                # back, new lines taken out - applied once
+                apply_stock_deltas(sync_sale_items(sale, lines))
+
                 # =====================================================
                 # GST + MISC LOGIC (PHASE 2)
                 # =====================================================
@@ -2049,13 +5263,7 @@ def register_routes(app: Flask) -> None:
         sale = Sale.query.get_or_404(sale_id)
         try:
             # Reverse stock
-            for item in sale.items:
-                if item.product_id:
-                    prod = Product.query.get(item.product_id)
-                    if prod:
-                        prod.change_stock(item.quantity_kg)
-                        adjust_batch_stock(item.product_id, item.cost_rate_per_kg or 0.0, item.quantity_kg)
-                        sync_product_total_stock(item.product_id)
+            apply_stock_deltas(sync_sale_items(sale, []))
 
             db.session.delete(sale)
             commit_or_rollback()
@@ -2124,37 +5332,10 @@ def register_routes(app: Flask) -> None:
                 # -----------------------------
                 # Save Line Items
                 # -----------------------------
-                qty_list = request.form.getlist("quantity[]")
-                rate_list = request.form.getlist("rate[]")
-                prod_id_list = request.form.getlist("product_id[]")
-
-                subtotal = 0
-
-                for i in range(min(len(qty_list), len(rate_list))):
-                    q = qty_list[i]
-                    r = rate_list[i]
-                    p_id = prod_id_list[i] if i < len(prod_id_list) else ""
-
-                    if q and r:
-                        qty = float(q)
-                        rate = float(r)
-                        subtotal += qty * rate
-
-                        item = PurchaseItem(
-                            purchase_id=purchase.id,
-                            quantity_kg=qty,
-                            rate_per_kg=rate,
-                            product_id=int(p_id) if (p_id and p_id.strip()) else None
-                        )
-                        db.session.add(item)
-                        
-                        # Increment stock if product linked
-                        if item.product_id:
-                            prod = Product.query.get(item.product_id)
-                            if prod:
-                                prod.change_stock(qty)
-                                adjust_batch_stock(item.product_id, item.rate_per_kg or 0.0, qty)
-                                sync_product_total_stock(item.product_id)
+                lines = purchase_form_lines(request.form)
+                apply_stock_deltas(sync_purchase_items(purchase, lines), received_on=purchase.date)
+
+                subtotal = sum(l["quantity_kg"] * l["rate_per_kg"] for l in lines)
 
                 # Add freight to subtotal
                 subtotal += freight
@@ -2227,51 +5408,13 @@ def register_routes(app: Flask) -> None:
                 purchase.gst_percent = float(request.form.get("gst_percent") or 0)
 
                 # -----------------------------
-                # Delete Old Line Items & Reverse Stock
+                # Line Items: diff against the saved ones by line_id[]
+                # and apply one net batch change per (product, rate)
                 # -----------------------------
-                for old_item in purchase.items:
-                    if old_item.product_id:
-                        prod = Product.query.get(old_item.product_id)
-                        if prod:
-                            prod.change_stock(-old_item.quantity_kg)
-                            adjust_batch_stock(old_item.product_id, old_item.rate_per_kg or 0.0, -old_item.quantity_kg)
-                            sync_product_total_stock(old_item.product_id)
-
-                PurchaseItem.query.filter_by(purchase_id=purchase.id).delete()
+                lines = purchase_form_lines(request.form)
+                apply_stock_deltas(sync_purchase_items(purchase, lines), received_on=purchase.date)
 
-                qty_list = request.form.getlist("quantity[]")
-                rate_list = request.form.getlist("rate[]")
-                prod_id_list = request.form.getlist("product_id[]")
-
-                subtotal = 0
-
-                # -----------------------------
-                # Re-add Line Items & Apply Stock
-                # -----------------------------
-                for i in range(min(len(qty_list), len(rate_list))):
-                    q = qty_list[i]
-                    r = rate_list[i]
-                    p_id = prod_id_list[i] if i < len(prod_id_list) else ""
-
-                    if q and r:
-                        qty = float(q)
-                        rate = float(r)
-                        subtotal += qty * rate
-
-                        new_item = PurchaseItem(
-                            purchase_id=purchase.id,
-                            quantity_kg=qty,
-                            rate_per_kg=rate,
-                            product_id=int(p_id) if (p_id and p_id.strip()) else None
-                        )
-                        db.session.add(new_item)
-                        
-                        if new_item.product_id:
-                            prod = Product.query.get(new_item.product_id)
-                            if prod:
-                                prod.change_stock(qty)
-                                adjust_batch_stock(new_item.product_id, new_item.rate_per_kg or 0.0, qty)
-                                sync_product_total_stock(new_item.product_id)
+                subtotal = sum(l["quantity_kg"] * l["rate_per_kg"] for l in lines)
 
                 # Add freight
                 subtotal += purchase.freight
@@ -2319,13 +5462,7 @@ def register_routes(app: Flask) -> None:
         purchase = Purchase.query.get_or_404(purchase_id)
 
         # Reverse stock
-        for item in purchase.items:
-            if item.product_id:
-                prod = Product.query.get(item.product_id)
-                if prod:
-                    prod.change_stock(-item.quantity_kg)
-                    adjust_batch_stock(item.product_id, item.rate_per_kg or 0.0, -item.quantity_kg)
-                    sync_product_total_stock(item.product_id)
+        apply_stock_deltas(sync_purchase_items(purchase, []))
 
         db.session.delete(purchase)
         db.session.commit()
@@ -2403,61 +5540,33 @@ def register_routes(app: Flask) -> None:
         status_filter = request.args.get("status", "pending")
         q_list = [v for v in request.args.getlist("q") if v.strip()]
 
-        all_purchases = Purchase.query.order_by(Purchase.date.desc()).all()
-
-        if status_filter == "paid":
-            purchases = [p for p in all_purchases if p.payment_status() == "Paid"]
-        elif status_filter == "unpaid":
-            purchases = [p for p in all_purchases if p.payment_status() == "Unpaid"]
-        elif status_filter == "partial":
-            purchases = [p for p in all_purchases if p.payment_status() == "Partial"]
-        else:
-            purchases = [p for p in all_purchases if p.payment_status() in ["Unpaid", "Partial"]]
-
-        if q_list:
-            purchases = [p for p in purchases if p.vendor_name in q_list]
+        purchases = purchase_balances(vendors=q_list or None, status=status_filter)
+        vendor_report = vendor_balances(vendors=q_list) if q_list else {}
 
         clients = Client.query.order_by(Client.name).all()
 
         return render_template(
             "payments_list.html",
             purchases=purchases,
+            vendor_report=vendor_report,
             status_filter=status_filter,
             q_list=q_list,
             clients=clients
         )
 
 
-
-
     @app.route("/reports/vendor-dues")
+    @conditional_get("purchases")
     def vendor_dues_report():
-
-        purchases = Purchase.query.all()
-
-        report = {}
-
-        for p in purchases:
-            vendor = p.vendor_name
-
-            if vendor not in report:
-                report[vendor] = {
-                    "total_purchase": 0,
-                    "total_paid": 0,
-                    "balance": 0
-                }
-
-            report[vendor]["total_purchase"] += p.total_cost()
-            report[vendor]["total_paid"] += p.total_paid()
-            report[vendor]["balance"] += p.balance_due()
-
         return render_template(
-            "vendor_dues_report.html",
-            report=report
+            "vendor_dues.html",
+            vendor_report=vendor_balances(),
+            credit_days=VENDOR_CREDIT_DAYS
         )
 
 
     @app.route("/outstanding-report")
+    @conditional_get("sales", "purchases")
     def outstanding_report():
 
         vendor_report = get_vendor_dues()
@@ -2466,10 +5575,45 @@ def register_routes(app: Flask) -> None:
         return render_template(
             "outstanding_report.html",
             vendor_report=vendor_report,
-            client_report=client_report
+            client_report=client_report,
+            credit_days=VENDOR_CREDIT_DAYS
         )
 
+    @app.route("/period-close", methods=["GET", "POST"])
+    def period_close():
+        if request.method == "POST":
+            if request.form.get("action") == "reopen":
+                close = reopen_last_close()
+                commit_or_rollback()
+                if close:
+                    flash(f"Reopened the period closed up to {close.as_of.strftime('%d-%b-%Y')}.", "info")
+                return redirect(url_for("period_close"))
+            try:
+                as_of = _parse_date(request.form.get("as_of") or "")
+                close = close_period(as_of, (request.form.get("notes") or "").strip())
+                commit_or_rollback()
+                flash(f"Books closed up to {as_of.strftime('%d-%b-%Y')}; "
+                      f"{len(close.balances)} balances carried forward.", "success")
+            except ValueError as exc:
+                db.session.rollback()
+                flash(str(exc), "danger")
+            return redirect(url_for("period_close"))
+
+        closes = PeriodClose.query.order_by(PeriodClose.as_of.desc()).all()
+        summary = {}
+        for close_id, kind, count, amount, qty in db.session.query(
+            ClosingBalance.close_id, ClosingBalance.kind, func.count(ClosingBalance.id),
+            func.sum(ClosingBalance.amount_paise), func.sum(ClosingBalance.quantity_kg),
+        ).group_by(ClosingBalance.close_id, ClosingBalance.kind):
+            summary[(close_id, kind)] = {"count": count, "amount": (amount or 0) / PAISE, "qty": qty or 0.0}
+
+        # Default to the end of the last financial year (31 March)
+        today = date.today()
+        fy_end = date(today.year if today.month > 3 else today.year - 1, 3, 31)
+        return render_template("period_close.html", closes=closes, summary=summary, default_as_of=fy_end.isoformat())
+
     @app.route("/reports/profitability")
+    @conditional_get("sales")
     def party_profitability():
         sales = Sale.query.all()
         report = {}
@@ -2505,6 +5649,7 @@ def register_routes(app: Flask) -> None:
         return render_template("party_profitability_report.html", report=sorted_report)
 
     @app.route("/reports/payment-aging")
+    @conditional_get("sales")
     def payment_aging():
         sales = Sale.query.all()
         today = datetime.now().date()
@@ -2556,46 +5701,28 @@ def register_routes(app: Flask) -> None:
                                total_outstanding=total_outstanding)
 
     @app.route("/reports/expense-analysis")
+    @conditional_get("expenses")
     def expense_analysis():
-        month_filter = request.args.get("month")
-        if not month_filter:
-            month_filter = datetime.now().strftime("%Y-%m")
-
-        all_expenses = Expense.query.all()
-        months = sorted(list(set(e.date.strftime("%Y-%m") for e in all_expenses)), reverse=True)
-        if month_filter not in months and month_filter != datetime.now().strftime("%Y-%m"):
-            months.insert(0, month_filter)
-
-        expenses = [e for e in all_expenses if e.date.strftime("%Y-%m") == month_filter]
-        
-        report = {}
-        total_amount = 0
-        
-        for e in expenses:
-            cat = e.category
-            if cat not in report:
-                report[cat] = {
-                    "amount": 0,
-                    "count": 0
-                }
-            
-            report[cat]["amount"] += e.amount
-            report[cat]["count"] += 1
-            total_amount += e.amount
-            
-        # Add percentages and format
-        for cat in report:
-            amt = report[cat]["amount"]
-            report[cat]["pct"] = (amt / total_amount * 100) if total_amount > 0 else 0
-            
-        # Sort by amount descending
-        sorted_report = dict(sorted(report.items(), key=lambda x: x[1]['amount'], reverse=True))
-
-        return render_template("expense_analysis_report.html", 
-                               report=sorted_report, 
-                               total_amount=total_amount,
+        this_month = datetime.now().strftime("%Y-%m")
+        month_from = request.args.get("from") or request.args.get("month") or this_month
+        month_to = request.args.get("to") or month_from
+        try:
+            summary = expense_summary(month_from, month_to)
+        except ValueError:
+            summary = expense_summary(this_month)
+
+        months = expense_months()
+        for m in (summary["months"][0], this_month):
+            if m not in months:
+                months.insert(0, m)
+
+        return render_template("expense_analysis_report.html",
+                               report=summary["report"],
+                               total_amount=summary["total"],
+                               summary=summary,
                                months=months,
-                               selected_month=month_filter)
+                               selected_month=summary["months"][0],
+                               month_to=summary["months"][-1])
 
     @app.route("/employees", methods=["GET"])
     def employees_list():
@@ -2640,7 +5767,14 @@ def register_routes(app: Flask) -> None:
         
         query = Expense.query.filter_by(employee_id=id)
         if month_filter:
-            query = query.filter(db.func.strftime('%Y-%m', Expense.date) == month_filter)
+            try:
+                # Date range rather than strftime() so ix_expense_date applies
+                query = query.filter(
+                    Expense.date >= _month_start(month_filter),
+                    Expense.date < _month_start(_shift_month(month_filter, 1)),
+                )
+            except ValueError:
+                pass
             
         payments = query.order_by(Expense.date.desc(), Expense.id.desc()).all()
         
@@ -2703,15 +5837,17 @@ def register_routes(app: Flask) -> None:
             name = request.form.get("name")
             min_stock = float(request.form.get("min_stock") or 0)
             val_rate = float(request.form.get("valuation_rate") or 0)
+            method = request.form.get("costing_method")
             if name:
-                p = Product(name=name, min_stock_kg=min_stock, valuation_rate=val_rate)
+                p = Product(name=name, min_stock_kg=min_stock, valuation_rate=val_rate,
+                            costing_method=method if method in COSTING_METHODS else "manual")
                 db.session.add(p)
                 db.session.commit()
                 flash(f"Product {name} added", "success")
             return redirect(url_for("products_list"))
         
         products = Product.query.order_by(Product.name.asc()).all()
-        return render_template("products_list.html", products=products)
+        return render_template("products_list.html", products=products, costing_methods=COSTING_METHODS)
 
     @app.route("/product/<int:id>/edit", methods=["POST"])
     def edit_product(id):
@@ -2723,6 +5859,9 @@ def register_routes(app: Flask) -> None:
         p.name = request.form.get("name")
         p.min_stock_kg = float(request.form.get("min_stock") or 0)
         p.valuation_rate = new_val_rate
+        if request.form.get("costing_method") in COSTING_METHODS:
+            # Applies to sale lines saved from now on; existing lines keep their cost
+            p.costing_method = request.form["costing_method"]
         
         current_sum = sum(b.quantity_kg for b in p.batches)
         diff = new_stock - current_sum
@@ -2761,13 +5900,14 @@ def register_routes(app: Flask) -> None:
             new_rate_str = request.form.get("new_rate")
             new_qty_str = request.form.get("new_qty")
             if new_rate_str and new_rate_str.strip() and new_qty_str and new_qty_str.strip():
-                rate_val = round(float(new_rate_str), 4)
+                rate_key = to_rate_e4(new_rate_str)
                 qty_val = round(float(new_qty_str), 2)
-                existing = ProductBatch.query.filter_by(product_id=id, rate=rate_val).first()
+                existing = ProductBatch.query.filter_by(product_id=id, rate_key=rate_key).first()
                 if existing:
                     existing.quantity_kg = qty_val
                 else:
-                    new_batch = ProductBatch(product_id=id, rate=rate_val, quantity_kg=qty_val)
+                    new_batch = ProductBatch(product_id=id, rate_key=rate_key, quantity_kg=qty_val,
+                                             received_on=date.today())
                     db.session.add(new_batch)
                     
             sync_product_total_stock(id)
@@ -2793,14 +5933,10 @@ def register_routes(app: Flask) -> None:
         return redirect(url_for("product_stock_ledger", id=id))
 
     @app.route("/product/<int:id>/ledger")
+    @conditional_get("stock", "sales", "purchases", "masters")
     def product_stock_ledger(id):
         p = Product.query.get_or_404(id)
         
-        # 1. Fetch Purchase transactions
-        purchases_query = db.session.query(PurchaseItem, Purchase).join(Purchase).filter(PurchaseItem.product_id == id).all()
-        # 2. Fetch Sale transactions
-        sales_query = db.session.query(SaleItem, Sale).join(Sale).filter(SaleItem.product_id == id).all()
-        
         # Apply Month Filter
         month_filter = request.args.get("month")
         if month_filter:
@@ -2812,7 +5948,24 @@ def register_routes(app: Flask) -> None:
         else:
             filter_start = None
 
-        # Calculate lifetime totals
+        # Lines dated after the last close before the window; stock held at
+        # the close comes from closing_balance
+        close = last_close(before=filter_start)
+
+        # 1. Fetch Purchase transactions
+        purchases_query = db.session.query(PurchaseItem, Purchase).join(Purchase).filter(PurchaseItem.product_id == id)
+        # 2. Fetch Sale transactions
+        sales_query = db.session.query(SaleItem, Sale).join(Sale).filter(SaleItem.product_id == id)
+        carried = []
+        if close:
+            purchases_query = purchases_query.filter(Purchase.date > close.as_of)
+            sales_query = sales_query.filter(Sale.date > close.as_of)
+            carried = ClosingBalance.query.filter_by(close_id=close.id, ref_id=id).filter(
+                ClosingBalance.kind.in_(("product", "batch"))).all()
+        purchases_query = purchases_query.all()
+        sales_query = sales_query.all()
+
+        # Calculate lifetime totals (since the close, if any)
         lifetime_added = sum(item.quantity_kg or 0.0 for item, purchase in purchases_query)
         lifetime_reduced = sum(item.quantity_kg or 0.0 for item, sale in sales_query)
         
@@ -2885,7 +6038,8 @@ def register_routes(app: Flask) -> None:
             entry["running_bal"] = running_bal
             
         # Prepend starting balance baseline entry
-        if filter_start or starting_stock != 0:
+        closing = next((c for c in carried if c.kind == "product"), None)
+        if filter_start or starting_stock != 0 or close:
             earliest_date = filter_start if filter_start else min((e["date"] for e in ledger_entries), default=None)
             baseline_entry = {
                 "date": earliest_date,
@@ -2899,6 +6053,15 @@ def register_routes(app: Flask) -> None:
                 "ref_text": "System Baseline",
                 "running_bal": starting_stock
             }
+            if close and not filter_start:
+                # Held at the close, valued at its batch rates
+                baseline_entry.update({
+                    "date": close.as_of,
+                    "party": f"Carry Forward (closed {close.as_of.strftime('%d-%b-%Y')})",
+                    "cp": round(closing.amount / closing.quantity_kg, 2) if closing and closing.quantity_kg else 0.0,
+                    "total_val": closing.amount if closing else 0.0,
+                    "ref_text": "Period Close",
+                })
             ledger_entries.insert(0, baseline_entry)
             
         ledger_entries.reverse()
@@ -2907,7 +6070,7 @@ def register_routes(app: Flask) -> None:
         estimated_valuation = round(display_stock * (p.valuation_rate or 0.0), 2)
         
         # Fetch batches from the database
-        db_batches = ProductBatch.query.filter_by(product_id=id).order_by(ProductBatch.rate.desc()).all()
+        db_batches = ProductBatch.query.filter_by(product_id=id).order_by(ProductBatch.rate_key.desc()).all()
         breakdown = []
         for batch in db_batches:
             breakdown.append({
@@ -2917,38 +6080,50 @@ def register_routes(app: Flask) -> None:
                 "total_val": round(batch.quantity_kg * batch.rate, 2)
             })
             
-        # Compute transaction history for each batch based on price rate matching
-        from collections import defaultdict
-        batch_histories = defaultdict(list)
-        for batch in db_batches:
-            r_val = round(batch.rate, 4)
-            # Additions
-            for item, purchase in purchases_query:
-                if round(item.rate_per_kg or 0.0, 4) == r_val:
-                    batch_histories[batch.id].append({
-                        "date": purchase.date,
-                        "type": "Purchase",
-                        "party": purchase.vendor_name,
-                        "qty_change": item.quantity_kg or 0.0,
-                        "ref_url": url_for("edit_purchase", purchase_id=purchase.id),
-                        "ref_text": f"Purchase #{purchase.id}"
-                    })
-            # Reductions
-            for item, sale in sales_query:
-                if round(item.cost_rate_per_kg or 0.0, 4) == r_val:
-                    batch_histories[batch.id].append({
-                        "date": sale.date,
-                        "type": "Sale",
-                        "party": sale.client_name,
-                        "qty_change": -(item.quantity_kg or 0.0),
-                        "ref_url": url_for("sales_form", sale_id=sale.id),
-                        "ref_text": f"Sale #{sale.id}"
-                    })
-            # Sort newest transactions first
-            batch_histories[batch.id].sort(key=lambda x: x["date"], reverse=True)
+        # Transaction history per batch: each line goes to the batch with its
+        # rate key, one dict probe per line instead of a pass per batch
+        batch_ids = {batch.rate_key: batch.id for batch in db_batches}
+        batch_histories = {batch.id: [] for batch in db_batches}
+        for item, purchase in purchases_query:
+            batch_id = batch_ids.get(item.rate_e4 or 0)
+            if batch_id is not None:
+                batch_histories[batch_id].append({
+                    "date": purchase.date,
+                    "type": "Purchase",
+                    "party": purchase.vendor_name,
+                    "qty_change": item.quantity_kg or 0.0,
+                    "ref_url": url_for("edit_purchase", purchase_id=purchase.id),
+                    "ref_text": f"Purchase #{purchase.id}"
+                })
+        for item, sale in sales_query:
+            batch_id = batch_ids.get(item.cost_rate_e4 or 0)
+            if batch_id is not None:
+                batch_histories[batch_id].append({
+                    "date": sale.date,
+                    "type": "Sale",
+                    "party": sale.client_name,
+                    "qty_change": -(item.quantity_kg or 0.0),
+                    "ref_url": url_for("sales_form", sale_id=sale.id),
+                    "ref_text": f"Sale #{sale.id}"
+                })
+        # What each batch held at the close
+        for c in carried:
+            batch_id = batch_ids.get(c.rate_key) if c.kind == "batch" else None
+            if batch_id is not None:
+                batch_histories[batch_id].append({
+                    "date": close.as_of,
+                    "type": "Carry Forward",
+                    "party": "Period Close",
+                    "qty_change": c.quantity_kg or 0.0,
+                    "ref_url": None,
+                    "ref_text": "Period Close"
+                })
+        # Sort newest transactions first
+        for history in batch_histories.values():
+            history.sort(key=lambda x: x["date"], reverse=True)
             
         display_stock = running_bal if filter_start else p.current_stock_kg
-        estimated_valuation = sum(b["total_val"] for b in breakdown)
+        estimated_valuation = p.stock_value
 
         return render_template(
             "product_ledger.html",
@@ -2964,11 +6139,13 @@ def register_routes(app: Flask) -> None:
         )
 
     @app.route("/reports/stock")
+    @conditional_get("stock")
     def stock_report():
         products = Product.query.all()
         return render_template("stock_report.html", products=products)
 
     @app.route("/reports/monthly-performance")
+    @conditional_get("sales", "purchases", "stock", "expenses")
     def monthly_performance_report():
         monthly_raw = db.session.execute(
             text("""
@@ -2976,15 +6153,15 @@ def register_routes(app: Flask) -> None:
                 ROUND(SUM(qty_kg),2) qty_kg,
                 ROUND(SUM(sp),2) sp,
                 ROUND(SUM(cp),2) cp,
-                ROUND(SUM(freight),2) freight
+                ROUND(SUM(freight) / 100.0, 2) freight
             FROM (
                 SELECT
                     strftime('%Y-%m', sale.date) ym,
                     sale.id,
                     SUM(sale_item.quantity_kg) qty_kg,
-                    SUM(sale_item.selling_rate_per_kg * sale_item.quantity_kg) sp,
-                    SUM(sale_item.cost_rate_per_kg * sale_item.quantity_kg) cp,
-                    COALESCE(sale.freight,0) freight
+                    SUM(sale_item.selling_rate_e4 * sale_item.quantity_kg) / 10000.0 sp,
+                    SUM(sale_item.cost_rate_e4 * sale_item.quantity_kg) / 10000.0 cp,
+                    sale.freight_paise freight
                 FROM sale
                 JOIN sale_item ON sale_item.sale_id = sale.id
                 GROUP BY sale.id
@@ -2997,7 +6174,7 @@ def register_routes(app: Flask) -> None:
         expense_monthly = dict(
             db.session.query(
                 func.strftime('%Y-%m', Expense.date),
-                func.sum(Expense.amount)
+                func.sum(Expense.amount_paise) / 100.0
             )
             .group_by(func.strftime('%Y-%m', Expense.date))
             .all()
@@ -3057,6 +6234,7 @@ def register_routes(app: Flask) -> None:
         )
 
     @app.route("/reports/monthly-pivot")
+    @conditional_get("sales", "stock")
     def monthly_pivot_report():
         from collections import defaultdict
 
@@ -3136,12 +6314,13 @@ def register_routes(app: Flask) -> None:
 
     # Reports & Export
     @app.route("/reports")
+    @conditional_get("sales")
     def reports():
         client_rows_sql = text(
             """
             SELECT sale.client_name as client_name,
                    ROUND(SUM(sale_item.quantity_kg), 2) AS qty_kg,
-                   ROUND(SUM(sale_item.selling_rate_per_kg * sale_item.quantity_kg), 2) AS sp
+                   ROUND(SUM(sale_item.selling_rate_e4 * sale_item.quantity_kg) / 10000.0, 2) AS sp
             FROM sale_item JOIN sale ON sale_item.sale_id = sale.id
             GROUP BY client_name
             ORDER BY sp DESC
@@ -3175,6 +6354,7 @@ def register_routes(app: Flask) -> None:
         return render_template("reports.html", rows=enriched, totals=totals)
 
     @app.route("/export.csv")
+    @conditional_get("sales")
     def export_csv():
         output = io.StringIO()
         writer = csv.writer(output)
@@ -3207,6 +6387,123 @@ def register_routes(app: Flask) -> None:
         fname = f"hcl_sales_export_{datetime.now(ZoneInfo('Asia/Kolkata')).strftime('%Y%m%d_%H%M%S')}.csv"
         return send_file(mem, as_attachment=True, download_name=fname, mimetype="text/csv")
 
+    @app.route("/import", methods=["GET", "POST"])
+    def import_page():
+        # Preview saves the upload under instance/imports and hands back a
+        # token; the confirm step re-reads that file and writes it.
+        upload_dir = os.path.join(app.instance_path, "imports")
+        kind = request.values.get("kind") or "sale"
+        plan = None
+        token = None
+        path = None
+
+        if request.method == "POST":
+            try:
+                if kind not in IMPORT_KINDS:
+                    raise ValueError("Choose sales or purchases")
+                token = request.form.get("token") or ""
+                if token:
+                    if not re.fullmatch(r"[0-9a-f]{32}\.(csv|xlsx|xlsm)", token):
+                        raise ValueError("Invalid import token")
+                    path = os.path.join(upload_dir, token)
+                    if not os.path.exists(path):
+                        raise ValueError("Upload expired, please choose the file again")
+                    with open(path, "rb") as f:
+                        plan = import_invoices(kind, f, token, dry_run=True)
+                    # Parsed and validated outside the lock; only the inserts
+                    # (and apply_import's closed-period check) run inside it
+                    with write_transaction():
+                        written = apply_import(plan)
+                    os.remove(path)
+                    flash(f"Imported {written['invoices']} {kind}s ({written['lines']} lines)", "success")
+                    return redirect(url_for("sales_list" if kind == "sale" else "purchases"))
+
+                upload = request.files.get("file")
+                if not upload or not upload.filename:
+                    raise ValueError("Choose a file to import")
+                ext = os.path.splitext(upload.filename)[1].lower()
+                if ext not in (".csv", ".xlsx", ".xlsm"):
+                    raise ValueError("Upload a .csv or .xlsx file")
+                _prune_uploads(upload_dir)
+                os.makedirs(upload_dir, exist_ok=True)
+                token = uuid.uuid4().hex + ext
+                path = os.path.join(upload_dir, token)
+                upload.save(path)
+                with open(path, "rb") as f:
+                    plan = import_invoices(kind, f, token, dry_run=True)
+                if plan["error_count"] or not plan["invoices"]:
+                    # Nothing to confirm; the fixed file comes in as a new upload
+                    _discard_upload(path)
+                    token = None
+            except Exception as exc:
+                db.session.rollback()
+                _discard_upload(path)
+                flash(WRITE_BUSY_MESSAGE if is_locked_error(exc) else f"Error: {exc}", "danger")
+                plan = None
+                token = None
+
+        return render_template("import.html", kind=kind, plan=plan, token=token)
+
+    @app.route("/bank-import", methods=["GET", "POST"])
+    def bank_import():
+        # Same upload-token flow as /import: the review screen re-posts the
+        # token with per-line party overrides and the accepted line numbers.
+        upload_dir = os.path.join(app.instance_path, "imports")
+        statement = None
+        token = None
+        path = None
+
+        if request.method == "POST":
+            try:
+                token = request.form.get("token") or ""
+                if token:
+                    if not re.fullmatch(r"[0-9a-f]{32}\.(csv|xlsx|xlsm)", token):
+                        raise ValueError("Invalid import token")
+                    path = os.path.join(upload_dir, token)
+                    if not os.path.exists(path):
+                        raise ValueError("Upload expired, please choose the statement again")
+                else:
+                    upload = request.files.get("file")
+                    if not upload or not upload.filename:
+                        raise ValueError("Choose a statement file")
+                    ext = os.path.splitext(upload.filename)[1].lower()
+                    if ext not in (".csv", ".xlsx", ".xlsm"):
+                        raise ValueError("Upload a .csv or .xlsx file")
+                    _prune_uploads(upload_dir)
+                    os.makedirs(upload_dir, exist_ok=True)
+                    token = uuid.uuid4().hex + ext
+                    path = os.path.join(upload_dir, token)
+                    upload.save(path)
+
+                with open(path, "rb") as f:
+                    statement = read_bank_statement(f, token)
+                overrides = {}
+                for key, value in request.form.items():
+                    if key.startswith("party_") and value.strip():
+                        overrides[_to_int(key[len("party_"):])] = value.strip()
+                if request.form.get("action") == "post":
+                    accepted = {_to_int(v) for v in request.form.getlist("accept")}
+                    # Matched against the open balances as they are under the lock
+                    with write_transaction():
+                        match_statement(statement["lines"], overrides)
+                        for l in statement["lines"]:
+                            l["accept"] = l["line"] in accepted
+                        written = post_bank_matches(statement["lines"])
+                    os.remove(path)
+                    flash(f"Posted {written['sale']} receipt(s) and {written['purchase']} payment(s) "
+                          f"with {written['payments']} invoice allocation(s)", "success")
+                    return redirect(url_for("bank_import"))
+                match_statement(statement["lines"], overrides)
+            except Exception as exc:
+                db.session.rollback()
+                _discard_upload(path)
+                flash(WRITE_BUSY_MESSAGE if is_locked_error(exc) else f"Error: {exc}", "danger")
+                statement = None
+                token = None
+
+        parties = db.session.execute(db.select(Client.name).order_by(Client.name)).scalars().all()
+        return render_template("bank_import.html", statement=statement, token=token, parties=parties)
+
     # Bottle types
     @app.route("/bottles")
     def bottles_list():
@@ -3274,8 +6571,124 @@ def register_routes(app: Flask) -> None:
         return redirect(url_for("bottles_list"))
 
 
+    # --- Background jobs ---
+    @app.route("/jobs", methods=["POST"])
+    def job_submit():
+        data = request.get_json(silent=True) or request.form
+        parts = urlsplit((data.get("url") or "").strip())
+        path = parts.path
+        url = f"{path}?{parts.query}" if parts.query else path
+        try:
+            endpoint, _args = app.url_map.bind("").match(path, method="GET")
+        except Exception:
+            endpoint = None
+        if endpoint not in JOB_ENDPOINTS:
+            return jsonify({"error": "this page cannot run as a background job"}), 400
+        job = submit_job(app, endpoint, url)
+        return jsonify(job.to_dict()), 202
+
+    @app.route("/jobs/<job_id>")
+    def job_status(job_id):
+        job = BackgroundJob.query.get_or_404(job_id)
+        if job.status in ("queued", "running") and job.created_at < datetime.utcnow() - JOB_TIMEOUT:
+            # The worker that owned it died or restarted
+            with write_transaction():
+                job = db.session.get(BackgroundJob, job_id)
+                if job.status in ("queued", "running"):
+                    job.status = "failed"
+                    job.error = "timed out"
+        return jsonify(job.to_dict())
+
+    @app.route("/jobs/<job_id>/result")
+    def job_result(job_id):
+        job = BackgroundJob.query.get_or_404(job_id)
+        if job.status != "done" or not os.path.exists(job.result_path or ""):
+            return jsonify({"error": "result not available"}), 404
+        return send_file(
+            job.result_path,
+            mimetype=job.mimetype,
+            as_attachment=bool(job.download_name),
+            download_name=job.download_name,
+        )
+
+    # --- Write-lock contention counters (see _begin_immediate) ---
+    @app.route("/api/write-contention")
+    def write_contention_api():
+        # Per-worker counters since it started; ALL plus one entry per endpoint
+        return jsonify({
+            "pid": os.getpid(),
+            "busy_timeout_ms": SQLITE_BUSY_TIMEOUT_MS,
+            "retry_attempts": WRITE_RETRY_ATTEMPTS,
+            "endpoints": write_contention_stats(),
+        })
+
+    # --- Last-rate lookup (rate autofill on sale / purchase forms) ---
+    @app.route("/api/last-rates")
+    @conditional_get("sales", "purchases")
+    def api_last_rates():
+        """
+        Last rate per product for one party, for every line of a form at once.
+          ?side=sale|purchase&party=<name>&product_id=1,2,3
+          (party_id=<client id> may be sent instead of party)
+        """
+        side = request.args.get("side", "sale")
+        if side not in _PRICE_SIDES:
+            return jsonify({"error": "side must be sale or purchase"}), 400
+        party = (request.args.get("party") or "").strip()
+        party_id = request.args.get("party_id", type=int)
+        if not party and party_id:
+            client = Client.query.get(party_id)
+            party = client.name if client else ""
+        product_ids = {_to_int(p) for p in (request.args.get("product_id") or "").split(",")} - {0}
+        if not party or not product_ids:
+            return jsonify({"party": party, "rates": {}})
+        rates = last_rates(side, party, product_ids)
+        return jsonify({"party": party, "rates": {str(pid): r.to_dict() for pid, r in rates.items()}})
+
+    # --- Global search (FTS5) ---
+    SEARCH_LINKS = {
+        "lead": lambda i, parent: url_for("leads_page"),
+        "client": lambda i, parent: url_for("clients_form", client_id=i),
+        "sale_payment": lambda i, parent: url_for("sale_payments_detail", sale_id=parent),
+        "purchase_payment": lambda i, parent: url_for("purchase_payments", purchase_id=parent),
+        "client_collection": lambda i, parent: url_for("edit_client_collection", collection_id=i),
+        "vendor_collection": lambda i, parent: url_for("edit_vendor_collection", collection_id=i),
+    }
+    # Payment hits link to their invoice: one lookup per kind for all hits
+    SEARCH_PARENTS = {
+        "sale_payment": (SalePayment.id, SalePayment.sale_id),
+        "purchase_payment": (PurchasePayment.id, PurchasePayment.purchase_id),
+    }
+
+    @app.route("/api/search")
+    @conditional_get("sales", "purchases", "leads")
+    def api_search():
+        """
+        Ranked search over leads, clients and payment notes.
+          ?q=<words>           every word must match (prefix match)
+          ?kind=lead,client    optional kind filter
+          ?limit=20
+        Highlighted fields (`title`, `snippet`) are HTML-escaped with <mark> tags.
+        """
+        q = (request.args.get("q") or "").strip()
+        kinds = [k for k in (request.args.get("kind") or "").split(",") if k]
+        limit = min(max(_to_int(request.args.get("limit"), 20), 1), 100)
+        try:
+            hits = search_all(q, kinds=kinds or None, limit=limit)
+        except OperationalError as exc:
+            return jsonify({"error": str(exc.orig)}), 400
+        parents = {}
+        for kind, (id_col, parent_col) in SEARCH_PARENTS.items():
+            ids = [h["id"] for h in hits if h["kind"] == kind]
+            if ids:
+                parents[kind] = dict(db.session.execute(select(id_col, parent_col).where(id_col.in_(ids))).all())
+        for h in hits:
+            h["url"] = SEARCH_LINKS[h["kind"]](h["id"], parents.get(h["kind"], {}).get(h["id"]))
+        return jsonify({"q": q, "results": hits})
+
     # --- Leads / Locations UI + API ---
-    DEAL_CHOICES = ["Need To Visit", "In Discussion", "Deal Closed", "Deal Rejected"]
+    LEADS_PAGE_SIZE = 200
+    LEADS_MAX_PAGE_SIZE = 1000
 
     @app.route("/leads")
     def leads_page():
@@ -3292,36 +6705,79 @@ def register_routes(app: Flask) -> None:
 
     # Leads API
     @app.route("/api/leads", methods=["GET"])
+    @conditional_get("leads")
     def api_leads_list():
+        """
+        Lead list, newest first: a bare JSON list of every matching lead.
+
+        Passing any of these returns a page instead,
+        {items, next_cursor, removed, server_time}:
+          ?limit=200&cursor=<next_cursor>   keyset paging on id
+          ?updated_since=<server_time>      only leads changed since a previous
+                                            sync; `removed` lists ids deleted or
+                                            no longer matching the filters
+        """
+        paged = any(k in request.args for k in ("limit", "cursor", "updated_since"))
         location_id = request.args.get("location_id", type=int)
         deal_status_param = request.args.get("deal_status")  # comma-separated string if multiple selected
+        limit = min(max(request.args.get("limit", LEADS_PAGE_SIZE, type=int), 1), LEADS_MAX_PAGE_SIZE)
+        cursor = request.args.get("cursor", type=int)
+        since_raw = request.args.get("updated_since")
+        try:
+            since = datetime.fromisoformat(since_raw) if since_raw else None
+        except ValueError:
+            return jsonify({"error": "updated_since must be an ISO timestamp"}), 400
 
-        # Start query
-        query = Lead.query.order_by(Lead.created_at.desc())
+        # Leave a little slack for writes still committing while we read;
+        # re-sending a lead on the next sync is harmless.
+        server_time = datetime.utcnow() - timedelta(seconds=2)
 
+        filters = []
         # Optional: filter by location
         if location_id:
-            query = query.filter(Lead.location_id == location_id)
+            filters.append(Lead.location_id == location_id)
 
         # Optional: filter by deal status (multi-select)
+        statuses = []
         if deal_status_param:
             # Example: "Need To Visit,Deal Closed"
             statuses = [s.strip() for s in deal_status_param.split(",") if s.strip()]
             if statuses:
-                query = query.filter(Lead.deal_status.in_(statuses))
-
-        # Fetch rows
-        rows = query.all()
-
-        # Optional debug print
-        print(json.dumps([r.to_dict() for r in rows], indent=2))
-
-        # Return JSON
-        return jsonify([r.to_dict() for r in rows])
+                filters.append(Lead.deal_status.in_(statuses))
+
+        # ids follow creation order, so id DESC == newest first and is index-backed
+        query = Lead.query.options(joinedload(Lead.location)).filter(*filters)
+        if not paged:
+            return jsonify([r.to_dict() for r in query.order_by(Lead.id.desc())])
+        if since:
+            query = query.filter(Lead.updated_at > since)
+        if cursor:
+            query = query.filter(Lead.id < cursor)
+        rows = query.order_by(Lead.id.desc()).limit(limit + 1).all()
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        removed = []
+        if since and not cursor:
+            removed = [r[0] for r in db.session.query(LeadTombstone.id).filter(LeadTombstone.deleted_at > since)]
+            if filters:
+                changed = db.session.query(Lead.id, Lead.location_id, Lead.deal_status).filter(Lead.updated_at > since)
+                removed += [
+                    lid for lid, loc_id, status in changed
+                    if (location_id and loc_id != location_id) or (statuses and status not in statuses)
+                ]
+
+        return jsonify({
+            "items": [r.to_dict() for r in rows],
+            "next_cursor": rows[-1].id if has_more else None,
+            "removed": removed,
+            "server_time": server_time.isoformat(),
+        })
 
     @app.route("/api/leads", methods=["POST"])
     def api_leads_create():
-        data = request.json or request.form
+        data = request.get_json(silent=True) or request.form
         name = (data.get("name") or "").strip()
         if not name:
             return jsonify({"error": "name required"}), 400
@@ -3356,7 +6812,7 @@ def register_routes(app: Flask) -> None:
     @app.route("/api/leads/<int:lead_id>", methods=["PUT", "PATCH"])
     def api_leads_update(lead_id):
         lead = Lead.query.get_or_404(lead_id)
-        data = request.json or request.form
+        data = request.get_json(silent=True) or request.form
         # update only provided fields
         if "name" in data:
             lead.name = (data.get("name") or "").strip()
@@ -3404,6 +6860,7 @@ def register_routes(app: Flask) -> None:
 
     # API: list/create/update/delete locations (reusable by leads page)
     @app.route("/api/locations", methods=["GET"])
+    @conditional_get("leads")
     def api_locations_list():
         rows = Location.query.order_by(Location.name.asc()).all()
         out = [{"id": r.id, "name": r.name} for r in rows]
@@ -3411,7 +6868,7 @@ def register_routes(app: Flask) -> None:
 
     @app.route("/api/locations", methods=["POST"])
     def api_locations_create():
-        data = request.json or request.form
+        data = request.get_json(silent=True) or request.form
         print(data)
         name = (data.get("name") or "").strip()
         if not name:
@@ -3440,7 +6897,7 @@ def register_routes(app: Flask) -> None:
     @app.route("/api/locations/<int:loc_id>", methods=["PUT", "PATCH"])
     def api_locations_update(loc_id):
         loc = Location.query.get_or_404(loc_id)
-        data = request.json or request.form
+        data = request.get_json(silent=True) or request.form
         name = (data.get("name") or "").strip()
         if not name:
             return jsonify({"error": "name required"}), 400
@@ -3475,7 +6932,14 @@ def register_routes(app: Flask) -> None:
             query = query.filter(Expense.category == category_filter)
         
         if month_filter:
-            query = query.filter(db.func.strftime('%Y-%m', Expense.date) == month_filter)
+            try:
+                # Date range rather than strftime() so ix_expense_date applies
+                query = query.filter(
+                    Expense.date >= _month_start(month_filter),
+                    Expense.date < _month_start(_shift_month(month_filter, 1)),
+                )
+            except ValueError:
+                pass
 
         expenses = query.order_by(
             Expense.date.desc(),
@@ -3562,24 +7026,514 @@ def register_routes(app: Flask) -> None:
         return redirect(url_for("expenses_list"))
 
 
+# -----------------------------------------------------------------------------
+# Synthetic data (scale testing)
+# -----------------------------------------------------------------------------
+_SYN_FIRMS = ["Shree", "Om", "Jay", "Krishna", "Sai", "Maruti", "Ganesh", "Ambica", "Bharat", "Navkar",
+              "Shiv", "Patel", "Mahavir", "Radhe", "Siddhi", "Umiya", "Vishal", "Arihant", "Deep", "Sun"]
+_SYN_TRADES = ["Chemicals", "Dyes", "Industries", "Traders", "Enterprises", "Pharma", "Textiles",
+               "Polymers", "Agencies", "Corporation", "Metals", "Intermediates"]
+_SYN_CITIES = ["Vapi", "Ankleshwar", "Bharuch", "Surat", "Vadodara", "Ahmedabad", "Dahej",
+               "Sarigam", "Valsad", "Navsari", "Silvassa", "Daman"]
+_SYN_CHEMICALS = ["HCL", "Sulphuric Acid", "Nitric Acid", "Caustic Soda Lye", "Caustic Flakes",
+                  "Hydrogen Peroxide", "Soda Ash", "Acetic Acid", "Formic Acid", "Sodium Hypo",
+                  "Phosphoric Acid", "Ammonia Solution", "Methanol", "IPA", "Toluene", "Acetone",
+                  "Bleaching Powder", "Ferric Chloride", "Alum", "Oxalic Acid"]
+_SYN_GRADES = ["Tech", "LR", "AR", "30%", "48%", "98%", "Commercial", "Food Grade"]
+_SYN_MODES = ["Cash", "Bank", "UPI"]
+_SYN_PEOPLE = ["Ramesh", "Suresh", "Mahesh", "Dinesh", "Kiran", "Alpesh", "Jignesh", "Hitesh",
+               "Rakesh", "Nilesh", "Mukesh", "Paresh", "Bhavesh", "Vipul", "Sanjay", "Ajay"]
+
+# Rows per table at --scale 1 (sale/purchase lines, payments etc. follow from these)
+SYNTHETIC_BASE = {
+    "clients": 300,
+    "products": 40,
+    "sales": 12000,
+    "purchases": 3000,
+    "expenses": 5000,
+    "employees": 20,
+    "loans": 60,
+    "locations": 40,
+    "leads": 3000,
+}
+_SYN_INSERT_ORDER = [
+    "client", "product", "bottle_type", "employee", "location",
+    "purchase", "purchase_item", "vendor_collection", "purchase_payment",
+    "sale", "sale_item", "client_collection", "sale_payment",
+    "product_batch", "expense", "loan", "loan_repayment", "lead",
+]
+_DERIVED_TRIGGER_RE = re.compile(r"_(search|rollup|last_rate)_a[iud]$")
+
+
+def drop_derived_triggers() -> int:
+    """Drops the search / price rollup / last-rate triggers (for bulk loads)."""
+    names = db.session.execute(text("SELECT name FROM sqlite_master WHERE type = 'trigger'")).scalars().all()
+    dropped = [n for n in names if _DERIVED_TRIGGER_RE.search(n)]
+    for name in dropped:
+        db.session.execute(text(f'DROP TRIGGER IF EXISTS "{name}"'))
+    db.session.commit()
+    return len(dropped)
+
+
+def rebuild_derived_tables() -> None:
+    """Recreates the derived-table triggers and recomputes their contents."""
+    ensure_search_index(rebuild=True)
+    ensure_price_rollup(rebuild=True)
+    ensure_last_rate(rebuild=True)
+
+
+_BOTTLE_TYPE_SQL = f"""
+    SELECT id, quantity_ltr, bottles_in_batch, can_price_paise / 100.0 AS can_price,
+           price_per_kg_e4 / {float(RATE_SCALE)} AS price_per_kg, box_cost_paise / 100.0 AS box_cost,
+           selling_price_per_batch_paise / 100.0 AS selling_price_per_batch
+    FROM bottle_type
+"""
+
+
+def seed_synthetic(scale: float = 1.0, seed: int = 42, days: int = 730, log=lambda msg: None) -> dict:
+    """
+    Bulk-loads a consistent synthetic dataset and returns rows written per
+    table. The same seed/scale/days always produces the same rows (apart from
+    ids when appending). Triggers on derived tables are dropped for the load
+    and the derived tables are rebuilt once at the end.
+    """
+    rnd = random.Random(seed)
+    n = {k: max(1, int(v * scale)) for k, v in SYNTHETIC_BASE.items()}
+    today = date.today()
+    start = today - timedelta(days=days)
+    now = datetime.utcnow()
+
+    next_id = {}
+    for table in _SYN_INSERT_ORDER:
+        next_id[table] = (db.session.execute(text(f'SELECT COALESCE(MAX(id), 0) FROM "{table}"')).scalar() or 0) + 1
+    buffers = {t: [] for t in _SYN_INSERT_ORDER}
+    written = {t: 0 for t in _SYN_INSERT_ORDER}
+    tables = db.metadata.tables
+
+    def new_id(table):
+        i = next_id[table]
+        next_id[table] = i + 1
+        return i
+
+    def add(table, row):
+        buffers[table].append(scaled_row(table, row))
+        if len(buffers[table]) >= 20000:
+            flush()
+
+    def flush():
+        # parents first, so the file never holds dangling references
+        for table in _SYN_INSERT_ORDER:
+            rows = buffers[table]
+            if rows:
+                db.session.execute(tables[table].insert(), rows)
+                written[table] += len(rows)
+                buffers[table] = []
+
+    def rand_date(lo=start, hi=today):
+        return lo + timedelta(days=rnd.randint(0, max(0, (hi - lo).days)))
+
+    def money(x):
+        return round(x, 2)
+
+    step = time.perf_counter()
+    drop_derived_triggers()
+
+    # --- Masters ---
+    existing = set(db.session.execute(text("SELECT name FROM client")).scalars())
+    clients = []
+    for i in range(n["clients"]):
+        name = f"{rnd.choice(_SYN_FIRMS)} {rnd.choice(_SYN_TRADES)} {rnd.choice(_SYN_CITIES)} #{seed}-{i:05d}"
+        if name in existing:
+            continue
+        cid = new_id("client")
+        clients.append((cid, name))
+        add("client", {
+            "id": cid, "name": name,
+            "address": f"Plot {rnd.randint(1, 900)}, GIDC {rnd.choice(_SYN_CITIES)}",
+            "gst": f"24{''.join(rnd.choice('ABCDEFGHJKLMNPQRSTUVWXYZ') for _ in range(5))}{rnd.randint(1000, 9999)}A1Z{rnd.randint(1, 9)}",
+            "phone": f"9{rnd.randint(100000000, 999999999)}",
+            "opening_balance": money(rnd.choice([0, 0, 0, rnd.uniform(-20000, 80000)])),
+        })
+    vendors = rnd.sample(clients, max(1, len(clients) // 6))
+
+    existing = set(db.session.execute(text("SELECT name FROM product")).scalars())
+    products = []
+    for i in range(n["products"]):
+        name = f"{rnd.choice(_SYN_CHEMICALS)} {rnd.choice(_SYN_GRADES)} #{seed}-{i:03d}"
+        if name in existing:
+            continue
+        pid = new_id("product")
+        base_rate = round(rnd.uniform(8, 120), 2)
+        products.append((pid, base_rate))
+        add("product", {"id": pid, "name": name, "current_stock_kg": 0.0,
+                        "min_stock_kg": float(rnd.choice([0, 100, 500, 1000])), "valuation_rate": base_rate})
+
+    bottle_types = db.session.execute(text(
+        _BOTTLE_TYPE_SQL
+    )).all()
+    if not bottle_types:
+        for d in DEFAULT_BOTTLE_TYPES:
+            add("bottle_type", dict(d, id=new_id("bottle_type")))
+        flush()
+        bottle_types = db.session.execute(text(
+            _BOTTLE_TYPE_SQL
+        )).all()
+
+    employees = []
+    for i in range(n["employees"]):
+        eid = new_id("employee")
+        employees.append(eid)
+        add("employee", {"id": eid, "name": f"{rnd.choice(_SYN_PEOPLE)} #{seed}-{i:03d}",
+                         "monthly_salary": float(rnd.choice([12000, 15000, 18000, 22000, 30000]))})
+
+    locations = []
+    for i in range(n["locations"]):
+        lid = new_id("location")
+        locations.append(lid)
+        add("location", {"id": lid, "name": f"{rnd.choice(_SYN_CITIES)} Zone {seed}-{i:03d}", "created_at": now})
+    log(f"masters: {len(clients)} clients, {len(products)} products, {len(employees)} employees")
+
+    # Running price per product, drifting over time so series have a trend
+    def rate_on(base, d):
+        drift = 1 + 0.15 * ((d - start).days / max(days, 1))
+        return round(base * drift * rnd.uniform(0.93, 1.07), 2)
+
+    batches = {}   # (product_id, rate_key) -> kg; rates bought become the cost rates sold
+    received = {}  # (product_id, rate_key) -> first purchase date
+    bought = []    # (date, product_id, rate_key, kg) per purchase line
+
+    # --- Purchases (+ payments, vendor collections) ---
+    for _ in range(n["purchases"]):
+        vid, vname = rnd.choice(vendors)
+        d = rand_date()
+        hid = new_id("purchase")
+        freight = float(rnd.choice([0, 0, 500, 1200, 2500]))
+        gst = float(rnd.choice([0, 5, 18, 18]))
+        subtotal = freight
+        for _line in range(rnd.choice([1, 1, 1, 2, 3])):
+            pid, base = rnd.choice(products)
+            qty = float(rnd.choice([500, 1000, 2000, 5000, 10000]))
+            rate = rate_on(base * 0.8, d)
+            subtotal += qty * rate
+            key = (pid, to_rate_e4(rate))
+            batches[key] = batches.get(key, 0.0) + qty
+            received[key] = min(received.get(key, d), d)
+            bought.append((d, pid, key[1], qty))
+            add("purchase_item", {"id": new_id("purchase_item"), "purchase_id": hid, "product_id": pid,
+                                  "quantity_kg": qty, "rate_per_kg": rate})
+        gst_amount = subtotal * gst / 100
+        total = money(subtotal + gst_amount)
+        add("purchase", {"id": hid, "date": d, "vendor_name": vname, "freight": freight, "gst_percent": gst,
+                         "subtotal": money(subtotal), "cgst_amount": money(gst_amount / 2),
+                         "sgst_amount": money(gst_amount / 2), "igst_amount": 0.0, "grand_total": total})
+
+        age = (today - d).days
+        roll = rnd.random()
+        if age > 60 and roll < 0.15 or age > 30 and roll < 0.08:
+            # settled through a vendor collection (bulk payment)
+            pay_date = min(today, d + timedelta(days=rnd.randint(15, 60)))
+            vc = new_id("vendor_collection")
+            mode = rnd.choice(_SYN_MODES)
+            add("vendor_collection", {"id": vc, "vendor_name": vname, "date": pay_date, "amount": total,
+                                      "mode": mode, "notes": f"Bulk payment {vname.split(' #')[0]}"})
+            add("purchase_payment", {"id": new_id("purchase_payment"), "purchase_id": hid, "date": pay_date,
+                                     "amount": total, "mode": mode,
+                                     "notes": f"Bulk Payment via Collection #{vc}", "collection_id": vc})
+        elif roll < 0.85:
+            paid = total if roll < 0.65 else money(total * rnd.uniform(0.2, 0.8))
+            add("purchase_payment", {"id": new_id("purchase_payment"), "purchase_id": hid,
+                                     "date": min(today, d + timedelta(days=rnd.randint(0, 45))),
+                                     "amount": paid, "mode": rnd.choice(_SYN_MODES),
+                                     "notes": rnd.choice([None, None, "NEFT", "cheque", "part payment"]),
+                                     "collection_id": None})
+    log(f"purchases: {n['purchases']}")
+
+    # --- Sales (+ payments, client collections) ---
+    # Made in date order: a line takes from a batch bought on or before its
+    # date, and never more than that batch still holds
+    bought.sort(key=lambda b: b[0])
+    on_hand = {}   # product_id -> {rate_key: kg} as of the sale being made
+    arrived = 0
+    base_rates = dict(products)
+
+    def take_stock(pid, qty):
+        lots = on_hand.get(pid)
+        if not lots:
+            stocked = [p for p in products if on_hand.get(p[0])]
+            if not stocked:
+                return None
+            pid = rnd.choice(stocked)[0]
+            lots = on_hand[pid]
+        rate_key = rnd.choice(sorted(lots))
+        qty = round(min(qty, lots[rate_key]), 2)
+        lots[rate_key] = round(lots[rate_key] - qty, 2)
+        if lots[rate_key] <= 0:
+            del lots[rate_key]
+        batches[(pid, rate_key)] -= qty
+        return pid, rate_key, qty
+
+    open_collection = {}   # client -> [(sale_id, amount, date)] waiting to be settled in bulk
+    for d in sorted(rand_date() for _ in range(n["sales"])):
+        while arrived < len(bought) and bought[arrived][0] <= d:
+            _d, pid, rate_key, kg = bought[arrived]
+            lots = on_hand.setdefault(pid, {})
+            lots[rate_key] = lots.get(rate_key, 0.0) + kg
+            arrived += 1
+        cid, cname = rnd.choice(clients)
+        hid = new_id("sale")
+        is_cash = rnd.random() < 0.15
+        freight = float(rnd.choice([0, 0, 0, 300, 800, 1500]))
+        sp_total = gst_total = qty_total = 0.0
+        for _line in range(rnd.choice([1, 1, 2, 2, 3, 4])):
+            gst_pct = float(rnd.choice([0, 18, 18, 18, 5]))
+            taken = None
+            if not is_cash:
+                pid, base = rnd.choice(products)
+                taken = take_stock(pid, float(rnd.choice([50, 100, 200, 500, 1000, 2000])))
+            if taken:
+                pid, rate_key, qty = taken
+                base = base_rates[pid]
+                cost = rate_key / RATE_SCALE
+                sp = round(max(cost, rate_on(base, d)) * rnd.uniform(1.02, 1.25), 2)
+                row = {"product_id": pid, "bottle_type_id": None, "cost_rate_per_kg": cost}
+            else:
+                # Cash sales, and bill lines with nothing in stock yet, sell bottles
+                bt = rnd.choice(bottle_types)
+                cp = round((bt.can_price or 0) * (bt.bottles_in_batch or 0)
+                           + (bt.price_per_kg or 0) * (bt.quantity_ltr or 0) * (bt.bottles_in_batch or 0)
+                           + (bt.box_cost or 0), 2)
+                sp = round((bt.selling_price_per_batch or 0) * rnd.uniform(0.95, 1.1), 2)
+                qty = float(rnd.randint(1, 40))
+                row = {"product_id": None, "bottle_type_id": bt.id, "cost_rate_per_kg": cp}
+            row.update({"id": new_id("sale_item"), "sale_id": hid, "quantity_kg": qty,
+                        "selling_rate_per_kg": sp, "gst_percent": gst_pct})
+            add("sale_item", row)
+            sp_total += sp * qty
+            gst_total += sp * qty * gst_pct / 100
+            qty_total += qty
+        total = money(sp_total + gst_total)
+        add("sale", {"id": hid, "date": d, "client_name": cname, "freight": freight, "quantity_kg": qty_total,
+                     "sale_type": "cash" if is_cash else "bill", "gst_percent": 0.0,
+                     "subtotal": money(sp_total), "cgst_amount": money(gst_total / 2),
+                     "sgst_amount": money(gst_total / 2), "igst_amount": 0.0,
+                     "misc_amount": 0.0, "grand_total": total})
+
+        age = (today - d).days
+        roll = rnd.random()
+        if age > 45 and roll < 0.35:
+            # settled later in a bulk ClientCollection with other invoices
+            pending = open_collection.setdefault(cid, [])
+            pending.append((hid, total, d))
+            if len(pending) >= rnd.randint(2, 6):
+                pay_date = min(today, max(p[2] for p in pending) + timedelta(days=rnd.randint(5, 40)))
+                cc = new_id("client_collection")
+                mode = rnd.choice(_SYN_MODES)
+                add("client_collection", {"id": cc, "client_id": cid, "date": pay_date,
+                                          "amount": money(sum(p[1] for p in pending)), "mode": mode,
+                                          "notes": rnd.choice([None, "RTGS", "cheque deposit", "month end settlement"])})
+                for sid, amt, _d in pending:
+                    add("sale_payment", {"id": new_id("sale_payment"), "sale_id": sid, "date": pay_date,
+                                         "amount": amt, "mode": mode,
+                                         "notes": f"Bulk Payment via Collection #{cc}", "collection_id": cc})
+                open_collection[cid] = []
+        elif roll < 0.85:
+            paid = total if roll < 0.7 or age > 120 else money(total * rnd.uniform(0.2, 0.8))
+            for part in ([paid] if rnd.random() < 0.7 else [money(paid / 2), money(paid - money(paid / 2))]):
+                add("sale_payment", {"id": new_id("sale_payment"), "sale_id": hid,
+                                     "date": min(today, d + timedelta(days=rnd.randint(0, 60))),
+                                     "amount": part, "mode": rnd.choice(_SYN_MODES),
+                                     "notes": rnd.choice([None, None, "UPI ref", "cheque", "cash at godown"]),
+                                     "collection_id": None})
+    log(f"sales: {n['sales']}")
+
+    # Stock = net of every generated line, per (product, rate_key) batch
+    stock = {}
+    for (pid, rate_key), kg in batches.items():
+        add("product_batch", {"id": new_id("product_batch"), "product_id": pid, "rate_key": rate_key,
+                              "quantity_kg": round(kg, 2),
+                              "received_on": received.get((pid, rate_key), OPENING_STOCK_DATE)})
+        stock[pid] = stock.get(pid, 0.0) + kg
+
+    # --- Expenses ---
+    categories = db.session.execute(text("SELECT name FROM expense_category")).scalars().all() or EXPENSE_CATEGORIES
+    for _ in range(n["expenses"]):
+        salaried = employees and rnd.random() < 0.2
+        add("expense", {
+            "id": new_id("expense"), "date": rand_date(),
+            "employee_id": rnd.choice(employees) if salaried else None,
+            "category": "Labour" if salaried else rnd.choice(categories),
+            "description": rnd.choice([None, "monthly", "advance", "vehicle", "site visit", "misc"]),
+            "amount": money(rnd.choice([rnd.uniform(100, 3000), rnd.uniform(3000, 25000)])),
+            "mode": rnd.choice(_SYN_MODES), "created_at": now,
+        })
+
+    # --- Loans ---
+    for _ in range(n["loans"]):
+        lid = new_id("loan")
+        issued = rand_date()
+        principal = float(rnd.choice([50000, 100000, 200000, 500000]))
+        repaid = 0.0
+        for _r in range(rnd.randint(0, 6)):
+            amt = money(principal * rnd.uniform(0.05, 0.2))
+            repaid += amt
+            add("loan_repayment", {"id": new_id("loan_repayment"), "loan_id": lid, "date": rand_date(issued),
+                                   "amount": amt, "mode": rnd.choice(_SYN_MODES), "notes": None})
+        add("loan", {"id": lid, "loan_type": rnd.choice(["given", "taken"]),
+                     "party_name": f"{rnd.choice(_SYN_PEOPLE)} {rnd.choice(_SYN_FIRMS)}",
+                     "principal": principal, "interest_rate": float(rnd.choice([0, 9, 12, 18])),
+                     "date_issued": issued, "due_date": issued + timedelta(days=rnd.choice([180, 365, 730])),
+                     "notes": None, "is_closed": repaid >= principal, "created_at": now})
+
+    # --- Leads ---
+    for i in range(n["leads"]):
+        created = datetime.combine(rand_date(), datetime.min.time()) + timedelta(minutes=rnd.randint(0, 1439))
+        add("lead", {
+            "id": new_id("lead"),
+            "name": f"{rnd.choice(_SYN_FIRMS)} {rnd.choice(_SYN_TRADES)} (lead {seed}-{i:05d})",
+            "location_id": rnd.choice(locations),
+            "indiamart_link": None,
+            "deal_status": rnd.choice(DEAL_CHOICES),
+            "comments": rnd.choice([None, "asked for HCL 30% rates", "call back next week",
+                                    "needs sample", "price too high", "visit plant"]),
+            "address": f"{rnd.choice(_SYN_CITIES)} GIDC",
+            "created_at": created, "updated_at": created,
+        })
+
+    flush()
+    # Product totals follow their batches, as sync_product_total_stock() does
+    _sync_product_totals(list(stock))
+    bump_data_version(db.session, set(DATA_GROUPS.values()))
+    db.session.commit()
+    log(f"bulk insert: {time.perf_counter() - step:.1f}s")
+
+    step = time.perf_counter()
+    rebuild_derived_tables()
+    log(f"derived tables: {time.perf_counter() - step:.1f}s")
+    return written
+
+
 # -----------------------------------------------------------------------------
 # CLI helpers
 # -----------------------------------------------------------------------------
 def register_cli(app: Flask) -> None:
     @app.cli.command("init-db")
     def init_db():
-        db.create_all()
-        print("Database initialized OK")
+        timings = bootstrap_db()
+        print(f"Database initialized OK ({', '.join(f'{k} {v:.0f}ms' for k, v in timings.items())})")
+
+    @app.cli.command("db-upgrade")
+    @click.option("--no-backup", is_flag=True, help="Skip the online pre-upgrade backup.")
+    @click.option("--batch-size", type=int, default=MIGRATION_BATCH_SIZE, show_default=True,
+                  help="Rows per transaction for data backfills.")
+    def db_upgrade(no_backup, batch_size):
+        global MIGRATION_BATCH_SIZE
+        MIGRATION_BATCH_SIZE = batch_size
+        applied = upgrade_db(backup=not no_backup, log=print)
+        if applied:
+            print(f"Upgraded to schema v{applied[-1]} ({len(applied)} migration(s))")
+        else:
+            print("Schema already up to date")
+
+    @app.cli.command("db-status")
+    def db_status():
+        pending = pending_migrations()
+        print(f"Schema version: {db_boot_state()[1]} (latest {latest_schema_version()})")
+        for version, name, _fn in pending:
+            print(f"  pending v{version:03d} {name}")
+
+    @app.cli.command("search-reindex")
+    def search_reindex():
+        """Rebuild the FTS5 search index from the source tables."""
+        ensure_search_index(rebuild=True)
+        n = db.session.execute(text("SELECT COUNT(*) FROM search_index")).scalar()
+        print(f"Search index rebuilt: {n} documents")
+
+    @app.cli.command("price-rollup-rebuild")
+    def price_rollup_rebuild():
+        """Recompute every price_rollup bucket from sale/purchase items."""
+        ensure_price_rollup(rebuild=True)
+        n = db.session.execute(text("SELECT COUNT(*) FROM price_rollup")).scalar()
+        print(f"Price rollup rebuilt: {n} buckets")
+
+    @app.cli.command("last-rate-rebuild")
+    def last_rate_rebuild():
+        """Re-derive the last sold / bought rate for every (party, product)."""
+        ensure_last_rate(rebuild=True)
+        n = db.session.execute(text("SELECT COUNT(*) FROM last_rate")).scalar()
+        print(f"Last-rate table rebuilt: {n} rows")
+
+    @app.cli.command("seed-synthetic")
+    @click.option("--scale", default=1.0, show_default=True,
+                  help="Multiplier on SYNTHETIC_BASE; ~10 gives about a million rows.")
+    @click.option("--seed", default=42, show_default=True, help="Random seed (same seed, same data).")
+    @click.option("--days", default=730, show_default=True, help="History length ending today.")
+    @click.option("--append", is_flag=True, help="Allow seeding a database that already has sales.")
+    def seed_synthetic_cmd(scale, seed, days, append):
+        """Bulk-load realistic synthetic data for scale / performance testing."""
+        if Sale.query.first() is not None and not append:
+            raise click.ClickException("Database already has sales; use a scratch DATABASE_URL or pass --append.")
+        started = time.perf_counter()
+        written = seed_synthetic(scale=scale, seed=seed, days=days, log=print)
+        for table, count in written.items():
+            if count:
+                print(f"{table:<20} {count:>9,}")
+        print(f"{sum(written.values()):,} rows in {time.perf_counter() - started:.1f}s")
+
+    @app.cli.command("import-invoices")
+    @click.argument("path", type=click.Path(exists=True, dir_okay=False))
+    @click.option("--kind", type=click.Choice(IMPORT_KINDS), required=True)
+    @click.option("--commit", is_flag=True, help="Write the rows; without it this is a dry run.")
+    def import_invoices_cmd(path, kind, commit):
+        """Bulk-import sales or purchases from a CSV / XLSX file (one row per line item)."""
+        started = time.perf_counter()
+        with open(path, "rb") as f:
+            try:
+                plan = import_invoices(kind, f, path, dry_run=not commit)
+            except ValueError as exc:
+                raise click.ClickException(str(exc))
+        print(f"{plan['rows']:,} rows -> {len(plan['invoices']):,} {kind}s, {plan['lines']:,} lines, "
+              f"total {plan['total']:,.2f} ({plan['date_from']} .. {plan['date_to']})")
+        for line_no, msg in plan["errors"]:
+            print(f"  line {line_no}: {msg}")
+        if plan["error_count"] > len(plan["errors"]):
+            print(f"  ... {plan['error_count'] - len(plan['errors'])} more error(s)")
+        if plan["new_parties"]:
+            print(f"Not in parties (imported by name): {', '.join(plan['new_parties'])}")
+        if plan["duplicates"]:
+            print(f"{len(plan['duplicates'])} invoice(s) match an existing date / party / total")
+        for r in plan["stock_changes"]:
+            print(f"  {r['product']:<24} {r['change_kg']:>+12,.2f} kg  {r['before_kg']:>12,.2f} -> {r['after_kg']:,.2f}")
+        if commit:
+            print(f"Imported in {time.perf_counter() - started:.1f}s")
+        elif not plan["error_count"]:
+            print("Dry run - nothing written. Re-run with --commit to import.")
+
+    @app.cli.command("close-period")
+    @click.option("--as-of", "as_of", required=True, help="Last day of the period to close (YYYY-MM-DD).")
+    @click.option("--notes", default="", help="Note stored with the close.")
+    def close_period_cmd(as_of, notes):
+        """Close the books up to --as-of; ledgers and balances then start from it."""
+        started = time.perf_counter()
+        try:
+            close = close_period(_parse_date(as_of), notes.strip())
+            commit_or_rollback()
+        except ValueError as exc:
+            raise click.ClickException(str(exc))
+        counts = {}
+        for b in close.balances:
+            counts[b.kind] = counts.get(b.kind, 0) + 1
+        print(f"Closed up to {close.as_of} in {time.perf_counter() - started:.1f}s: "
+              + ", ".join(f"{counts.get(k, 0):,} {k}" for k in ("client", "vendor", "product", "batch", "loan")))
+
+    @app.cli.command("startup-timings")
+    def startup_timings():
+        for k, v in app.config["STARTUP_TIMINGS_MS"].items():
+            print(f"{k:<16} {v:>8.1f} ms")
 
     @app.cli.command("seed-bottles")
     def seed_bottles():
-        data = [
-            {"label": "1 ltr", "quantity_ltr": 1.0, "bottles_in_batch": 12, "can_price": 4.25, "price_per_kg": 9.0, "box_cost": 21, "selling_price_per_batch": 170},
-            {"label": "0.5 ltr", "quantity_ltr": 0.5, "bottles_in_batch": 24, "can_price": 6.0, "price_per_kg": 9.0, "box_cost": 21, "selling_price_per_batch": 220},
-            {"label": "5 ltr", "quantity_ltr": 5.0, "bottles_in_batch": 1, "can_price": 15.0, "price_per_kg": 9.0, "box_cost": 0.0, "selling_price_per_batch": 80},
-        ]
         created = 0
-        for d in data:
+        for d in DEFAULT_BOTTLE_TYPES:
             existing = BottleType.query.filter_by(label=d["label"]).first()
             if existing:
                 existing.quantity_ltr = d["quantity_ltr"]
@@ -3761,6 +7715,7 @@ def register_cli(app: Flask) -> None:
         return redirect(url_for("loan_detail", loan_id=loan_id))
 
     @app.route("/reports/price-trend")
+    @conditional_get("sales", "purchases", "stock")
     def price_trend_report():
         products = Product.query.order_by(Product.name).all()
         clients = Client.query.order_by(Client.name).all()
@@ -3773,6 +7728,7 @@ def register_cli(app: Flask) -> None:
                                vendors=sorted(vendor_list))
 
     @app.route("/api/reports/price-history")
+    @conditional_get("sales", "purchases", "masters")
     def price_history_api():
         product_id = request.args.get("product_id", type=int)
         client_id = request.args.get("client_id", type=int)
@@ -3782,7 +7738,11 @@ def register_cli(app: Flask) -> None:
             return jsonify([])
 
         # 1. Fetch Sales
-        sales_query = db.session.query(SaleItem, Sale).join(Sale).filter(SaleItem.product_id == product_id)
+        sales_query = (
+            db.session.query(SaleItem, Sale).join(Sale)
+            .options(joinedload(SaleItem.bottle_type))
+            .filter(SaleItem.product_id == product_id)
+        )
         if client_id:
             client = Client.query.get(client_id)
             if client:
@@ -3823,19 +7783,48 @@ def register_cli(app: Flask) -> None:
 
         return jsonify(results)
 
-
-# -----------------------------------------------------------------------------
-# Run (local dev)
-# -----------------------------------------------------------------------------
-if __name__ == "__main__":
-    app = create_app()
-    app.run(host="0.0.0.0", port=5002, debug=True)
-
+    @app.route("/api/reports/price-series")
+    @conditional_get("sales", "purchases", "masters")
+    def price_series_api():
+        """
+        Rolled-up rate series for one product over its full history.
+          ?product_id=1&period=month|week&side=all|sale|purchase
+          &client_id=..&vendor_name=..&from=YYYY-MM-DD&to=YYYY-MM-DD
+        """
+        product_id = request.args.get("product_id", type=int)
+        period = request.args.get("period", "month")
+        side = request.args.get("side", "all")
+        if not product_id:
+            return jsonify({"error": "product_id is required"}), 400
+        if period not in PRICE_PERIODS:
+            return jsonify({"error": f"period must be one of {', '.join(PRICE_PERIODS)}"}), 400
+        sides = tuple(_PRICE_SIDES) if side == "all" else (side,)
+        if not set(sides) <= set(_PRICE_SIDES):
+            return jsonify({"error": "side must be all, sale or purchase"}), 400
+
+        client_name = None
+        client_id = request.args.get("client_id", type=int)
+        if client_id:
+            client = Client.query.get(client_id)
+            client_name = client.name if client else None
+        try:
+            start = _parse_date(request.args["from"]) if request.args.get("from") else None
+            end = _parse_date(request.args["to"]) if request.args.get("to") else None
+        except ValueError:
+            return jsonify({"error": "from/to must be YYYY-MM-DD"}), 400
+
+        series = price_series(
+            product_id, period, sides,
+            client_name=client_name,
+            vendor_name=request.args.get("vendor_name") or None,
+            start=start, end=end,
+        )
+        return jsonify({"product_id": product_id, "period": period, "series": series})
 
 
 # -----------------------------------------------------------------------------
-# Run (local dev)
+# Run (local dev) – production uses wsgi.py + gunicorn.conf.py
 # -----------------------------------------------------------------------------
 if __name__ == "__main__":
     app = create_app()
-    app.run(host="0.0.0.0", port=5002, debug=True)
+    app.run(host="0.0.0.0", port=5002, debug=os.environ.get("FLASK_DEBUG", "1") == "1")
@@ -0,0 +1,56 @@
+"""
+Gunicorn config for the HCL ledger.
+
+Usage (on production):
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Deploying new code: the app is preloaded in the master (preload_app), so
+HUP only restarts workers on the code already loaded. Either restart the
+service, or hand over to a new master without dropping requests:
+    kill -USR2 <master pid>      # new master + workers on the new code
+    kill -TERM <old master pid>  # once they are up; old workers finish
+                                 # in-flight requests (QUIT would cut them)
+
+Sizing: SQLite (WAL) allows many concurrent readers but a single writer, so
+we run a few processes with a handful of threads each instead of lots of
+sync workers all queueing on the same write lock.
+"""
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5002")
+
+# Processes use all cores for template rendering / report maths; threads
+# cover I/O waits (SQLite reads, slow mobile clients).
+workers = int(os.environ.get("WEB_WORKERS", min(multiprocessing.cpu_count(), 4)))
+worker_class = "gthread"
+threads = int(os.environ.get("WEB_THREADS", "4"))
+
+# Build the app once in the master; workers inherit it on fork.
+preload_app = True
+
+# A request that runs longer than this is killed and the worker restarted.
+# Keep it well above WRITE_LOCK_WAIT_MS (20 s), the longest a write request
+# waits for the SQLite write lock before answering 503.
+timeout = int(os.environ.get("WEB_TIMEOUT", "60"))
+# Time given to in-flight requests on TERM / shutdown.
+graceful_timeout = int(os.environ.get("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Recycle workers now and then so slow leaks never pile up.
+max_requests = int(os.environ.get("WEB_MAX_REQUESTS", "2000"))
+max_requests_jitter = 200
+
+accesslog = os.environ.get("WEB_ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.environ.get("WEB_LOG_LEVEL", "info")
+
+
+def post_fork(server, worker):
+    # SQLite connections must never be shared across processes: drop any
+    # pooled connection the master opened while preloading.
+    from wsgi import app
+    from app import db
+
+    with app.app_context():
+        db.engine.dispose(close=False)
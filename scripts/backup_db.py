@@ -1,7 +1,34 @@
+"""
+Incremental, deduplicated SQLite backups.
+
+Each run snapshots the live database with the sqlite3 backup API (a few
+pages per step, so writers are never blocked for long), splits the snapshot
+into fixed-size page chunks and stores every chunk gzip-compressed under its
+SHA-256. Only chunks that changed since an earlier run are written, so a
+backup of a mostly unchanged database costs a few KB instead of a full copy.
+A JSON manifest per run lists the chunk hashes needed to rebuild that point
+in time.
+
+Layout of BACKUP_DIR:
+    chunks/ab/ab12...ef.gz      content-addressed, compressed page chunks
+    manifests/<timestamp>.json  one per backup run (local time, to the
+                                microsecond; -1, -2 ... on a clash)
+
+Usage:
+    python scripts/backup_db.py                  # take a backup (+ git push if BACKUP_REPO_URL is set)
+    python scripts/backup_db.py list
+    python scripts/backup_db.py restore latest restored.db
+    python scripts/backup_db.py verify [name|all]
+"""
+import argparse
+import gzip
+import hashlib
+import json
 import os
-import shutil
 import sqlite3
 import subprocess
+import sys
+import tempfile
 from datetime import datetime
 import time
 
@@ -9,8 +36,16 @@ import time
 DB_PATH = "instance/hcl_sales.db"
 BACKUP_DIR = "backups_repo" # Local folder for the cloned backup repo
 # The user should set this environment variable on the server
-REPO_URL = os.environ.get("BACKUP_REPO_URL") 
-RETENTION_DAYS = 30 # Can keep more in Git as it's efficient
+REPO_URL = os.environ.get("BACKUP_REPO_URL")
+RETENTION_DAYS = 30 # Manifests older than this are dropped; history stays in Git
+
+# Pages copied per sqlite3 backup step, and pages per stored chunk.
+STEP_PAGES = 256
+CHUNK_PAGES = 64
+
+CHUNK_DIR = os.path.join(BACKUP_DIR, "chunks")
+MANIFEST_DIR = os.path.join(BACKUP_DIR, "manifests")
+
 
 def run_command(command, cwd=None):
     try:
@@ -23,7 +58,8 @@ def run_command(command, cwd=None):
 
 def setup_git_repo():
     if not REPO_URL:
-        print("Error: BACKUP_REPO_URL environment variable not set.")
+        print("BACKUP_REPO_URL not set - keeping backups local only.")
+        os.makedirs(BACKUP_DIR, exist_ok=True)
         return False
 
     if not os.path.exists(BACKUP_DIR):
@@ -36,65 +72,242 @@ def setup_git_repo():
         subprocess.run(["git", "pull"], cwd=BACKUP_DIR, capture_output=True)
     return True
 
+
+def chunk_path(digest):
+    return os.path.join(CHUNK_DIR, digest[:2], f"{digest}.gz")
+
+
+def snapshot(dest_path):
+    """Consistent online copy of DB_PATH, taken STEP_PAGES pages at a time."""
+    with sqlite3.connect(DB_PATH) as src_conn:
+        with sqlite3.connect(dest_path) as dst_conn:
+            src_conn.backup(dst_conn, pages=STEP_PAGES, sleep=0.005)
+            page_size = dst_conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_size
+
+
+def store_chunks(path, chunk_size):
+    """Writes unseen chunks; returns (hashes, new chunk paths, full-file sha256)."""
+    hashes, new_paths = [], []
+    whole = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                break
+            whole.update(data)
+            digest = hashlib.sha256(data).hexdigest()
+            hashes.append(digest)
+            target = chunk_path(digest)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                tmp = target + ".tmp"
+                with gzip.open(tmp, "wb", compresslevel=6) as out:
+                    out.write(data)
+                os.replace(tmp, target)
+                new_paths.append(target)
+    return hashes, new_paths, whole.hexdigest()
+
+
 def backup_database():
-    if not setup_git_repo():
+    use_git = setup_git_repo()
+    if not os.path.exists(DB_PATH):
+        print(f"Error: Database file not found at {DB_PATH}")
         return
 
-    # 1. Generate timestamped filename
-    timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    backup_filename = f"backup_{timestamp}.db"
-    backup_path = os.path.join(BACKUP_DIR, backup_filename)
+    # 1. Timestamp for the manifest name and created_at
+    now = datetime.now().astimezone()
+    timestamp = now.strftime("%Y-%m-%d_%H-%M-%S-%f")
+    print(f"Starting incremental backup of {DB_PATH}...")
 
-    print(f"Starting backup of {DB_PATH} to Git repo...")
-
-    # 2. Perform the backup
+    # 2. Snapshot + chunk
+    started = time.time()
+    fd, tmp_db = tempfile.mkstemp(suffix=".db", dir=BACKUP_DIR)
+    os.close(fd)
     try:
-        if not os.path.exists(DB_PATH):
-            print(f"Error: Database file not found at {DB_PATH}")
-            return
-
-        with sqlite3.connect(DB_PATH) as src_conn:
-            with sqlite3.connect(backup_path) as dst_conn:
-                src_conn.backup(dst_conn)
-        
-        print(f"Backup created locally: {backup_path}")
+        page_size = snapshot(tmp_db)
+        chunk_size = page_size * CHUNK_PAGES
+        hashes, new_paths, full_hash = store_chunks(tmp_db, chunk_size)
+        size = os.path.getsize(tmp_db)
     except Exception as e:
         print(f"Error during backup: {e}")
         return
+    finally:
+        os.remove(tmp_db)
+
+    manifest = {
+        "created_at": now.isoformat(),
+        "source": DB_PATH,
+        "page_size": page_size,
+        "chunk_size": chunk_size,
+        "size": size,
+        "sha256": full_hash,
+        "chunks": hashes,
+    }
+    manifest_path = write_manifest(timestamp, manifest)
+    manifest_name = os.path.basename(manifest_path)
 
-    # 3. Git operations
-    print("Pushing backup to remote repository...")
-    run_command(["git", "add", backup_filename], cwd=BACKUP_DIR)
-    run_command(["git", "commit", "-m", f"Database backup {timestamp}"], cwd=BACKUP_DIR)
-    if run_command(["git", "push"], cwd=BACKUP_DIR) is not None:
-        print("Backup successfully pushed to Git!")
+    new_bytes = sum(os.path.getsize(p) for p in new_paths)
+    print(
+        f"Backup {manifest_name}: {size / 1e6:.1f} MB db, {len(hashes)} chunks, "
+        f"{len(new_paths)} new ({new_bytes / 1e3:.0f} KB compressed) in {time.time() - started:.1f}s"
+    )
+
+    # 3. Git operations - only the new chunks and the manifest are added
+    if use_git:
+        print("Pushing backup to remote repository...")
+        rel = [os.path.relpath(p, BACKUP_DIR) for p in new_paths + [manifest_path]]
+        run_command(["git", "add", *rel], cwd=BACKUP_DIR)
+        run_command(["git", "commit", "-m", f"Database backup {manifest_name[:-5]}"], cwd=BACKUP_DIR)
+        if run_command(["git", "push"], cwd=BACKUP_DIR) is not None:
+            print("Backup successfully pushed to Git!")
 
     # 4. Cleanup old backups locally (Git history remains)
-    cleanup_old_backups()
+    cleanup_old_backups(use_git)
+
 
-def cleanup_old_backups():
-    # We still keep a few local copies in the repo folder for quick access
-    # But Git itself stores the full history.
+def write_manifest(timestamp, manifest):
+    """Writes manifests/<timestamp>.json, never over an existing one; returns its path."""
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    name, n = timestamp, 0
+    while True:
+        path = os.path.join(MANIFEST_DIR, f"{name}.json")
+        try:
+            with open(path, "x") as f:
+                json.dump(manifest, f, indent=1)
+            return path
+        except FileExistsError:
+            n += 1
+            name = f"{timestamp}-{n}"
+
+
+def list_manifests():
+    if not os.path.isdir(MANIFEST_DIR):
+        return []
+    return sorted(f for f in os.listdir(MANIFEST_DIR) if f.endswith(".json"))
+
+
+def load_manifest(name):
+    names = list_manifests()
+    if not names:
+        raise SystemExit("No backups found")
+    if name in (None, "latest"):
+        name = names[-1]
+    if not name.endswith(".json"):
+        name += ".json"
+    with open(os.path.join(MANIFEST_DIR, name)) as f:
+        return name, json.load(f)
+
+
+def restore(name, out_path):
+    """Rebuilds the database for manifest `name`, checking every chunk hash."""
+    name, manifest = load_manifest(name)
+    whole = hashlib.sha256()
+    tmp = out_path + ".partial"
+    with open(tmp, "wb") as out:
+        for digest in manifest["chunks"]:
+            with gzip.open(chunk_path(digest), "rb") as f:
+                data = f.read()
+            if hashlib.sha256(data).hexdigest() != digest:
+                os.remove(tmp)
+                raise SystemExit(f"Corrupt chunk {digest} in {name}")
+            whole.update(data)
+            out.write(data)
+    if whole.hexdigest() != manifest["sha256"]:
+        os.remove(tmp)
+        raise SystemExit(f"Restored file hash mismatch for {name}")
+    os.replace(tmp, out_path)
+    return name
+
+
+def verify(name):
+    names = list_manifests() if name == "all" else [load_manifest(name)[0]]
+    ok = True
+    for n in names:
+        fd, tmp = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        try:
+            restore(n, tmp)
+            with sqlite3.connect(tmp) as conn:
+                result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+        except SystemExit as e:
+            result = str(e)
+        finally:
+            os.remove(tmp)
+        ok = ok and result == "ok"
+        print(f"{n}: {result}")
+    return ok
+
+
+def cleanup_old_backups(use_git=False):
+    # Drop manifests past retention, then any chunk no manifest references.
+    # Git itself still stores the full history.
     print(f"Running local cleanup in {BACKUP_DIR}...")
     now = time.time()
     retention_seconds = RETENTION_DAYS * 86400
+    removed = []
 
     try:
-        files = os.listdir(BACKUP_DIR)
-        for file in files:
-            if not file.startswith("backup_") or not file.endswith(".db"):
-                continue
-            
-            file_path = os.path.join(BACKUP_DIR, file)
-            if os.path.isfile(file_path):
-                file_age = os.path.getmtime(file_path)
-                if now - file_age > retention_seconds:
-                    print(f"Removing old backup from local tracking: {file}")
-                    run_command(["git", "rm", file], cwd=BACKUP_DIR)
-                    run_command(["git", "commit", "-m", f"Cleanup old backup {file}"], cwd=BACKUP_DIR)
-                    run_command(["git", "push"], cwd=BACKUP_DIR)
+        for name in list_manifests()[:-1]:  # never drop the newest backup
+            path = os.path.join(MANIFEST_DIR, name)
+            if now - os.path.getmtime(path) > retention_seconds:
+                print(f"Removing old backup manifest: {name}")
+                os.remove(path)
+                removed.append(path)
+
+        # Full-copy backups written by the old version of this script
+        for file in os.listdir(BACKUP_DIR):
+            if file.startswith("backup_") and file.endswith(".db"):
+                path = os.path.join(BACKUP_DIR, file)
+                if now - os.path.getmtime(path) > retention_seconds:
+                    print(f"Removing old full backup: {file}")
+                    os.remove(path)
+                    removed.append(path)
+
+        live = set()
+        for name in list_manifests():
+            live.update(load_manifest(name)[1]["chunks"])
+        if os.path.isdir(CHUNK_DIR):
+            for sub in os.listdir(CHUNK_DIR):
+                for file in os.listdir(os.path.join(CHUNK_DIR, sub)):
+                    if file[:-3] not in live:
+                        path = os.path.join(CHUNK_DIR, sub, file)
+                        os.remove(path)
+                        removed.append(path)
+
+        if use_git and removed:
+            run_command(["git", "add", "-A", "."], cwd=BACKUP_DIR)
+            run_command(["git", "commit", "-m", f"Cleanup {len(removed)} old backup file(s)"], cwd=BACKUP_DIR)
+            run_command(["git", "push"], cwd=BACKUP_DIR)
     except Exception as e:
         print(f"Error during cleanup: {e}")
 
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="cmd")
+    sub.add_parser("backup", help="take an incremental backup (default)")
+    sub.add_parser("list", help="list backups")
+    p_restore = sub.add_parser("restore", help="rebuild a backup into a .db file")
+    p_restore.add_argument("name", nargs="?", default="latest")
+    p_restore.add_argument("out", nargs="?", default="restored.db")
+    p_verify = sub.add_parser("verify", help="restore into a temp file and run integrity_check")
+    p_verify.add_argument("name", nargs="?", default="latest")
+    args = parser.parse_args(argv)
+
+    if args.cmd in (None, "backup"):
+        backup_database()
+    elif args.cmd == "list":
+        for name in list_manifests():
+            m = load_manifest(name)[1]
+            print(f"{name[:-5]}  {m['size'] / 1e6:8.1f} MB  {len(m['chunks'])} chunks")
+    elif args.cmd == "restore":
+        name = restore(args.name, args.out)
+        print(f"Restored {name} -> {args.out}")
+    elif args.cmd == "verify":
+        if not verify(args.name):
+            sys.exit(1)
+
+
 if __name__ == "__main__":
-    backup_database()
+    main()
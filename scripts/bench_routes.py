@@ -0,0 +1,327 @@
+"""
+Route-level benchmark: latency, SQL query count and peak memory per GET route.
+
+For each dataset size the app is booted with create_app() against a synthetic
+database (built once with seed_synthetic() and cached under BENCH_DIR), and
+every side-effect-free GET route is requested through the test client:
+dashboard, ledgers, reports, lists, export.csv and the JSON APIs. Routes with
+URL parameters get the heaviest matching row (the client with the most sales,
+the product with the most lines, ...).
+
+Per route and size it records p50/p95 latency over --iterations runs, the SQL
+statements one request issues, and the tracemalloc peak of one request. It
+fails (exit 1) when a route:
+    - issues more queries than the baseline (query counts are deterministic),
+    - has p95 above baseline * (1 + --tolerance) + --noise-ms,
+    - peaks above baseline memory * (1 + --mem-tolerance) + 512 KB,
+    - stops returning 2xx/3xx,
+    - has no baseline for its size (new route or size: re-record it).
+Without a baseline file it exits 2 before running anything. The committed
+baseline is timed on one machine; re-record it on the machine that compares.
+
+Usage:
+    python scripts/bench_routes.py --update-baseline       # record scripts/bench_baseline.json
+    python scripts/bench_routes.py                         # compare, exit 1 on regressions
+    python scripts/bench_routes.py --sizes 0.1,1 --routes ledger,report --iterations 5
+"""
+import argparse
+import gc
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+BENCH_DIR = os.path.join("instance", "bench")
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "bench_baseline.json")
+SEED = 42
+
+# Endpoints that change data (or need a job id) even though they answer GET
+SKIP_ENDPOINTS = {
+    "static", "login", "logout", "job_status", "job_result",
+    "delete_client_collection", "delete_vendor_collection",
+}
+
+# Query strings that make an endpoint do its real work
+EXTRA_ARGS = {
+    "api_search": lambda s: {"q": s["search_word"]},
+    "api_last_rates": lambda s: {"side": "sale", "party": s["client_name"], "product_id": s["product_ids"]},
+    "price_history_api": lambda s: {"product_id": s["product_id"]},
+    "price_series_api": lambda s: {"product_id": s["product_id"], "period": "week"},
+}
+
+
+def sample_values(db, text):
+    """Heaviest rows to plug into parameterised routes."""
+    one = lambda sql: db.session.execute(text(sql)).scalar()
+    client_name = one("SELECT client_name FROM sale GROUP BY client_name ORDER BY COUNT(*) DESC LIMIT 1")
+    vendor_name = one("SELECT vendor_name FROM purchase GROUP BY vendor_name ORDER BY COUNT(*) DESC LIMIT 1")
+    product_id = one("SELECT product_id FROM sale_item WHERE product_id IS NOT NULL "
+                     "GROUP BY product_id ORDER BY COUNT(*) DESC LIMIT 1")
+    product_ids = db.session.execute(text("SELECT id FROM product ORDER BY id LIMIT 10")).scalars().all()
+    sale_id = one("SELECT sale_id FROM sale_item GROUP BY sale_id ORDER BY COUNT(*) DESC LIMIT 1")
+    return {
+        "client_name": client_name,
+        "vendor_name": vendor_name,
+        "client_id": one(f"SELECT id FROM client WHERE name = {_sql_str(client_name)}"),
+        "product_id": product_id,
+        "product_ids": ",".join(str(i) for i in product_ids),
+        "employee_id": one("SELECT employee_id FROM expense WHERE employee_id IS NOT NULL "
+                           "GROUP BY employee_id ORDER BY COUNT(*) DESC LIMIT 1"),
+        "sale_id": sale_id,
+        "purchase_id": one("SELECT purchase_id FROM purchase_item GROUP BY purchase_id ORDER BY COUNT(*) DESC LIMIT 1"),
+        "expense_id": one("SELECT MAX(id) FROM expense"),
+        "bottle_id": one("SELECT MIN(id) FROM bottle_type"),
+        "loan_id": one("SELECT loan_id FROM loan_repayment GROUP BY loan_id ORDER BY COUNT(*) DESC LIMIT 1")
+                   or one("SELECT MIN(id) FROM loan"),
+        "client_collection_id": one("SELECT MAX(id) FROM client_collection"),
+        "vendor_collection_id": one("SELECT MAX(id) FROM vendor_collection"),
+        "search_word": (client_name or "a").split()[0],
+    }
+
+
+def _sql_str(value):
+    return "NULL" if value is None else "'" + str(value).replace("'", "''") + "'"
+
+
+# (endpoint, url argument) -> sample key
+URL_ARGS = {
+    ("bottles_form", "bt_id"): "bottle_id",
+    ("add_client_collection", "client_id"): "client_id",
+    ("clients_form", "client_id"): "client_id",
+    ("edit_client_collection", "collection_id"): "client_collection_id",
+    ("edit_vendor_collection", "collection_id"): "vendor_collection_id",
+    ("employee_ledger", "id"): "employee_id",
+    ("product_stock_ledger", "id"): "product_id",
+    ("expenses_form", "expense_id"): "expense_id",
+    ("loan_detail", "loan_id"): "loan_id",
+    ("edit_purchase", "purchase_id"): "purchase_id",
+    ("add_payment", "purchase_id"): "purchase_id",
+    ("purchase_payments", "purchase_id"): "purchase_id",
+    ("add_sale_payment", "sale_id"): "sale_id",
+    ("sale_payments_detail", "sale_id"): "sale_id",
+    ("sales_form", "sale_id"): "sale_id",
+    ("add_vendor_collection", "vendor_name"): "vendor_name",
+    ("combined_party_ledger", "name"): "client_name",
+}
+
+
+def bench_targets(app, samples):
+    """[(label, url)] for every benchmarkable GET route."""
+    from flask import url_for
+
+    targets = []
+    with app.test_request_context():
+        for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.rule):
+            if "GET" not in rule.methods or rule.endpoint in SKIP_ENDPOINTS:
+                continue
+            variants = []
+            if rule.endpoint == "party_ledger":
+                variants = [{"party_type": "client", "name": samples["client_name"]},
+                            {"party_type": "vendor", "name": samples["vendor_name"]}]
+            elif rule.arguments:
+                values = {}
+                for arg in rule.arguments:
+                    key = URL_ARGS.get((rule.endpoint, arg))
+                    if key is None or samples.get(key) is None:
+                        values = None
+                        break
+                    values[arg] = samples[key]
+                if values is None:
+                    continue
+                variants = [values]
+            else:
+                variants = [{}]
+            extra = EXTRA_ARGS.get(rule.endpoint, lambda s: {})(samples)
+            for values in variants:
+                label = rule.endpoint
+                if "party_type" in values:
+                    label += f"[{values['party_type']}]"
+                elif rule.arguments:
+                    label += "[id]"   # e.g. sales_form (new) vs sales_form[id] (edit)
+                targets.append((label, url_for(rule.endpoint, **values, **extra)))
+    return targets
+
+
+def dataset_path(scale):
+    return os.path.abspath(os.path.join(BENCH_DIR, f"synthetic-s{scale:g}-seed{SEED}.db"))
+
+
+def build_dataset(scale):
+    from app import create_app, seed_synthetic
+
+    path = dataset_path(scale)
+    if os.path.exists(path):
+        return path
+    os.makedirs(BENCH_DIR, exist_ok=True)
+    tmp = path + ".partial"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(tmp + suffix):
+            os.remove(tmp + suffix)
+    app = create_app({"DATABASE_URL": f"sqlite:///{tmp}"})
+    print(f"Building dataset scale={scale:g} ...")
+    started = time.time()
+    with app.app_context():
+        rows = sum(seed_synthetic(scale=scale, seed=SEED).values())
+        from app import db
+        db.session.execute(db.text("PRAGMA wal_checkpoint(TRUNCATE)"))
+        db.engine.dispose()
+    os.replace(tmp, path)
+    print(f"  {rows:,} rows in {time.time() - started:.1f}s -> {path}")
+    return path
+
+
+def run_size(scale, iterations, route_filter):
+    from sqlalchemy import event
+    from app import create_app, db
+
+    path = build_dataset(scale)
+    app = create_app({"DATABASE_URL": f"sqlite:///{path}"})
+    app.logger.disabled = True   # failing routes show up as their status code
+    client = app.test_client()
+    # Signed-in session without needing APP_USER / APP_PASS
+    with client.session_transaction() as sess:
+        sess["user"] = "bench"
+
+    with app.app_context():
+        samples = sample_values(db, db.text)
+        engine = db.engine
+    targets = bench_targets(app, samples)
+    if route_filter:
+        targets = [t for t in targets if any(f in t[0] or f in t[1] for f in route_filter)]
+
+    counter = {"n": 0}
+
+    def count(*_args, **_kwargs):
+        counter["n"] += 1
+
+    results = {}
+    for label, url in targets:
+        # warm-up + query count
+        event.listen(engine, "before_cursor_execute", count)
+        counter["n"] = 0
+        resp = client.get(url)
+        event.remove(engine, "before_cursor_execute", count)
+        queries = counter["n"]
+        status = resp.status_code
+
+        # Collector off while timing, as timeit does: with few iterations p95
+        # is close to the max, and one GC pause would read as a regression
+        timings = []
+        gc.collect()
+        gc.disable()
+        try:
+            for _ in range(iterations):
+                started = time.perf_counter()
+                client.get(url)
+                timings.append((time.perf_counter() - started) * 1000)
+        finally:
+            gc.enable()
+
+        tracemalloc.start()
+        client.get(url)
+        _current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        timings.sort()
+        results[label] = {
+            "url": url,
+            "status": status,
+            "queries": queries,
+            "p50_ms": round(statistics.median(timings), 2),
+            "p95_ms": round(timings[min(len(timings) - 1, int(round(0.95 * (len(timings) - 1))))], 2),
+            "peak_kb": round(peak / 1024, 1),
+        }
+        r = results[label]
+        print(f"  {label:<32} {status:>3}  p50 {r['p50_ms']:>8.1f} ms  p95 {r['p95_ms']:>8.1f} ms  "
+              f"{queries:>5} q  {r['peak_kb']:>9.0f} KB")
+    with app.app_context():
+        db.engine.dispose()
+    return results
+
+
+def compare(size_key, results, baseline, args):
+    """Returns a list of human-readable regressions for one size."""
+    problems = []
+    if size_key not in baseline:
+        return [f"{size_key}: no baseline; run with --update-baseline"]
+    base_size = baseline[size_key]
+    for label, r in results.items():
+        if not 200 <= r["status"] < 400:
+            problems.append(f"{size_key} {label}: HTTP {r['status']}")
+            continue
+        base = base_size.get(label)
+        if not base:
+            problems.append(f"{size_key} {label}: no baseline; run with --update-baseline")
+            continue
+        if r["queries"] > base["queries"]:
+            problems.append(f"{size_key} {label}: {r['queries']} queries (baseline {base['queries']})")
+        p95_budget = base["p95_ms"] * (1 + args.tolerance) + args.noise_ms
+        if r["p95_ms"] > p95_budget:
+            problems.append(f"{size_key} {label}: p95 {r['p95_ms']:.1f} ms > budget {p95_budget:.1f} ms")
+        mem_budget = base["peak_kb"] * (1 + args.mem_tolerance) + 512
+        if r["peak_kb"] > mem_budget:
+            problems.append(f"{size_key} {label}: peak {r['peak_kb']:.0f} KB > budget {mem_budget:.0f} KB")
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sizes", default="0.1,1", help="comma-separated seed_synthetic scales")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--routes", default="", help="comma-separated substrings of endpoint or URL")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 growth (fraction)")
+    parser.add_argument("--noise-ms", type=float, default=5.0, help="absolute p95 slack (ms)")
+    parser.add_argument("--mem-tolerance", type=float, default=0.5, help="allowed peak memory growth (fraction)")
+    parser.add_argument("--json", help="also write this run's results to a JSON file")
+    args = parser.parse_args(argv)
+
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        print(f"ERROR: no baseline at {args.baseline}; nothing to compare against.\n"
+              f"Record one with --update-baseline (and commit it).", file=sys.stderr)
+        sys.exit(2)
+
+    route_filter = [r for r in args.routes.split(",") if r]
+    run = {}
+    for scale in (float(s) for s in args.sizes.split(",") if s):
+        key = f"scale={scale:g}"
+        print(f"\n== {key} ==")
+        run[key] = run_size(scale, args.iterations, route_filter)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(run, f, indent=1, sort_keys=True)
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        for key, results in run.items():
+            baseline.setdefault(key, {}).update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=1, sort_keys=True)
+        print(f"\nBaseline written to {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    problems = []
+    for key, results in run.items():
+        problems += compare(key, results, baseline, args)
+    if problems:
+        print(f"\n{len(problems)} regression(s):")
+        for p in problems:
+            print(f"  - {p}")
+        sys.exit(1)
+    print("\nAll routes within budget.")
+
+
+if __name__ == "__main__":
+    main()
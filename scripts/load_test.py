@@ -0,0 +1,326 @@
+"""
+Concurrent load test: counter staff saving sales / collections while others
+open the dashboard, long ledgers and reports.
+
+Each virtual user signs in through /login with its own cookie jar, then loops
+over a weighted mix of scenarios until --duration runs out. Reads and writes
+hit the real routes, so run it against a scratch database (for example one
+built with `flask seed-synthetic`), never production.
+
+At the end it prints, per scenario and overall: requests, throughput,
+p50/p95/p99/max latency, failures, and SQLite lock errors. A lock error is a
+response that mentions "database is locked" (the forms flash the exception)
+or an HTTP 503 (write lock not acquired after retries); other 5xx responses
+count as plain errors. It then prints the server's /api/write-contention
+counters for the worker that answered.
+
+Usage:
+    # against a running server (e.g. gunicorn -c gunicorn.conf.py wsgi:app)
+    APP_PASS=... python scripts/load_test.py --url http://127.0.0.1:8000 --users 8 --duration 60
+
+    # or start a threaded dev server in-process on a scratch database
+    APP_PASS=x python scripts/load_test.py --serve --db /tmp/load.db --users 8
+
+    # custom mix (weights), e.g. write-heavy
+    ... --mix dashboard=1,ledger=1,new_sale=6,collection=2
+"""
+import argparse
+import http.cookiejar
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from datetime import date
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+DEFAULT_MIX = {
+    "dashboard": 2,
+    "ledger": 2,
+    "sales_list": 1,
+    "report": 1,
+    "leads_api": 1,
+    "new_sale": 3,
+    "collection": 1,
+    "new_lead": 1,
+}
+WRITE_SCENARIOS = {"new_sale", "collection", "new_lead"}
+LOCK_MARKERS = (b"database is locked", b"database table is locked")
+
+
+class Session:
+    """One signed-in user: cookie jar + small request helpers."""
+
+    def __init__(self, base_url, timeout):
+        self.base = base_url.rstrip("/")
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()),
+            _NoRedirect(),
+        )
+
+    def request(self, path, data=None, json_body=None):
+        """Returns (status, body bytes); redirects are not followed."""
+        headers = {}
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers["Content-Type"] = "application/json"
+        elif data is not None:
+            body = urllib.parse.urlencode(data, doseq=True).encode()
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        req = urllib.request.Request(self.base + path, data=body, headers=headers)
+        try:
+            with self.opener.open(req, timeout=self.timeout) as resp:
+                return resp.status, resp.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def login(self, user, password):
+        status, _ = self.request("/login", data={"username": user, "password": password})
+        if status != 302:
+            raise SystemExit(f"Login failed for {user!r} (HTTP {status}); set APP_USER / APP_PASS")
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+def discover(session):
+    """Client / product ids and names from the sale form, so writes use real masters."""
+    status, html = session.request("/sales/new")
+    if status != 200:
+        raise SystemExit(f"Could not load /sales/new (HTTP {status})")
+    html = html.decode("utf-8", "replace")
+
+    def options(select_marker):
+        start = html.find(select_marker)
+        end = html.find("</select>", start)
+        if start < 0:
+            return []
+        return [(int(v), re.sub(r"\s+", " ", label).strip())
+                for v, label in re.findall(r'<option value="(\d+)"[^>]*>([^<]*)', html[start:end])]
+
+    clients = options('id="client_id"')
+    products = options("product-select-template")
+    if not clients or not products:
+        raise SystemExit("Need at least one client and one product (seed the database first)")
+    return {"clients": clients, "products": products}
+
+
+def scenario_request(name, rnd, masters):
+    """(path, form, json) for one scenario; form/json are None for reads."""
+    client_id, client_name = rnd.choice(masters["clients"])
+    today = date.today().isoformat()
+    if name == "dashboard":
+        return "/", None, None
+    if name == "ledger":
+        return "/ledger/client/" + urllib.parse.quote(client_name), None, None
+    if name == "sales_list":
+        return "/sales", None, None
+    if name == "report":
+        return rnd.choice(["/reports/monthly-performance", "/reports/payment-aging",
+                           "/reports/stock", "/payments"]), None, None
+    if name == "leads_api":
+        return "/api/leads?limit=200", None, None
+    if name == "new_sale":
+        lines = rnd.randint(1, 3)
+        form = {
+            "date": today, "sale_type": "bill", "client_id": client_id, "client_name": "",
+            "freight": 0, "misc_amount": 0,
+            "product_id[]": [], "quantity[]": [], "unit[]": [], "cost_rate[]": [],
+            "sell_rate[]": [], "gst_percent[]": [],
+        }
+        for _ in range(lines):
+            rate = round(rnd.uniform(10, 60), 2)
+            form["product_id[]"].append(rnd.choice(masters["products"])[0])
+            form["quantity[]"].append(rnd.choice([50, 100, 250]))
+            form["unit[]"].append("kg")
+            form["cost_rate[]"].append(rate)
+            form["sell_rate[]"].append(round(rate * 1.15, 2))
+            form["gst_percent[]"].append(18)
+        return "/sales/new", form, None
+    if name == "collection":
+        return f"/client/{client_id}/collection", {
+            "amount": rnd.choice([1000, 5000, 25000]), "date": today,
+            "mode": rnd.choice(["Cash", "Bank", "UPI"]), "notes": "load test",
+        }, None
+    if name == "new_lead":
+        return "/api/leads", None, {"name": f"Load test lead {rnd.randint(1, 10**6)}",
+                                   "comments": "load test", "deal_status": "Need To Visit"}
+    raise ValueError(f"unknown scenario {name}")
+
+
+def classify(name, status, body):
+    """'ok', 'locked' or 'error' for one response."""
+    if any(m in body for m in LOCK_MARKERS) or status == 503:
+        return "locked"
+    if status >= 500:
+        return "error"
+    if name in WRITE_SCENARIOS:
+        # Forms redirect on success and re-render with a flashed error otherwise
+        if name == "new_lead":
+            return "ok" if status == 201 or status == 200 else "error"
+        return "ok" if status == 302 else "error"
+    return "ok" if status == 200 else "error"
+
+
+def worker(idx, args, masters, names, weights, deadline, results, lock):
+    rnd = random.Random(args.seed + idx)
+    session = Session(args.url, args.timeout)
+    session.login(args.user, args.password)
+    local = []
+    while time.time() < deadline:
+        name = rnd.choices(names, weights)[0]
+        path, form, body = scenario_request(name, rnd, masters)
+        started = time.perf_counter()
+        try:
+            status, resp = session.request(path, data=form, json_body=body)
+            outcome = classify(name, status, resp)
+        except Exception as e:   # timeouts, resets
+            status, outcome = 0, "locked" if "locked" in str(e) else "error"
+        local.append((name, (time.perf_counter() - started) * 1000, outcome, status))
+        if args.think_ms:
+            time.sleep(rnd.uniform(0, args.think_ms) / 1000)
+    with lock:
+        results.extend(local)
+
+
+def percentile(sorted_vals, pct):
+    if not sorted_vals:
+        return 0.0
+    return sorted_vals[min(len(sorted_vals) - 1, int(round(pct / 100 * (len(sorted_vals) - 1))))]
+
+
+def summarize(results, elapsed):
+    groups = {}
+    for name, ms, outcome, _status in results:
+        groups.setdefault(name, []).append((ms, outcome))
+    groups["ALL"] = [(ms, outcome) for _n, ms, outcome, _s in results]
+
+    summary = {}
+    print(f"\n{'scenario':<12} {'reqs':>6} {'req/s':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} "
+          f"{'errors':>7} {'locked':>7}")
+    for name in sorted(groups, key=lambda n: (n == "ALL", n)):
+        rows = groups[name]
+        lat = sorted(ms for ms, _ in rows)
+        s = {
+            "requests": len(rows),
+            "rps": round(len(rows) / elapsed, 2),
+            "p50_ms": round(statistics.median(lat), 1) if lat else 0.0,
+            "p95_ms": round(percentile(lat, 95), 1),
+            "p99_ms": round(percentile(lat, 99), 1),
+            "max_ms": round(lat[-1], 1) if lat else 0.0,
+            "errors": sum(1 for _, o in rows if o == "error"),
+            "locked": sum(1 for _, o in rows if o == "locked"),
+        }
+        summary[name] = s
+        print(f"{name:<12} {s['requests']:>6} {s['rps']:>7.1f} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} "
+              f"{s['p99_ms']:>8.1f} {s['max_ms']:>8.1f} {s['errors']:>7} {s['locked']:>7}")
+    return summary
+
+
+def serve_in_process(db_path, port):
+    """Threaded werkzeug server on a scratch database; returns its base URL."""
+    from werkzeug.serving import make_server
+    from app import create_app
+
+    app = create_app({"DATABASE_URL": f"sqlite:///{os.path.abspath(db_path)}"})
+    app.logger.disabled = True
+    server = make_server("127.0.0.1", port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def parse_mix(spec):
+    mix = dict(DEFAULT_MIX)
+    if spec:
+        mix = {}
+        for part in spec.split(","):
+            name, _, weight = part.partition("=")
+            mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(DEFAULT_MIX)
+    if unknown:
+        raise SystemExit(f"Unknown scenario(s): {', '.join(sorted(unknown))}. Known: {', '.join(DEFAULT_MIX)}")
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5002")
+    parser.add_argument("--serve", action="store_true", help="start an in-process threaded server")
+    parser.add_argument("--db", default="instance/load_test.db", help="database for --serve")
+    parser.add_argument("--port", type=int, default=0, help="port for --serve (0 = any free port)")
+    parser.add_argument("--users", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--mix", default="", help="scenario=weight,... (default: %s)" %
+                        ",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()))
+    parser.add_argument("--think-ms", type=float, default=0.0, help="max random pause between requests")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--user", default=os.environ.get("APP_USER", "yash"))
+    parser.add_argument("--password", default=os.environ.get("APP_PASS"))
+    parser.add_argument("--json", help="write the summary to this file")
+    args = parser.parse_args(argv)
+
+    if not args.password:
+        raise SystemExit("Set APP_PASS (or --password) to the server's login password")
+    mix = parse_mix(args.mix)
+    if args.serve:
+        args.url = serve_in_process(args.db, args.port)
+        print(f"Serving {args.db} at {args.url}")
+
+    probe = Session(args.url, args.timeout)
+    probe.login(args.user, args.password)
+    masters = discover(probe)
+    names, weights = list(mix), list(mix.values())
+    print(f"{args.users} users for {args.duration:g}s, mix: "
+          + ", ".join(f"{n}={w:g}" for n, w in mix.items()))
+
+    results, lock = [], threading.Lock()
+    started = time.time()
+    deadline = started + args.duration
+    threads = [threading.Thread(target=worker, args=(i, args, masters, names, weights, deadline, results, lock))
+               for i in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - started
+
+    summary = summarize(results, elapsed)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"users": args.users, "duration_s": round(elapsed, 1), "mix": mix,
+                       "scenarios": summary}, f, indent=1)
+    total = summary.get("ALL", {})
+    if total.get("locked"):
+        print(f"\n{total['locked']} request(s) hit SQLite lock errors")
+    print_contention(probe)
+
+
+def print_contention(session):
+    """Server-side write-lock waits / retries (one worker's counters)."""
+    status, body = session.request("/api/write-contention")
+    if status != 200:
+        return
+    stats = json.loads(body)
+    rows = stats["endpoints"]
+    print(f"\nwrite lock (pid {stats['pid']}): {'endpoint':<22} {'txns':>6} {'waited':>7} {'retries':>7} "
+          f"{'failed':>6} {'avg ms':>8} {'max ms':>8}")
+    for name in sorted(rows, key=lambda n: (n == "ALL", n)):
+        m = rows[name]
+        print(f"{'':<19} {name:<22} {m['transactions']:>6} {m['contended']:>7} {m['retries']:>7} "
+              f"{m['failures']:>6} {m['wait_ms_avg']:>8.1f} {m['wait_ms_max']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
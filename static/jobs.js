@@ -0,0 +1,48 @@
+// Runs heavy report / export links as background jobs.
+// Any <a data-bg-job> is submitted to /jobs; we poll /jobs/<id> and open the
+// cached result when it is ready, so the request never ties up a worker.
+document.addEventListener("DOMContentLoaded", function() {
+  const POLL_MS = 1000;
+
+  function poll(job, link, label) {
+    fetch(`/jobs/${job.id}`).then(r => r.json()).then(j => {
+      if (j.status === "done") {
+        link.innerHTML = label;
+        link.classList.remove("disabled");
+        window.location = j.result_url;
+      } else if (j.status === "failed") {
+        link.innerHTML = label;
+        link.classList.remove("disabled");
+        alert("Report failed: " + (j.error || "unknown error"));
+      } else {
+        setTimeout(() => poll(j, link, label), POLL_MS);
+      }
+    }).catch(err => {
+      link.innerHTML = label;
+      link.classList.remove("disabled");
+      alert("Error: " + err);
+    });
+  }
+
+  document.querySelectorAll("a[data-bg-job]").forEach(link => {
+    link.addEventListener("click", (e) => {
+      e.preventDefault();
+      if (link.classList.contains("disabled")) return;
+      const label = link.innerHTML;
+      link.classList.add("disabled");
+      link.innerHTML = '<span class="spinner-border spinner-border-sm me-1"></span> Preparing…';
+      fetch("/jobs", {
+        method: "POST",
+        headers: {"Content-Type": "application/json"},
+        body: JSON.stringify({ url: link.getAttribute("href") }),
+      }).then(r => r.json()).then(job => {
+        if (job.error) throw job.error;
+        poll(job, link, label);
+      }).catch(err => {
+        link.innerHTML = label;
+        link.classList.remove("disabled");
+        alert("Error: " + err);
+      });
+    });
+  });
+});
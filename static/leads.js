@@ -89,30 +89,67 @@ document.addEventListener("DOMContentLoaded", function() {
       });
   }
 
-  // --- Load leads and render rows ---
-  // accepts optional location_id, location_name, and dealStatuses (array)
-  function loadLeads(location_id = null, location_name = null, dealStatuses = null) {
-    const params = new URLSearchParams();
+  // --- Local lead store (synced incrementally via /api/leads?updated_since=) ---
+  const leadsById = new Map();
+  let lastSync = null;
+  let currentQuery = null;   // filter params of the list currently shown
+
+  function leadsQuery(location_id, dealStatuses) {
+    // limit asks for the paged {items, next_cursor, ...} response
+    const params = new URLSearchParams({ limit: 500 });
     if (location_id) params.append("location_id", location_id);
     if (dealStatuses && Array.isArray(dealStatuses) && dealStatuses.length) {
       params.append("deal_status", dealStatuses.join(","));
     }
-    let url = "/api/leads";
-    const qs = params.toString();
-    if (qs) url += `?${qs}`;
+    return params;
+  }
+
+  function fetchLeadsPage(params) {
+    return fetch(`/api/leads?${params.toString()}`, { credentials: 'same-origin' })
+      .then(r => {
+        if (!r.ok) return r.text().then(t => { throw { status: r.status, body: t }; });
+        return r.json();
+      });
+  }
+
+  // Follows next_cursor until the whole (filtered) list is loaded
+  function fetchAllLeads(params, cursor = null, acc = []) {
+    const p = new URLSearchParams(params);
+    if (cursor) p.set("cursor", cursor);
+    return fetchLeadsPage(p).then(page => {
+      acc.push(page);
+      return page.next_cursor ? fetchAllLeads(params, page.next_cursor, acc) : acc;
+    });
+  }
+
+  function applyPages(pages) {
+    pages.forEach(page => {
+      page.items.forEach(l => leadsById.set(l.id, l));
+      (page.removed || []).forEach(id => leadsById.delete(id));
+    });
+    // server_time of the first page: anything changed after it shows up next sync
+    if (pages.length) lastSync = pages[0].server_time;
+  }
+
+  function renderCurrent() {
+    renderLeadsRows(Array.from(leadsById.values()).sort((a, b) => b.id - a.id));
+  }
+
+  // --- Load leads and render rows ---
+  // accepts optional location_id, location_name, and dealStatuses (array)
+  function loadLeads(location_id = null, location_name = null, dealStatuses = null) {
+    currentQuery = leadsQuery(location_id, dealStatuses);
 
     const grid = document.getElementById("leads-grid");
     if (grid) grid.innerHTML = `<div class="col-12 text-center loading-text py-5"><div class="spinner-border spinner-border-sm text-primary me-2"></div> Loading…</div>`;
     // keep legacy compat
     leadsTableBody.innerHTML = `<tr><td colspan="7">Loading...</td></tr>`;
 
-    fetch(url, { credentials: 'same-origin' })
-      .then(r => {
-        if (!r.ok) return r.text().then(t => { throw { status: r.status, body: t }; });
-        return r.json();
-      })
-      .then(data => {
-        renderLeadsRows(data);
+    fetchAllLeads(currentQuery)
+      .then(pages => {
+        leadsById.clear();
+        applyPages(pages);
+        renderCurrent();
         currentLocationName.textContent = location_name ? `(${location_name})` : "(All)";
       })
       .catch(err => {
@@ -122,6 +159,19 @@ document.addEventListener("DOMContentLoaded", function() {
       });
   }
 
+  // Pulls only what changed since the last load/sync (after add/edit/delete)
+  function syncLeads() {
+    if (!currentQuery || !lastSync) return loadLeads();
+    const params = new URLSearchParams(currentQuery);
+    params.set("updated_since", lastSync);
+    return fetchAllLeads(params)
+      .then(pages => {
+        applyPages(pages);
+        renderCurrent();
+      })
+      .catch(err => console.error("syncLeads error:", err));
+  }
+
   // --- Render rows with Edit + Delete actions ---
 // --- Render rows with Edit + Delete actions (and mobile cards) ---
 function renderLeadsRows(leads) {
@@ -293,9 +343,7 @@ document.getElementById("edit-lead-form").addEventListener("submit", function(ev
     })
     .then(() => {
       bootstrap.Modal.getInstance(document.getElementById("editLeadModal")).hide();
-      const locVal = filterSelect ? filterSelect.value || null : null;
-      const locText = (filterSelect && filterSelect.selectedIndex >= 0) ? filterSelect.options[filterSelect.selectedIndex].text : null;
-      loadLeads(locVal, locText, getCurrentDealSelections());
+      syncLeads();
     })
     .catch(err => {
       console.error("update error:", err);
@@ -310,10 +358,7 @@ document.getElementById("edit-lead-form").addEventListener("submit", function(ev
     fetch(`/api/leads/${id}`, { method: "DELETE", credentials: 'same-origin' })
       .then(r => {
         if (!r.ok) return r.text().then(t => Promise.reject(t));
-        // reload with current filters
-        const locVal = filterSelect ? filterSelect.value || null : null;
-        const locText = (filterSelect && filterSelect.selectedIndex >= 0) ? filterSelect.options[filterSelect.selectedIndex].text : null;
-        loadLeads(locVal, locText, getCurrentDealSelections());
+        syncLeads();
       })
       .catch(err => {
         console.error("delete error:", err);
@@ -431,12 +476,10 @@ async function startInlineEdit(tr, lead) {
     // focus first input
     nameInput.focus();
 
-    // cancel handler: reload leads to restore original
+    // cancel handler: re-render from the local store to restore original
     cancelBtn.addEventListener("click", (ev) => {
       ev.preventDefault();
-      const locVal = filterSelect ? filterSelect.value || null : null;
-      const locText = (filterSelect && filterSelect.selectedIndex >= 0) ? filterSelect.options[filterSelect.selectedIndex].text : null;
-      loadLeads(locVal, locText, getCurrentDealSelections());
+      renderCurrent();
     });
 
     // save handler: send PUT
@@ -471,9 +514,7 @@ async function startInlineEdit(tr, lead) {
           return r.json();
         })
         .then(updated => {
-          const locVal = filterSelect ? filterSelect.value || null : null;
-          const locText = (filterSelect && filterSelect.selectedIndex >= 0) ? filterSelect.options[filterSelect.selectedIndex].text : null;
-          loadLeads(locVal, locText, getCurrentDealSelections());
+          syncLeads();
         })
         .catch(err => {
           console.error("update error:", err);
@@ -514,9 +555,7 @@ async function startInlineEdit(tr, lead) {
         return r.json();
       }).then(_ => {
         addLeadForm.reset();
-        const locVal = filterSelect ? filterSelect.value || null : null;
-        const locText = (filterSelect && filterSelect.selectedIndex >= 0) ? filterSelect.options[filterSelect.selectedIndex].text : null;
-        loadLeads(locVal, locText, getCurrentDealSelections());
+        syncLeads();
       }).catch(err => {
         console.error("add lead error:", err);
         alert(err?.error || "Error adding lead");
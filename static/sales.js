@@ -190,7 +190,7 @@
           gstSelect.value = gst_val;
 
           tr.innerHTML = "" +
-            '<td class="prod-cell"></td>' +
+            '<td class="prod-cell"><input type="hidden" name="line_id[]" value=""></td>' +
             '<td><input name="quantity[]" class="form-control" value="' + (q) + '"></td>' +
             '<td><select name="unit[]" class="form-select">' +
             '<option value="kg"' + (unit === "kg" ? " selected" : "") + '>kg</option>' +
@@ -236,7 +236,7 @@
             }
 
             tr.innerHTML = "" +
-              '<td class="select-cell"></td>' +
+              '<td class="select-cell"><input type="hidden" name="cash_line_id[]" value=""></td>' +
               '<td><input name="batches[]" class="form-control" value="' + batches + '"></td>' +
               '<td><input class="form-control cp-per-batch" readonly value="' + cp + '"></td>' +
               '<td><input class="form-control sp-per-batch" name="sp_batch[]" value="' + sp + '"></td>' +
@@ -359,6 +359,69 @@
         });
         if (addRowCashBtn) addRowCashBtn.addEventListener('click', function () { makeCashRow('', 1, '', ''); computeCashTotals(); });
 
+        // Last-rate autofill: one request for every bill line of the invoice.
+        // Only empty rates (or ones we filled earlier) are touched.
+        var clientIdEl = qs("#client_id");
+        var clientNameEl = qs("#client_name");
+
+        function currentClientName() {
+          var typed = clientNameEl ? clientNameEl.value.trim() : "";
+          if (typed) return typed;
+          if (clientIdEl && clientIdEl.value) {
+            var opt = clientIdEl.options[clientIdEl.selectedIndex];
+            return opt ? opt.text.trim() : "";
+          }
+          return "";
+        }
+
+        function prefillLastRates() {
+          try {
+            var party = currentClientName();
+            if (!party) return;
+            var targets = [];
+            qsa(".item-row", itemsBodyBill).forEach(function (r) {
+              var prod = qs('select[name="product_id[]"]', r);
+              var sell = qs('input[name="sell_rate[]"]', r);
+              if (!prod || !prod.value || !sell) return;
+              if (sell.value && sell.dataset.autofill !== "1") return;
+              targets.push({ productId: prod.value, sell: sell });
+            });
+            if (!targets.length) return;
+
+            var ids = targets.map(function (t) { return t.productId; });
+            var url = "/api/last-rates?side=sale&party=" + encodeURIComponent(party) +
+                      "&product_id=" + encodeURIComponent(ids.join(","));
+            fetch(url, { credentials: "same-origin" })
+              .then(function (res) { return res.ok ? res.json() : { rates: {} }; })
+              .then(function (data) {
+                var rates = data.rates || {};
+                targets.forEach(function (t) {
+                  var last = rates[t.productId];
+                  if (last) {
+                    t.sell.value = last.rate;
+                    t.sell.dataset.autofill = "1";
+                    t.sell.title = "Last sold " + last.date + ": ₹" + last.rate + "/kg × " + last.qty + " kg";
+                  } else if (t.sell.dataset.autofill === "1") {
+                    t.sell.value = "";
+                    t.sell.removeAttribute("title");
+                  }
+                });
+                computeBillTotals();
+              })
+              .catch(logError);
+          } catch (e) { logError(e); }
+        }
+
+        itemsBodyBill.addEventListener("change", function (e) {
+          if (e.target && e.target.name === "product_id[]") prefillLastRates();
+        });
+        itemsBodyBill.addEventListener("input", function (e) {
+          // a typed rate is the user's, never overwrite it
+          if (e.target && e.target.name === "sell_rate[]") delete e.target.dataset.autofill;
+        });
+        if (clientIdEl) clientIdEl.addEventListener("change", prefillLastRates);
+        if (clientNameEl) clientNameEl.addEventListener("change", prefillLastRates);
+
         if (freightEl) freightEl.addEventListener('input', computeAll);
 
         if (gstPercentEl) gstPercentEl.addEventListener("change", computeAll);
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("APP_PASS", "test")
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    flask_app = app_module.create_app({
+        "DATABASE_URL": f"sqlite:///{tmp_path / 'test.db'}",
+        "TESTING": True,
+    })
+    flask_app.instance_path = str(tmp_path / "instance")
+    with flask_app.app_context():
+        app_module.upgrade_db(backup=False)
+        yield flask_app
+        app_module.db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    c = app.test_client()
+    c.post("/login", data={"username": os.environ.get("APP_USER", "yash"), "password": os.environ["APP_PASS"]})
+    return c
+
+
+@pytest.fixture
+def flashes(client):
+    def pop():
+        with client.session_transaction() as s:
+            return [msg for _cat, msg in s.pop("_flashes", [])]
+    return pop
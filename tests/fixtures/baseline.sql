@@ -0,0 +1,232 @@
+-- Schema and sample rows of a database created before schema versioning (the
+-- first release), for the upgrade_db round-trip test.
+CREATE TABLE expense_category (
+	id INTEGER NOT NULL, 
+	name VARCHAR(120) NOT NULL, 
+	PRIMARY KEY (id), 
+	UNIQUE (name)
+);
+CREATE TABLE client (
+	id INTEGER NOT NULL, 
+	name VARCHAR(160) NOT NULL, 
+	address TEXT, 
+	gst VARCHAR(32), 
+	phone VARCHAR(20), 
+	opening_balance FLOAT NOT NULL, 
+	PRIMARY KEY (id), 
+	UNIQUE (name)
+);
+CREATE TABLE sale (
+	id INTEGER NOT NULL, 
+	date DATE NOT NULL, 
+	client_name VARCHAR(160) NOT NULL, 
+	freight FLOAT NOT NULL, 
+	quantity_kg FLOAT DEFAULT '0.0' NOT NULL, 
+	sale_type VARCHAR(16) NOT NULL, 
+	gst_percent FLOAT NOT NULL, 
+	subtotal FLOAT NOT NULL, 
+	cgst_amount FLOAT NOT NULL, 
+	sgst_amount FLOAT NOT NULL, 
+	igst_amount FLOAT NOT NULL, 
+	misc_amount FLOAT NOT NULL, 
+	grand_total FLOAT NOT NULL, 
+	PRIMARY KEY (id)
+);
+CREATE TABLE employee (
+	id INTEGER NOT NULL, 
+	name VARCHAR(100) NOT NULL, 
+	monthly_salary FLOAT NOT NULL, 
+	PRIMARY KEY (id), 
+	UNIQUE (name)
+);
+CREATE TABLE vendor_collection (
+	id INTEGER NOT NULL, 
+	vendor_name VARCHAR(160) NOT NULL, 
+	date DATE NOT NULL, 
+	amount FLOAT NOT NULL, 
+	mode VARCHAR(50), 
+	notes VARCHAR(250), 
+	PRIMARY KEY (id)
+);
+CREATE TABLE purchase (
+	id INTEGER NOT NULL, 
+	date DATE NOT NULL, 
+	vendor_name VARCHAR(160) NOT NULL, 
+	freight FLOAT NOT NULL, 
+	gst_percent FLOAT NOT NULL, 
+	subtotal FLOAT NOT NULL, 
+	cgst_amount FLOAT NOT NULL, 
+	sgst_amount FLOAT NOT NULL, 
+	igst_amount FLOAT NOT NULL, 
+	grand_total FLOAT NOT NULL, 
+	PRIMARY KEY (id)
+);
+CREATE TABLE bottle_type (
+	id INTEGER NOT NULL, 
+	label VARCHAR(64) NOT NULL, 
+	quantity_ltr FLOAT NOT NULL, 
+	bottles_in_batch INTEGER NOT NULL, 
+	can_price FLOAT NOT NULL, 
+	price_per_kg FLOAT NOT NULL, 
+	box_cost FLOAT NOT NULL, 
+	selling_price_per_batch FLOAT NOT NULL, 
+	PRIMARY KEY (id), 
+	UNIQUE (label)
+);
+CREATE TABLE product (
+	id INTEGER NOT NULL, 
+	name VARCHAR(160) NOT NULL, 
+	current_stock_kg FLOAT NOT NULL, 
+	min_stock_kg FLOAT NOT NULL, 
+	valuation_rate FLOAT NOT NULL, 
+	PRIMARY KEY (id), 
+	UNIQUE (name)
+);
+CREATE TABLE location (
+	id INTEGER NOT NULL, 
+	name VARCHAR(120) NOT NULL, 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	UNIQUE (name)
+);
+CREATE TABLE loan (
+	id INTEGER NOT NULL, 
+	loan_type VARCHAR(16) NOT NULL, 
+	party_name VARCHAR(200) NOT NULL, 
+	principal FLOAT NOT NULL, 
+	interest_rate FLOAT NOT NULL, 
+	date_issued DATE NOT NULL, 
+	due_date DATE, 
+	notes TEXT, 
+	is_closed BOOLEAN NOT NULL, 
+	created_at DATETIME, 
+	PRIMARY KEY (id)
+);
+CREATE TABLE expense (
+	id INTEGER NOT NULL, 
+	employee_id INTEGER, 
+	date DATE NOT NULL, 
+	category VARCHAR(120) NOT NULL, 
+	description VARCHAR(300), 
+	amount FLOAT NOT NULL, 
+	mode VARCHAR(50), 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(employee_id) REFERENCES employee (id)
+);
+CREATE TABLE sale_item (
+	id INTEGER NOT NULL, 
+	sale_id INTEGER NOT NULL, 
+	product_id INTEGER, 
+	bottle_type_id INTEGER, 
+	quantity_kg FLOAT NOT NULL, 
+	cost_rate_per_kg FLOAT NOT NULL, 
+	selling_rate_per_kg FLOAT, 
+	gst_percent FLOAT DEFAULT '0.0' NOT NULL, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(sale_id) REFERENCES sale (id), 
+	FOREIGN KEY(product_id) REFERENCES product (id), 
+	FOREIGN KEY(bottle_type_id) REFERENCES bottle_type (id)
+);
+CREATE TABLE client_collection (
+	id INTEGER NOT NULL, 
+	client_id INTEGER NOT NULL, 
+	date DATE NOT NULL, 
+	amount FLOAT NOT NULL, 
+	mode VARCHAR(50), 
+	notes VARCHAR(250), 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(client_id) REFERENCES client (id)
+);
+CREATE TABLE purchase_item (
+	id INTEGER NOT NULL, 
+	purchase_id INTEGER NOT NULL, 
+	product_id INTEGER, 
+	quantity_kg FLOAT NOT NULL, 
+	rate_per_kg FLOAT NOT NULL, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(purchase_id) REFERENCES purchase (id), 
+	FOREIGN KEY(product_id) REFERENCES product (id)
+);
+CREATE TABLE purchase_payment (
+	id INTEGER NOT NULL, 
+	purchase_id INTEGER NOT NULL, 
+	date DATE NOT NULL, 
+	amount FLOAT NOT NULL, 
+	mode VARCHAR(50), 
+	notes VARCHAR(250), 
+	collection_id INTEGER, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(purchase_id) REFERENCES purchase (id), 
+	FOREIGN KEY(collection_id) REFERENCES vendor_collection (id)
+);
+CREATE TABLE product_batch (
+	id INTEGER NOT NULL, 
+	product_id INTEGER NOT NULL, 
+	rate FLOAT NOT NULL, 
+	quantity_kg FLOAT NOT NULL, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(product_id) REFERENCES product (id)
+);
+CREATE TABLE lead (
+	id INTEGER NOT NULL, 
+	name VARCHAR(200) NOT NULL, 
+	location_id INTEGER, 
+	indiamart_link VARCHAR(1024), 
+	deal_status VARCHAR(64), 
+	comments TEXT, 
+	address VARCHAR(1024), 
+	created_at DATETIME, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(location_id) REFERENCES location (id)
+);
+CREATE TABLE loan_repayment (
+	id INTEGER NOT NULL, 
+	loan_id INTEGER NOT NULL, 
+	date DATE NOT NULL, 
+	amount FLOAT NOT NULL, 
+	mode VARCHAR(50), 
+	notes VARCHAR(250), 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(loan_id) REFERENCES loan (id)
+);
+CREATE TABLE sale_payment (
+	id INTEGER NOT NULL, 
+	sale_id INTEGER NOT NULL, 
+	date DATE NOT NULL, 
+	amount FLOAT NOT NULL, 
+	mode VARCHAR(50), 
+	notes VARCHAR(250), 
+	collection_id INTEGER, 
+	PRIMARY KEY (id), 
+	FOREIGN KEY(sale_id) REFERENCES sale (id), 
+	FOREIGN KEY(collection_id) REFERENCES client_collection (id)
+);
+
+INSERT INTO client (id, name, address, gst, phone, opening_balance) VALUES (1, 'Acme Traders', 'Pune', NULL, '98200', 1500.5);
+INSERT INTO product (id, name, current_stock_kg, min_stock_kg, valuation_rate) VALUES
+  (1, 'Caustic Soda', 120.0, 0.0, 42.5), (2, 'Soda Ash', 30.0, 0.0, 18.0);
+INSERT INTO product_batch (id, product_id, rate, quantity_kg) VALUES
+  (1, 1, 40.0, 80.0), (2, 1, 45.0, 25.0), (3, 1, 45.00001, 15.0), (4, 2, 18.0, 30.0);
+INSERT INTO bottle_type (id, label, quantity_ltr, bottles_in_batch, can_price, price_per_kg, box_cost, selling_price_per_batch)
+  VALUES (1, '1 ltr', 1.0, 12, 4.25, 9.0, 21.0, 170.0);
+INSERT INTO purchase (id, date, vendor_name, freight, gst_percent, subtotal, cgst_amount, sgst_amount, igst_amount, grand_total)
+  VALUES (1, '2024-01-10', 'Vendor One', 0.0, 18.0, 4000.0, 360.0, 360.0, 0.0, 4720.0),
+         (2, '2024-02-10', 'Vendor One', 0.0, 0.0, 1125.0, 0.0, 0.0, 0.0, 1125.0);
+INSERT INTO purchase_item (id, purchase_id, product_id, quantity_kg, rate_per_kg) VALUES
+  (1, 1, 1, 100.0, 40.0), (2, 2, 1, 25.0, 45.0);
+INSERT INTO purchase_payment (id, purchase_id, date, amount, mode, notes, collection_id) VALUES
+  (1, 1, '2024-01-20', 4720.0, 'Bank', 'cleared', NULL);
+INSERT INTO sale (id, date, client_name, freight, quantity_kg, sale_type, gst_percent, subtotal, cgst_amount, sgst_amount, igst_amount, misc_amount, grand_total)
+  VALUES (1, '2024-03-01', 'Acme Traders', 0.0, 20.0, 'bill', 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0),
+         (2, '2024-03-05', 'Acme Traders', 0.0, 2.0, 'cash', 0.0, 340.0, 0.0, 0.0, 0.0, 0.0, 340.0);
+INSERT INTO sale_item (id, sale_id, product_id, bottle_type_id, quantity_kg, cost_rate_per_kg, selling_rate_per_kg, gst_percent)
+  VALUES (1, 1, 1, NULL, 20.0, 40.0, 55.25, 0.0), (2, 2, NULL, 1, 2.0, 0.0, 170.0, 0.0);
+INSERT INTO sale_payment (id, sale_id, date, amount, mode, notes, collection_id) VALUES
+  (1, 1, '2024-03-15', 500.0, 'UPI', 'part payment', NULL);
+INSERT INTO employee (id, name, monthly_salary) VALUES (1, 'Ravi', 15000.0);
+INSERT INTO expense (id, employee_id, date, category, description, amount, mode, created_at)
+  VALUES (1, 1, '2024-03-31', 'Salary', 'March', 15000.0, 'Cash', '2024-03-31 10:00:00');
+INSERT INTO loan (id, loan_type, party_name, principal, interest_rate, date_issued, due_date, notes, is_closed, created_at)
+  VALUES (1, 'given', 'Friend', 50000.0, 12.0, '2024-01-01', '2024-12-31', NULL, 0, '2024-01-01 09:00:00');
+INSERT INTO loan_repayment (id, loan_id, date, amount, mode, notes) VALUES (1, 1, '2024-06-01', 10000.25, 'Bank', NULL);
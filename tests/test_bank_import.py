@@ -0,0 +1,103 @@
+from datetime import date
+
+import pytest
+
+from app import (
+    Client, ClientCollection, Purchase, PurchasePayment, Sale, SalePayment, VendorCollection, db, match_statement,
+    post_bank_matches,
+)
+
+
+def stmt(line, day, amount, description, party_hint=""):
+    """A statement line as read_bank_statement returns it; negative amounts are debits."""
+    return {"line": line, "date": day, "description": description, "ref": f"R{line}", "party_hint": party_hint,
+            "side": "sale" if amount > 0 else "purchase", "amount": abs(amount)}
+
+
+@pytest.fixture
+def books(app):
+    db.session.add_all([Client(name=n) for n in ("Acme", "Bolt Traders", "Cobalt", "Dyna", "Eagle", "Fresh")])
+    db.session.commit()
+    sales = {
+        "acme_old": Sale(date=date(2025, 1, 5), client_name="Acme", grand_total=1000.0),
+        "acme_new": Sale(date=date(2025, 1, 10), client_name="Acme", grand_total=500.0),
+        "bolt_1": Sale(date=date(2025, 1, 8), client_name="Bolt Traders", grand_total=750.0),
+        "bolt_2": Sale(date=date(2025, 1, 12), client_name="Bolt Traders", grand_total=300.0),
+        "cobalt": Sale(date=date(2025, 1, 12), client_name="Cobalt", grand_total=250.0),
+        "eagle": Sale(date=date(2025, 1, 14), client_name="Eagle", grand_total=250.0),
+        "dyna": Sale(date=date(2025, 1, 3), client_name="Dyna", grand_total=420.0),
+    }
+    acid = Purchase(date=date(2025, 1, 4), vendor_name="Acid Co", grand_total=800.0)
+    db.session.add_all([*sales.values(), acid])
+    db.session.commit()
+    # Already entered by hand: the same credit must not be posted twice
+    db.session.add(ClientCollection(client_id=Client.query.filter_by(name="Acme").one().id,
+                                    date=date(2025, 2, 5), amount=1000.0, mode="Bank"))
+    db.session.commit()
+    return {**{k: s.id for k, s in sales.items()}, "acid": acid.id}
+
+
+def statement():
+    return [
+        stmt(1, date(2025, 2, 1), 500.0, "NEFT ACME"),
+        stmt(2, date(2025, 2, 2), 1200.0, "IMPS from Bolt Traders"),
+        stmt(3, date(2025, 2, 3), 420.0, "CASH DEP"),
+        stmt(4, date(2025, 2, 3), 250.0, "CHQ 114"),
+        stmt(5, date(2025, 2, 4), -800.0, "RTGS Acid Co"),
+        stmt(6, date(2025, 2, 5), 1000.0, "NEFT", party_hint="acme"),
+        stmt(7, date(2025, 2, 6), 99.0, "UPI Fresh"),
+    ]
+
+
+def test_match_statement_statuses(books):
+    lines = {l["line"]: l for l in match_statement(statement())}
+    status = {n: (l["status"], l["party"], l["accept"]) for n, l in lines.items()}
+    assert status == {
+        1: ("exact", "Acme", True),
+        2: ("fifo", "Bolt Traders", True),
+        3: ("amount", "Dyna", False),         # proposed, left for the user to confirm
+        4: ("unmatched", None, False),        # Cobalt and Eagle both have 250 open
+        5: ("exact", "Acid Co", True),
+        6: ("posted", "Acme", False),
+        7: ("on_account", "Fresh", False),
+    }
+    assert lines[1]["allocations"] == [(books["acme_new"], date(2025, 1, 10), 500.0)]
+    # Oldest bill first, the rest left unallocated on the collection
+    assert [(a[0], a[2]) for a in lines[2]["allocations"]] == [(books["bolt_1"], 750.0), (books["bolt_2"], 300.0)]
+    assert lines[2]["unallocated"] == 150.0
+    assert lines[3]["allocations"] == [(books["dyna"], date(2025, 1, 3), 420.0)]
+    assert lines[7]["unallocated"] == 99.0
+
+
+def test_override_picks_the_party(books):
+    lines = {l["line"]: l for l in match_statement(statement(), overrides={4: "Eagle"})}
+    assert (lines[4]["status"], lines[4]["party"]) == ("exact", "Eagle")
+    assert lines[4]["allocations"][0][0] == books["eagle"]
+
+
+def test_post_bank_matches_writes_linked_collections_and_payments(books):
+    lines = match_statement(statement())
+    lines[2]["accept"] = True    # the user confirms the amount-only match
+    written = post_bank_matches(lines)
+    assert written == {"sale": 3, "purchase": 1, "payments": 5}
+
+    bolt = ClientCollection.query.join(Client).filter(Client.name == "Bolt Traders").one()
+    assert (bolt.date, bolt.amount, bolt.mode) == (date(2025, 2, 2), 1200.0, "Bank")
+    assert "IMPS from Bolt Traders" in bolt.notes and "[R2]" in bolt.notes
+    paid = {p.sale_id: (p.amount, p.collection_id) for p in SalePayment.query}
+    assert paid == {
+        books["acme_new"]: (500.0, ClientCollection.query.join(Client).filter(
+            Client.name == "Acme", ClientCollection.date == date(2025, 2, 1)).one().id),
+        books["bolt_1"]: (750.0, bolt.id),
+        books["bolt_2"]: (300.0, bolt.id),
+        books["dyna"]: (420.0, ClientCollection.query.join(Client).filter(Client.name == "Dyna").one().id),
+    }
+    acid = VendorCollection.query.one()
+    assert (acid.vendor_name, acid.amount) == ("Acid Co", 800.0)
+    assert [(p.purchase_id, p.amount, p.collection_id) for p in PurchasePayment.query] == [(books["acid"], 800.0, acid.id)]
+
+    # Importing the same statement again finds every posted line it can name a party for;
+    # the cash deposit's only candidate bill is paid now
+    again = {l["line"]: l["status"] for l in match_statement(statement())}
+    assert [again[n] for n in (1, 2, 3, 5, 6)] == ["posted", "posted", "unmatched", "posted", "posted"]
+    assert post_bank_matches(match_statement(statement())) == {"sale": 0, "purchase": 0, "payments": 0}
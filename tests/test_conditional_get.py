@@ -0,0 +1,29 @@
+from app import BottleType, Client, Product, db
+
+
+def etag(client, url):
+    resp = client.get(url)
+    assert resp.status_code == 200
+    return resp.headers["ETag"]
+
+
+def test_product_ledger_etag_follows_bottle_types(client):
+    db.session.add_all([Product(name="A"), BottleType(label="1 ltr", quantity_ltr=1.0, bottles_in_batch=12)])
+    db.session.commit()
+    url = f"/product/{Product.query.one().id}/ledger"
+    before = etag(client, url)
+    assert client.get(url, headers={"If-None-Match": before}).status_code == 304
+
+    BottleType.query.one().quantity_ltr = 0.5
+    db.session.commit()
+    assert etag(client, url) != before
+
+
+def test_party_ledger_etag_follows_opening_balance(client):
+    db.session.add(Client(name="C1"))
+    db.session.commit()
+    before = etag(client, "/ledger/client/C1")
+
+    Client.query.one().opening_balance = 250.0
+    db.session.commit()
+    assert etag(client, "/ledger/client/C1") != before
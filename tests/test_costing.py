@@ -0,0 +1,88 @@
+import io
+
+import pytest
+
+from app import (
+    Client, Product, ProductBatch, Sale, SaleItemLot, allocate_lots, db, import_invoices, load_lots, to_rate_e4,
+)
+
+
+def test_fifo_takes_oldest_lots_first():
+    deltas = {}
+    taken = allocate_lots([[50_000, 10.0], [70_000, 10.0]], 15, "fifo", 0, deltas, 1)
+    assert taken == [(50_000, 10.0), (70_000, 5.0)]
+    assert deltas == {(1, 50_000): -10.0, (1, 70_000): -5.0}
+
+    # A second line sees what the first one left
+    assert allocate_lots([[50_000, 10.0], [70_000, 10.0]], 5, "fifo", 0, deltas, 1) == [(70_000, 5.0)]
+
+
+def test_weighted_average_takes_from_every_lot_in_proportion():
+    taken = allocate_lots([[50_000, 30.0], [70_000, 10.0]], 20, "wavg", 0, {}, 1)
+    assert taken == [(50_000, 15.0), (70_000, 5.0)]
+    # 20 kg at the moving average of (30 x 5 + 10 x 7) / 40 = 5.5
+    assert sum(key * kg for key, kg in taken) / 20 == 55_000
+
+
+def test_shortfall_goes_to_the_newest_lot_or_the_valuation_rate():
+    assert allocate_lots([[50_000, 10.0], [70_000, 4.0]], 20, "fifo", 0, {}, 1) == [(50_000, 10.0), (70_000, 10.0)]
+    assert allocate_lots([[50_000, 6.0], [70_000, 2.0]], 10, "wavg", 0, {}, 1) == [(50_000, 6.0), (70_000, 4.0)]
+    assert allocate_lots([], 3, "fifo", 60_000, {}, 1) == [(60_000, 3)]
+
+
+def sale_form(client_id, day, lines):
+    form = {"date": day, "sale_type": "bill", "client_id": client_id, "client_name": "", "freight": 0,
+            "misc_amount": 0, "line_id[]": [], "product_id[]": [], "quantity[]": [], "unit[]": [],
+            "cost_rate[]": [], "sell_rate[]": [], "gst_percent[]": []}
+    for line_id, product_id, qty in lines:
+        form["line_id[]"].append(line_id)
+        form["product_id[]"].append(product_id)
+        form["quantity[]"].append(qty)
+        form["unit[]"].append("kg")
+        form["cost_rate[]"].append(1)
+        form["sell_rate[]"].append(20)
+        form["gst_percent[]"].append(0)
+    return form
+
+
+@pytest.fixture(params=["fifo", "wavg"])
+def stocked(request, app):
+    db.session.add_all([Client(name="C1"), Product(name="A", costing_method=request.param)])
+    db.session.commit()
+    import_invoices("purchase", io.BytesIO(
+        b"date,party,product,quantity,rate\n"
+        b"2024-01-01,V1,A,30,5\n"
+        b"2024-02-01,V1,A,10,7\n"
+    ), "p.csv", dry_run=False)
+    return request.param, Client.query.one().id, Product.query.one().id
+
+
+def batches(pid):
+    db.session.expire_all()
+    return {b.rate: b.quantity_kg for b in ProductBatch.query.filter_by(product_id=pid)}
+
+
+def test_sale_form_costs_lines_from_lots_and_edit_puts_them_back(stocked, client):
+    method, cid, pid = stocked
+    assert client.post("/sales/new", data=sale_form(cid, "2024-03-01", [("", pid, 32)])).status_code == 302
+    item = Sale.query.one().items[0]
+    lots = {l.rate_key: l.quantity_kg for l in item.lots}
+    if method == "fifo":
+        assert lots == {to_rate_e4(5): 30.0, to_rate_e4(7): 2.0}
+        assert batches(pid) == {5.0: 0.0, 7.0: 8.0}
+    else:
+        assert lots == {to_rate_e4(5): 24.0, to_rate_e4(7): 8.0}
+        assert batches(pid) == {5.0: 6.0, 7.0: 2.0}
+    assert item.cost_rate_per_kg == round(sum(k * kg for k, kg in lots.items()) / 32 / 10_000, 4)
+
+    # Shrinking the line returns its lots and re-allocates from the full stock
+    sale_id, item_id = item.sale_id, item.id
+    client.post(f"/sales/{sale_id}/edit", data=sale_form(cid, "2024-03-01", [(str(item_id), pid, 8)]))
+    db.session.expire_all()
+    lots = {l.rate_key: l.quantity_kg for l in db.session.get(Sale, sale_id).items[0].lots}
+    assert lots == ({to_rate_e4(5): 8.0} if method == "fifo" else {to_rate_e4(5): 6.0, to_rate_e4(7): 2.0})
+
+    client.post(f"/sales/{sale_id}/delete")
+    assert SaleItemLot.query.count() == 0
+    assert batches(pid) == {5.0: 30.0, 7.0: 10.0}
+    assert load_lots({pid})[pid] == [[to_rate_e4(5), 30.0], [to_rate_e4(7), 10.0]]
@@ -0,0 +1,174 @@
+from datetime import date
+
+import pytest
+from sqlalchemy import text
+
+from app import (
+    BottleType, Client, ClientCollection, Lead, Location, Product, Purchase, PurchaseItem, PurchasePayment, Sale,
+    SaleItem, SalePayment, VendorCollection, db, ensure_last_rate, ensure_price_rollup, ensure_search_index,
+)
+
+
+def snapshot(table, columns):
+    db.session.expire_all()
+    rows = db.session.execute(text(f"SELECT {columns} FROM {table}"))
+    # Sums kept incrementally and recomputed in one pass differ in the last float bits
+    return sorted(tuple(round(v, 6) if isinstance(v, float) else v for v in r) for r in rows)
+
+
+def assert_matches_rebuild(table, columns, rebuild):
+    """What the triggers left in `table` equals a recompute from the source rows."""
+    kept = snapshot(table, columns)
+    rebuild()
+    assert kept == snapshot(table, columns)
+    return kept
+
+
+SEARCH_COLUMNS = "rowid, title, body, label, kind, ref_id"
+
+
+def check_search():
+    return assert_matches_rebuild("search_index", SEARCH_COLUMNS, lambda: ensure_search_index(rebuild=True))
+
+
+def test_search_index_follows_inserts_updates_and_deletes(app):
+    pune = Location(name="Pune")
+    db.session.add_all([pune, Lead(name="Acme Lead", comments="wants caustic", location=pune),
+                        Client(name="Mayachem", address="GIDC Vapi", phone="98200")])
+    db.session.commit()
+    sale = Sale(date=date(2025, 1, 5), client_name="Mayachem", grand_total=100.0,
+                payments=[SalePayment(date=date(2025, 1, 9), amount=50.0, mode="UPI", notes="first cheque")])
+    purchase = Purchase(date=date(2025, 1, 6), vendor_name="Acid Co",
+                        payments=[PurchasePayment(date=date(2025, 1, 8), amount=20.0, notes="neft 1")])
+    db.session.add_all([sale, purchase,
+                        ClientCollection(client_id=Client.query.one().id, date=date(2025, 1, 9), amount=50.0,
+                                         notes="RTGS"),
+                        VendorCollection(vendor_name="Acid Co", date=date(2025, 1, 9), amount=5.0, notes="refund")])
+    db.session.commit()
+    assert len(check_search()) == 6
+
+    lead = Lead.query.one()
+    lead.comments = "wants soda ash"
+    Client.query.one().address = "Plot 4, Sarigam"
+    SalePayment.query.one().notes = "second cheque"
+    VendorCollection.query.one().notes = "credit note"
+    ClientCollection.query.one().notes = "RTGS 2"
+    db.session.commit()
+    check_search()
+
+    # Renaming a parent re-labels the children, with nothing else on them touched
+    Location.query.one().name = "Pune East"
+    sale.client_name = "Mayachem Traders"
+    purchase.vendor_name = "Acid Corp"
+    db.session.commit()
+    check_search()
+    Client.query.one().name = "Mayachem Pvt"
+    db.session.commit()
+    labels = {r[4]: r[3] for r in check_search()}
+    assert labels[1] == "Pune East" and labels[3] == "Mayachem Traders"
+    assert labels[4] == "Acid Corp" and labels[5] == "Mayachem Pvt"
+
+    PurchasePayment.query.one().notes = ""    # no notes, no document
+    db.session.delete(ClientCollection.query.one())
+    db.session.delete(lead)
+    db.session.commit()
+    assert len(check_search()) == 3
+    purchase.payments[0].notes = "neft 2"
+    db.session.commit()
+    assert len(check_search()) == 4
+    db.session.delete(sale)
+    db.session.delete(purchase)
+    db.session.delete(Client.query.one())
+    db.session.delete(VendorCollection.query.one())
+    db.session.commit()
+    assert check_search() == []
+
+
+@pytest.fixture
+def trade(app):
+    db.session.add_all([Product(name="A"), Product(name="B"), BottleType(label="1 ltr", quantity_ltr=1.0,
+                        bottles_in_batch=12, can_price=4.25, price_per_kg=9.0, box_cost=21, selling_price_per_batch=170)])
+    db.session.commit()
+    a, b = (p.id for p in Product.query.order_by(Product.name))
+    bottle = BottleType.query.one().id
+    db.session.add_all([
+        Purchase(date=date(2025, 1, 3), vendor_name="V1", items=[
+            PurchaseItem(product_id=a, quantity_kg=100, rate_per_kg=5.0),
+            PurchaseItem(product_id=b, quantity_kg=50, rate_per_kg=8.0)]),
+        Purchase(date=date(2025, 2, 3), vendor_name="V2", items=[PurchaseItem(product_id=a, quantity_kg=40, rate_per_kg=5.5)]),
+        Sale(date=date(2025, 1, 10), client_name="C1", items=[
+            SaleItem(product_id=a, quantity_kg=10, cost_rate_per_kg=5.0, selling_rate_per_kg=9.0),
+            SaleItem(product_id=a, quantity_kg=5, cost_rate_per_kg=5.0, selling_rate_per_kg=9.5),
+            SaleItem(product_id=b, quantity_kg=20, cost_rate_per_kg=8.0, selling_rate_per_kg=12.0)]),
+        Sale(date=date(2025, 1, 20), client_name="C2", sale_type="cash", items=[
+            SaleItem(bottle_type_id=bottle, quantity_kg=3, cost_rate_per_kg=100.0, selling_rate_per_kg=170.0)]),
+        Sale(date=date(2025, 2, 14), client_name="C1", items=[
+            SaleItem(product_id=a, quantity_kg=7, cost_rate_per_kg=5.5, selling_rate_per_kg=10.0)]),
+    ])
+    db.session.commit()
+    return a, b
+
+
+def edit_trade(a, check):
+    """Line edits, moved and re-partied headers, dropped lines and a deleted invoice; `check` after each step."""
+    first, cash, later = Sale.query.order_by(Sale.date).all()
+    first.items[0].quantity_kg = 12
+    first.items[1].selling_rate_per_kg = 11.0
+    later.items[0].selling_rate_per_kg = 10.5   # C1's last rate for A
+    db.session.commit()
+    check()
+    later.date = date(2025, 1, 28)        # February bucket -> January
+    db.session.commit()
+    check()
+    first.client_name = "C3"
+    db.session.commit()
+    check()
+    db.session.delete(first.items[2])
+    db.session.commit()
+    check()
+    v1 = Purchase.query.filter_by(vendor_name="V1").one()
+    v1.date, v1.vendor_name = date(2025, 2, 1), "V3"
+    v1.items[0].rate_per_kg = 5.2
+    db.session.commit()
+    check()
+    db.session.delete(Purchase.query.filter_by(vendor_name="V2").one())
+    db.session.add(PurchaseItem(purchase_id=v1.id, product_id=a, quantity_kg=10, rate_per_kg=6.0))
+    db.session.add(SaleItem(sale_id=later.id, product_id=a, quantity_kg=1, cost_rate_per_kg=5.0,
+                            selling_rate_per_kg=8.0))
+    db.session.commit()
+    return check()
+
+
+ROLLUP_COLUMNS = "side, product_id, party, period, period_start, n_lines, qty_kg, amount, cost_amount, min_rate, max_rate, sum_rate"
+
+
+def check_rollup():
+    return assert_matches_rebuild("price_rollup", ROLLUP_COLUMNS, lambda: ensure_price_rollup(rebuild=True))
+
+
+def test_price_rollup_follows_line_and_header_changes(trade):
+    a, _b = trade
+    rows = check_rollup()
+    assert ("sale", a, "C1", "month", "2025-01-01") in {r[:5] for r in rows}
+
+    rows = edit_trade(a, check_rollup)
+    parties = {r[2] for r in rows if r[0] == "sale"}
+    assert parties == {"C1", "C3"}
+    assert {r[2] for r in rows if r[0] == "purchase"} == {"V3"}
+
+
+LAST_RATE_COLUMNS = "side, party, product_id, rate, cost_rate, qty_kg, date, head_id, item_id"
+
+
+def check_last_rate():
+    return assert_matches_rebuild("last_rate", LAST_RATE_COLUMNS, lambda: ensure_last_rate(rebuild=True))
+
+
+def test_last_rate_follows_line_and_header_changes(trade):
+    a, b = trade
+    rows = check_last_rate()
+    assert {(r[1], r[2]): r[3] for r in rows if r[0] == "sale"} == {("C1", a): 10.0, ("C1", b): 12.0}
+
+    rows = edit_trade(a, check_last_rate)
+    assert {(r[1], r[2]) for r in rows if r[0] == "sale"} == {("C1", a), ("C3", a)}
+    assert {(r[1], r[2]) for r in rows if r[0] == "purchase"} == {("V3", a), ("V3", b)}
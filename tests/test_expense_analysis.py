@@ -0,0 +1,68 @@
+from datetime import date
+
+import pytest
+
+from app import EXPENSE_MAX_MONTHS, Expense, db, expense_months, expense_summary
+
+
+@pytest.fixture
+def expenses(app):
+    db.session.add_all([
+        Expense(date=date(2024, 10, 7), category="Fuel", amount=200.0, mode="Cash"),
+        Expense(date=date(2024, 11, 1), category="Rent", amount=1000.0, mode="Bank"),
+        Expense(date=date(2024, 12, 1), category="Rent", amount=1000.0, mode="Bank"),
+        Expense(date=date(2024, 12, 9), category="Fuel", amount=150.0, mode="Cash"),
+        Expense(date=date(2024, 12, 31), category="Fuel", amount=50.0, mode=""),
+        Expense(date=date(2025, 1, 1), category="Rent", amount=1200.0, mode="Bank"),
+        Expense(date=date(2025, 1, 20), category="Salary", amount=500.0, mode="UPI"),
+        Expense(date=date(2025, 2, 1), category="Fuel", amount=999.0, mode="Cash"),
+    ])
+    db.session.commit()
+
+
+def test_expense_months_newest_first(expenses):
+    assert expense_months() == ["2025-02", "2025-01", "2024-12", "2024-11", "2024-10"]
+
+
+def test_range_totals_against_the_previous_period(expenses):
+    s = expense_summary("2024-12", "2025-01")
+    assert s["months"] == ["2024-12", "2025-01"]
+    assert (s["prev_from"], s["prev_to"], s["prev_total"], s["total"]) == ("2024-10", "2024-11", 1200.0, 2900.0)
+    # Biggest first; a category new in the range has no percentage change
+    assert list(s["report"]) == ["Rent", "Salary", "Fuel"]
+    rent, salary, fuel = (s["report"][c] for c in ("Rent", "Salary", "Fuel"))
+    assert (rent["amount"], rent["count"], rent["prev_amount"], rent["delta"], rent["delta_pct"]) == (2200.0, 2, 1000.0, 1200.0, 120.0)
+    assert rent["pct"] == pytest.approx(2200 / 2900 * 100)
+    assert (salary["prev_amount"], salary["delta_pct"]) == (0.0, None)
+    assert (fuel["amount"], fuel["count"], fuel["delta_pct"]) == (200.0, 2, 0.0)
+    # A blank mode is reported as "Other"
+    assert fuel["modes"] == {"Cash": 150.0, "Other": 50.0}
+    assert list(s["modes"].items()) == [("Bank", 2200.0), ("UPI", 500.0), ("Cash", 150.0), ("Other", 50.0)]
+
+
+def test_month_grid_deltas_start_from_the_month_before(expenses):
+    s = expense_summary("2024-12", "2025-01")
+    assert [(c["amount"], c["delta"]) for c in s["monthly"]["Rent"]] == [(1000.0, 0.0), (1200.0, 200.0)]
+    assert [(c["amount"], c["delta"]) for c in s["monthly"]["Fuel"]] == [(200.0, 200.0), (0.0, -200.0)]
+    assert [(t["month"], t["amount"], t["delta"]) for t in s["month_totals"]] == [
+        ("2024-12", 1200.0, 200.0), ("2025-01", 1700.0, 500.0)]
+
+
+def test_single_month_keeps_categories_that_dropped_to_zero(expenses):
+    s = expense_summary("2025-01")
+    assert (s["months"], s["prev_from"]) == (["2025-01"], "2024-12")
+    fuel = s["report"]["Fuel"]
+    assert (fuel["amount"], fuel["prev_amount"], fuel["delta_pct"]) == (0.0, 200.0, -100.0)
+
+
+def test_range_is_ordered_and_capped(expenses):
+    assert expense_summary("2025-01", "2024-12")["months"] == ["2024-12", "2025-01"]
+    months = expense_summary("2015-01", "2025-01")["months"]
+    assert len(months) == EXPENSE_MAX_MONTHS and months[-1] == "2025-01"
+
+
+def test_report_page_renders_a_range(expenses, client):
+    r = client.get("/reports/expense-analysis?from=2024-12&to=2025-01")
+    assert r.status_code == 200 and b"Salary" in r.data
+    # A malformed range falls back to this month instead of failing
+    assert client.get("/reports/expense-analysis?from=junk").status_code == 200
@@ -0,0 +1,43 @@
+import time
+
+from app import Lead, Location, db
+
+
+def test_job_submit_accepts_a_form_post(client):
+    r = client.post("/jobs", data={"url": "/export.csv"})
+    assert r.status_code == 202
+    job = r.get_json()
+    assert job["kind"] == "export_csv"
+
+    deadline = time.time() + 10
+    while job["status"] in ("queued", "running") and time.time() < deadline:
+        time.sleep(0.05)
+        db.session.rollback()   # the test client shares this session; see the worker's commits
+        job = client.get(f"/jobs/{job['id']}").get_json()
+    assert job["status"] == "done"
+
+    assert client.post("/jobs", data={"url": "/sales"}).status_code == 400
+
+
+def test_job_submit_still_accepts_json(client):
+    r = client.post("/jobs", json={"url": "/sales"})
+    assert r.status_code == 400
+    assert r.get_json()["error"] == "this page cannot run as a background job"
+
+
+def test_lead_and_location_apis_accept_form_posts(client):
+    r = client.post("/api/locations", data={"name": "Pune"})
+    assert r.status_code == 201
+    loc_id = r.get_json()["id"]
+    r = client.put(f"/api/locations/{loc_id}", data={"name": "Pune East"})
+    assert r.status_code == 200
+
+    r = client.post("/api/leads", data={"name": "Acme", "location_id": str(loc_id)})
+    assert r.status_code == 201
+    lead_id = r.get_json()["id"]
+    assert client.patch(f"/api/leads/{lead_id}", data={"deal_status": "won"}).status_code == 200
+
+    db.session.expire_all()
+    assert db.session.get(Location, loc_id).name == "Pune East"
+    lead = db.session.get(Lead, lead_id)
+    assert (lead.name, lead.location_id, lead.deal_status) == ("Acme", loc_id, "won")
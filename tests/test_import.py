@@ -0,0 +1,74 @@
+import io
+import os
+import time
+from datetime import date
+
+import pytest
+
+from app import IMPORT_UPLOAD_TTL, Client, Product, ProductBatch, SaleItem, db, import_invoices
+
+
+def csv(text):
+    return io.BytesIO(text.encode())
+
+
+@pytest.fixture
+def product(app):
+    db.session.add_all([Client(name="C1"), Product(name="A", costing_method="fifo")])
+    db.session.commit()
+    return Product.query.one()
+
+
+def test_purchase_batches_are_dated_by_their_own_invoice(product):
+    import_invoices("purchase", csv(
+        "date,party,product,quantity,rate\n"
+        "2024-02-01,V1,A,10,7\n"
+        "2024-01-01,V1,A,10,5\n"
+    ), "p.csv", dry_run=False)
+    batches = {b.rate: b.received_on for b in ProductBatch.query}
+    assert batches == {5.0: date(2024, 1, 1), 7.0: date(2024, 2, 1)}
+
+
+def test_sales_take_lots_in_invoice_date_order(product):
+    import_invoices("purchase", csv(
+        "date,party,product,quantity,rate\n"
+        "2024-01-01,V1,A,10,5\n"
+        "2024-02-01,V1,A,10,7\n"
+    ), "p.csv", dry_run=False)
+    import_invoices("sale", csv(
+        "date,client,product,quantity,sell_rate\n"
+        "2024-03-10,C1,A,15,20\n"
+        "2024-03-05,C1,A,5,20\n"
+    ), "s.csv", dry_run=False)
+    costs = {i.sale.date: round(i.cost_rate_per_kg, 4) for i in SaleItem.query}
+    assert costs == {date(2024, 3, 5): 5.0, date(2024, 3, 10): round(95 / 15, 4)}
+    assert db.session.get(Product, product.id).current_stock_kg == 0.0
+
+
+def uploads(app):
+    upload_dir = os.path.join(app.instance_path, "imports")
+    return sorted(os.listdir(upload_dir)) if os.path.isdir(upload_dir) else []
+
+
+def preview(client, text):
+    return client.post("/import", data={"kind": "sale", "file": (csv(text), "s.csv")},
+                       content_type="multipart/form-data")
+
+
+def test_failed_preview_leaves_no_upload_behind(app, client):
+    preview(client, "date,client,quantity,sell_rate\nnot-a-date,C1,1,100\n")
+    preview(client, "no,usable,columns\n1,2,3\n")
+    assert uploads(app) == []
+
+    preview(client, "date,client,quantity,sell_rate\n2024-05-05,C1,1,100\n")
+    assert len(uploads(app)) == 1
+
+
+def test_abandoned_previews_are_pruned(app, client):
+    preview(client, "date,client,quantity,sell_rate\n2024-05-05,C1,1,100\n")
+    [stale] = uploads(app)
+    old = time.time() - IMPORT_UPLOAD_TTL.total_seconds() - 60
+    os.utime(os.path.join(app.instance_path, "imports", stale), (old, old))
+
+    preview(client, "date,client,quantity,sell_rate\n2024-05-06,C1,1,100\n")
+    assert stale not in uploads(app) and len(uploads(app)) == 1
@@ -0,0 +1,52 @@
+import time
+
+from app import Lead, Location, db
+
+
+def add_leads():
+    pune = Location(name="Pune")
+    db.session.add_all([pune, Lead(name="L1", location=pune), Lead(name="L2", location=pune), Lead(name="L3")])
+    db.session.commit()
+    return pune.id
+
+
+def test_plain_request_keeps_the_bare_list(client):
+    add_leads()
+    body = client.get("/api/leads").get_json()
+    assert isinstance(body, list)
+    assert [l["name"] for l in body] == ["L3", "L2", "L1"]
+
+
+def test_paging_params_return_pages(client):
+    add_leads()
+    page = client.get("/api/leads?limit=2").get_json()
+    assert [l["name"] for l in page["items"]] == ["L3", "L2"]
+    rest = client.get(f"/api/leads?limit=2&cursor={page['next_cursor']}").get_json()
+    assert [l["name"] for l in rest["items"]] == ["L1"] and rest["next_cursor"] is None
+
+
+def sync(client, since, **filters):
+    params = "&".join(f"{k}={v}" for k, v in filters.items())
+    return client.get(f"/api/leads?updated_since={since}&{params}").get_json()
+
+
+def test_location_rename_reaches_delta_sync(client):
+    loc_id = add_leads()
+    time.sleep(2.1)   # server_time keeps 2 s of slack
+    since = client.get("/api/leads?limit=50").get_json()["server_time"]
+
+    assert client.put(f"/api/locations/{loc_id}", json={"name": "Pune East"}).status_code == 200
+    changed = sync(client, since)["items"]
+    assert sorted((l["name"], l["location_name"]) for l in changed) == [("L1", "Pune East"), ("L2", "Pune East")]
+
+
+def test_location_delete_reaches_delta_sync(client):
+    loc_id = add_leads()
+    ids = sorted(l.id for l in Lead.query.filter_by(location_id=loc_id))
+    time.sleep(2.1)
+    since = client.get("/api/leads?limit=50").get_json()["server_time"]
+
+    assert client.delete(f"/api/locations/{loc_id}").status_code == 204
+    db.session.expire_all()
+    assert sorted(sync(client, since)["removed"]) == ids
+    assert sorted(sync(client, since, location_id=loc_id)["removed"]) == ids
@@ -0,0 +1,157 @@
+import threading
+
+from app import (
+    BottleType, Client, Product, ProductBatch, Purchase, PurchaseItem, Sale, SaleItem, adjust_batch_stock,
+    apply_stock_deltas, db, sync_product_total_stock, to_rate_e4,
+)
+
+
+def sale_form(client_id, day, lines):
+    form = {"date": day, "sale_type": "bill", "client_id": client_id, "client_name": "", "freight": 0,
+            "misc_amount": 0, "line_id[]": [], "product_id[]": [], "quantity[]": [], "unit[]": [],
+            "cost_rate[]": [], "sell_rate[]": [], "gst_percent[]": []}
+    for line_id, product_id, qty, rate in lines:
+        form["line_id[]"].append(line_id)
+        form["product_id[]"].append(product_id)
+        form["quantity[]"].append(qty)
+        form["unit[]"].append("kg")
+        form["cost_rate[]"].append(rate)
+        form["sell_rate[]"].append(rate * 2)
+        form["gst_percent[]"].append(0)
+    return form
+
+
+def batches():
+    db.session.expire_all()
+    return {(b.product_id, b.rate): b.quantity_kg for b in ProductBatch.query}
+
+
+def items(sale_id):
+    db.session.expire_all()
+    return {i.id: (i.product_id, i.quantity_kg, i.cost_rate_per_kg) for i in db.session.get(Sale, sale_id).items}
+
+
+def stocked(app):
+    db.session.add_all([Client(name="C1"), Product(name="A"), Product(name="B")])
+    db.session.commit()
+    a, b = (p.id for p in Product.query.order_by(Product.name))
+    for pid in (a, b):
+        adjust_batch_stock(pid, 5.0, 100.0)
+        sync_product_total_stock(pid)
+    db.session.commit()
+    return Client.query.one().id, a, b
+
+
+def test_sale_edit_keeps_line_ids_and_moves_net_stock(app, client):
+    cid, a, b = stocked(app)
+    client.post("/sales/new", data=sale_form(cid, "2025-01-05", [("", a, 10, 5.0), ("", b, 20, 5.0)]))
+    sale_id = Sale.query.one().id
+    first, second = sorted(items(sale_id))
+
+    client.post(f"/sales/{sale_id}/edit", data=sale_form(
+        cid, "2025-01-05", [(str(first), a, 15, 5.0), (str(second), b, 20, 5.0)]))
+    assert items(sale_id) == {first: (a, 15.0, 5.0), second: (b, 20.0, 5.0)}
+    assert batches() == {(a, 5.0): 85.0, (b, 5.0): 80.0}
+
+    # A changed cost rate moves the line's kg from one batch to the other
+    client.post(f"/sales/{sale_id}/edit", data=sale_form(
+        cid, "2025-01-05", [(str(first), a, 15, 6.0), (str(second), b, 20, 5.0)]))
+    assert sorted(items(sale_id)) == [first, second]
+    assert batches() == {(a, 5.0): 100.0, (a, 6.0): -15.0, (b, 5.0): 80.0}
+
+
+def test_sale_edit_deletes_only_the_removed_line(app, client):
+    cid, a, b = stocked(app)
+    client.post("/sales/new", data=sale_form(cid, "2025-01-05", [("", a, 10, 5.0), ("", b, 20, 5.0)]))
+    sale_id = Sale.query.one().id
+    first, second = sorted(items(sale_id))
+
+    client.post(f"/sales/{sale_id}/edit", data=sale_form(
+        cid, "2025-01-05", [(str(second), b, 20, 5.0), ("", a, 3, 5.0)]))
+    after = items(sale_id)
+    assert first not in after and after[second] == (b, 20.0, 5.0)
+    assert SaleItem.query.count() == 2
+    assert batches() == {(a, 5.0): 97.0, (b, 5.0): 80.0}
+
+
+def test_cash_sale_edit_matches_bottle_lines_by_id(app, client):
+    db.session.add_all([Client(name="C1"), BottleType(label="1 ltr", quantity_ltr=1.0, bottles_in_batch=12,
+                                                      can_price=4.25, price_per_kg=9.0, box_cost=21,
+                                                      selling_price_per_batch=170),
+                        BottleType(label="5 ltr", quantity_ltr=5.0, bottles_in_batch=1, can_price=15.0,
+                                   price_per_kg=9.0, box_cost=0.0, selling_price_per_batch=80)])
+    db.session.commit()
+    cid = Client.query.one().id
+    one, five = (bt.id for bt in BottleType.query.order_by(BottleType.quantity_ltr))
+
+    def cash_form(lines):
+        return {"date": "2025-01-05", "sale_type": "cash", "client_id": cid, "client_name": "", "freight": 0,
+                "misc_amount": 0, "cash_line_id[]": [l[0] for l in lines], "bottle_type_id[]": [l[1] for l in lines],
+                "batches[]": [l[2] for l in lines], "sp_batch[]": ["" for _ in lines],
+                "gst_percent_cash[]": [0 for _ in lines]}
+
+    client.post("/sales/new", data=cash_form([("", one, 2), ("", five, 4)]))
+    sale_id = Sale.query.one().id
+    by_type = {i.bottle_type_id: i.id for i in db.session.get(Sale, sale_id).items}
+
+    client.post(f"/sales/{sale_id}/edit", data=cash_form([(str(by_type[five]), five, 6)]))
+    db.session.expire_all()
+    [item] = db.session.get(Sale, sale_id).items
+    assert (item.id, item.bottle_type_id, item.quantity_kg) == (by_type[five], five, 6.0)
+
+
+def purchase_form(lines):
+    return {"date": "2025-01-05", "vendor_id": "", "vendor_name": "V1", "freight": 0, "gst_percent": 0,
+            "line_id[]": [l[0] for l in lines], "product_id[]": [l[1] for l in lines],
+            "quantity[]": [l[2] for l in lines], "rate[]": [l[3] for l in lines]}
+
+
+def test_purchase_edit_keeps_ids_and_deletes_only_removed_lines(app, client):
+    db.session.add_all([Product(name="A"), Product(name="B")])
+    db.session.commit()
+    a, b = (p.id for p in Product.query.order_by(Product.name))
+    client.post("/purchase/new", data=purchase_form([("", a, 10, 5), ("", b, 20, 7), ("", a, 5, 6)]))
+    purchase = Purchase.query.one()
+    ids = {(i.product_id, i.rate_per_kg): i.id for i in purchase.items}
+
+    client.post(f"/purchase/{purchase.id}/edit", data=purchase_form([
+        (str(ids[(a, 5.0)]), a, 12, 5), (str(ids[(b, 7.0)]), b, 20, 7)]))
+    db.session.expire_all()
+    after = {i.id: (i.product_id, i.quantity_kg, i.rate_per_kg) for i in db.session.get(Purchase, purchase.id).items}
+    assert after == {ids[(a, 5.0)]: (a, 12.0, 5.0), ids[(b, 7.0)]: (b, 20.0, 7.0)}
+    assert PurchaseItem.query.count() == 2
+    assert batches() == {(a, 5.0): 12.0, (a, 6.0): 0.0, (b, 7.0): 20.0}
+
+
+def test_concurrent_upserts_of_one_rate_key_merge(app):
+    db.session.add(Product(name="A"))
+    db.session.commit()
+    pid = Product.query.one().id
+    db.session.rollback()
+    key = to_rate_e4(5.0)
+    start = threading.Barrier(2)
+    errors = []
+
+    def worker():
+        with app.app_context():
+            try:
+                start.wait()
+                for _ in range(25):
+                    apply_stock_deltas({(pid, key): 4.0})
+                    db.session.commit()
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=worker) for _ in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    db.session.rollback()   # end this session's read snapshot
+    [batch] = ProductBatch.query.all()
+    assert (batch.rate_key, batch.quantity_kg) == (key, 200.0)
+    assert db.session.get(Product, pid).current_stock_kg == 200.0
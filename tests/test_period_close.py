@@ -0,0 +1,195 @@
+import io
+from datetime import date
+
+import pytest
+
+from app import (
+    Client, PeriodClosedError, Product, Purchase, PurchaseItem, Sale, adjust_batch_stock, apply_import, close_period, db,
+    get_sales_outstanding, import_invoices, last_close, match_statement, post_bank_matches,
+    read_bank_statement, sync_product_total_stock,
+)
+
+
+def add_sale(client_name, day, total):
+    sale = Sale(date=day, client_name=client_name, grand_total=total)
+    db.session.add(sale)
+    db.session.commit()
+    return sale
+
+
+@pytest.fixture
+def closed_books(app):
+    db.session.add(Client(name="C1"))
+    db.session.commit()
+    add_sale("C1", date(2024, 6, 1), 346.0)
+    close_period(date(2024, 12, 31))
+    db.session.commit()
+
+
+def csv(text):
+    return io.BytesIO(text.encode())
+
+
+def test_import_rejects_rows_in_closed_period(closed_books):
+    plan = import_invoices("sale", csv("date,client,quantity,sell_rate\n2024-05-05,C1,1,100\n"), "s.csv")
+    assert plan["error_count"] == 1
+    assert "closed period" in plan["errors"][0][1]
+    with pytest.raises(ValueError):
+        apply_import(plan)
+    assert Sale.query.count() == 1
+    assert get_sales_outstanding()["C1"]["balance"] == 346.0
+
+
+def test_import_refuses_plan_made_before_the_close(app):
+    db.session.add(Client(name="C1"))
+    db.session.commit()
+    plan = import_invoices("sale", csv("date,client,quantity,sell_rate\n2024-05-05,C1,1,100\n"), "s.csv")
+    assert plan["error_count"] == 0
+    close_period(date(2024, 12, 31))
+    db.session.commit()
+    with pytest.raises(PeriodClosedError):
+        apply_import(plan)
+    assert Sale.query.count() == 0
+
+
+def test_import_after_close_still_writes(closed_books):
+    plan = import_invoices("sale", csv("date,client,quantity,sell_rate\n2025-01-05,C1,1,100\n"), "s.csv",
+                           dry_run=False)
+    assert plan["written"]["invoices"] == 1
+    assert get_sales_outstanding()["C1"]["balance"] == 446.0
+
+
+def test_bank_lines_in_closed_period_are_not_posted(closed_books):
+    statement = read_bank_statement(csv("date,narration,party,credit\n2024-07-01,NEFT,C1,346\n"), "b.csv")
+    lines = match_statement(statement["lines"])
+    assert lines[0]["status"] == "closed" and not lines[0]["accept"]
+    assert post_bank_matches(lines)["sale"] == 0
+
+    lines[0].update(accept=True, party="C1", status="on_account")
+    with pytest.raises(PeriodClosedError):
+        post_bank_matches(lines)
+    assert get_sales_outstanding()["C1"]["balance"] == 346.0
+
+
+def sale_form(client_id, day, lines):
+    form = {"date": day, "sale_type": "bill", "client_id": client_id, "client_name": "", "freight": 0,
+            "misc_amount": 0, "line_id[]": [], "product_id[]": [], "quantity[]": [], "unit[]": [],
+            "cost_rate[]": [], "sell_rate[]": [], "gst_percent[]": []}
+    for line_id, product_id, qty, rate in lines:
+        form["line_id[]"].append(line_id)
+        form["product_id[]"].append(product_id)
+        form["quantity[]"].append(qty)
+        form["unit[]"].append("kg")
+        form["cost_rate[]"].append(rate)
+        form["sell_rate[]"].append(rate * 2)
+        form["gst_percent[]"].append(0)
+    return form
+
+
+@pytest.fixture
+def closed_sale(app, client):
+    db.session.add_all([Client(name="C1"), Product(name="A")])
+    db.session.commit()
+    cid, pid = Client.query.one().id, Product.query.one().id
+    adjust_batch_stock(pid, 5.0, 100.0)
+    sync_product_total_stock(pid)
+    db.session.commit()
+    assert client.post("/sales/new", data=sale_form(cid, "2024-02-01", [("", pid, 10, 5.0), ("", pid, 20, 5.0)])).status_code == 302
+    close_period(date(2024, 12, 31))
+    db.session.commit()
+    return cid, pid, Sale.query.one().id
+
+
+def stock_of(pid):
+    db.session.expire_all()
+    return db.session.get(Product, pid).current_stock_kg
+
+
+def test_close_carries_balances_and_ledger_matches(closed_sale, client):
+    cid, pid, sale_id = closed_sale
+    close = last_close()
+    rows = {(b.kind, b.party or b.ref_id): b for b in close.balances}
+    assert rows[("client", "C1")].amount == 300.0
+    assert rows[("product", pid)].quantity_kg == 70.0
+    assert rows[("product", pid)].amount == 350.0
+    assert get_sales_outstanding()["C1"]["brought_forward"] == 300.0
+
+    page = client.get("/ledger/client/C1").data.decode()
+    assert "Balance b/f as of 31-Dec-2024" in page
+    assert f"Sale Invoice #{sale_id}" not in page
+    assert "₹300.00" in page
+
+
+def test_close_must_move_forward_and_stay_in_the_past(closed_sale):
+    with pytest.raises(PeriodClosedError):
+        close_period(date(2024, 6, 30))
+    with pytest.raises(ValueError):
+        close_period(date.today())
+
+
+def test_guard_refuses_edits_and_deletes_in_closed_period(closed_sale, client, flashes):
+    cid, pid, sale_id = closed_sale
+    client.post(f"/sales/{sale_id}/delete", headers={"Referer": "/sales"})
+    assert any("closed" in m for m in flashes())
+    assert db.session.get(Sale, sale_id) is not None
+
+    sale = db.session.get(Sale, sale_id)
+    sale.freight = 10.0
+    with pytest.raises(PeriodClosedError):
+        db.session.commit()
+    db.session.rollback()
+
+    # Moving an open-period sale into the closed period
+    fresh = add_sale("C1", date(2025, 1, 10), 50.0)
+    fresh.date = date(2024, 11, 1)
+    with pytest.raises(PeriodClosedError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_guard_refuses_dropping_a_line_from_a_closed_sale(closed_sale, client):
+    cid, pid, sale_id = closed_sale
+    items = sorted(i.id for i in db.session.get(Sale, sale_id).items)
+    before = stock_of(pid)
+
+    client.post(f"/sales/{sale_id}/edit", data=sale_form(cid, "2024-02-01", [(str(items[0]), pid, 10, 5.0)]))
+    db.session.expire_all()
+    assert sorted(i.id for i in db.session.get(Sale, sale_id).items) == items
+    assert stock_of(pid) == before
+
+    sale = db.session.get(Sale, sale_id)
+    sale.items.remove(sale.items[0])
+    with pytest.raises(PeriodClosedError):
+        db.session.commit()
+    db.session.rollback()
+
+
+def test_open_period_payment_on_closed_sale_is_allowed(closed_sale, client):
+    cid, pid, sale_id = closed_sale
+    r = client.post(f"/sale/{sale_id}/payment", data={"date": "2025-01-15", "amount": "100", "mode": "Cash"})
+    assert r.status_code == 302
+    assert get_sales_outstanding()["C1"]["balance"] == 200.0
+
+
+def test_reopen_unlocks_the_period(closed_sale, client, flashes):
+    cid, pid, sale_id = closed_sale
+    client.post("/period-close", data={"action": "reopen"})
+    assert last_close() is None
+    client.post(f"/sales/{sale_id}/delete")
+    assert db.session.get(Sale, sale_id) is None
+    assert stock_of(pid) == 100.0
+
+
+def test_guard_refuses_deleting_a_line_of_a_closed_purchase(app):
+    purchase = Purchase(date=date(2024, 3, 1), vendor_name="V1", grand_total=50.0,
+                        items=[PurchaseItem(quantity_kg=10, rate_per_kg=5.0)])
+    db.session.add(purchase)
+    db.session.commit()
+    close_period(date(2024, 12, 31))
+    db.session.commit()
+
+    db.session.delete(purchase.items[0])
+    with pytest.raises(PeriodClosedError):
+        db.session.commit()
+    db.session.rollback()
+    assert PurchaseItem.query.count() == 1
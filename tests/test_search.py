@@ -0,0 +1,33 @@
+from datetime import date
+
+from sqlalchemy import event
+
+from app import Client, Sale, SalePayment, db
+
+
+def test_clients_list_still_finds_a_name_by_substring(client):
+    db.session.add_all([Client(name="Mayachem Industries"), Client(name="Chemtex"), Client(name="Acme")])
+    db.session.commit()
+    page = client.get("/clients?q=chem").data.decode()
+    assert "Mayachem Industries" in page and "Chemtex" in page and "Acme" not in page
+
+
+def test_search_links_payments_without_a_query_per_hit(client):
+    db.session.add(Client(name="C1"))
+    for n in range(6):
+        sale = Sale(date=date(2025, 1, n + 1), client_name="C1", grand_total=100.0)
+        sale.payments.append(SalePayment(date=date(2025, 2, 1), amount=10.0, mode="UPI", notes=f"cheque batch {n}"))
+        db.session.add(sale)
+    db.session.commit()
+    expected = {p.id: f"/sale/{p.sale_id}/payments" for p in SalePayment.query}
+
+    statements = []
+    count = lambda *args, **kwargs: statements.append(args[2])
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        hits = client.get("/api/search?q=cheque").get_json()["results"]
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+
+    assert {h["id"]: h["url"] for h in hits} == expected
+    assert sum("FROM sale_payment" in sql for sql in statements) == 1
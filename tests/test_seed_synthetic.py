@@ -0,0 +1,17 @@
+from sqlalchemy import text
+
+from app import db, seed_synthetic
+
+
+def test_sales_draw_from_batches_on_hand(app):
+    seed_synthetic(scale=0.1, seed=7)
+    one = lambda sql: db.session.execute(text(sql)).scalar()
+    assert one("SELECT COUNT(*) FROM product_batch WHERE quantity_kg < 0") == 0
+    # Every product line is costed at a batch of its product bought by the sale date
+    assert one("""
+        SELECT COUNT(*) FROM sale_item si JOIN sale s ON s.id = si.sale_id
+        WHERE si.product_id IS NOT NULL AND NOT EXISTS (
+            SELECT 1 FROM product_batch b
+            WHERE b.product_id = si.product_id AND b.rate_key = si.cost_rate_e4 AND b.received_on <= s.date)
+    """) == 0
+    assert one("SELECT COUNT(*) FROM sale_item WHERE product_id IS NOT NULL") > 0
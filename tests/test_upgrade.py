@@ -0,0 +1,105 @@
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import text
+
+import app as app_module
+from app import (
+    _LAST_RATE_COLS, _ROLLUP_COLS, MIGRATIONS, BottleType, Client, Employee, Loan, LoanRepayment, Product,
+    ProductBatch, Sale, db, pending_migrations, rebuild_derived_tables, upgrade_db,
+)
+
+FIXTURE = os.path.join(os.path.dirname(__file__), "fixtures", "baseline.sql")
+
+
+@pytest.fixture
+def upgraded(tmp_path):
+    path = tmp_path / "baseline.db"
+    with sqlite3.connect(path) as conn, open(FIXTURE) as f:
+        conn.executescript(f.read())
+    flask_app = app_module.create_app({"DATABASE_URL": f"sqlite:///{path}", "TESTING": True})
+    with flask_app.app_context():
+        applied = upgrade_db(backup=False)
+        yield path, applied
+        db.session.remove()
+
+
+def schema(path):
+    conn = sqlite3.connect(path)
+    tables = [r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+    columns = {t: sorted((c[1], c[2].upper(), c[3]) for c in conn.execute(f"PRAGMA table_info({t})")) for t in tables}
+    others = {(kind, name) for kind, name in conn.execute(
+        "SELECT type, name FROM sqlite_master WHERE type IN ('index', 'trigger') AND name NOT LIKE 'sqlite_%'")}
+    conn.close()
+    return columns, others
+
+
+def test_baseline_upgrade_replays_every_migration(upgraded):
+    _path, applied = upgraded
+    assert applied == [version for version, _name, _fn in MIGRATIONS]
+    assert pending_migrations() == []
+    assert upgrade_db(backup=False) == []
+
+
+def test_baseline_upgrade_keeps_the_money(upgraded):
+    assert Client.query.one().opening_balance == 1500.5
+    assert Employee.query.one().monthly_salary == 15000.0
+    assert Loan.query.one().principal == 50000.0
+    assert LoanRepayment.query.one().amount == 10000.25
+    bottle = BottleType.query.one()
+    assert (bottle.can_price, bottle.price_per_kg, bottle.selling_price_per_batch) == (4.25, 9.0, 170.0)
+    sale = db.session.get(Sale, 1)
+    assert sale.items[0].selling_rate_per_kg == 55.25
+    assert db.session.get(Sale, 2).grand_total == 340.0
+
+
+def test_baseline_upgrade_folds_batches_and_dates_them(upgraded):
+    soda = Product.query.filter_by(name="Caustic Soda").one()
+    batches = ProductBatch.query.filter_by(product_id=soda.id).all()
+    # 45.0 and 45.00001 are the same rate once stored x 10^4
+    assert sorted((b.rate, b.quantity_kg) for b in batches) == [(40.0, 80.0), (45.0, 40.0)]
+    assert all(b.received_on is not None for b in ProductBatch.query)
+    assert soda.current_stock_kg == 120.0
+
+
+def test_baseline_upgrade_leaves_derived_tables_as_a_rebuild_would(upgraded):
+    # v19 builds the rollups from float rates that v20 / v23 then re-key and
+    # convert; nothing after it may leave them out of step with the source rows
+    tables = {"price_rollup": _ROLLUP_COLS, "last_rate": _LAST_RATE_COLS,
+              "search_index": "rowid, title, body, label, kind, ref_id"}
+    snap = lambda: {t: sorted(db.session.execute(text(f"SELECT {c} FROM {t}")).all()) for t, c in tables.items()}
+    kept = snap()
+    assert kept["price_rollup"] and kept["last_rate"]
+    rebuild_derived_tables()
+    assert snap() == kept
+
+
+def test_baseline_upgrade_matches_a_fresh_schema(upgraded, tmp_path):
+    path, _applied = upgraded
+    fresh = app_module.create_app({"DATABASE_URL": f"sqlite:///{tmp_path / 'fresh.db'}", "TESTING": True})
+    with fresh.app_context():
+        upgrade_db(backup=False)
+        db.session.remove()
+    assert schema(path) == schema(tmp_path / "fresh.db")
+
+
+def test_v19_leaves_the_master_tables_to_v23(tmp_path):
+    path = tmp_path / "baseline.db"
+    with sqlite3.connect(path) as conn, open(FIXTURE) as f:
+        conn.executescript(f.read())
+    flask_app = app_module.create_app({"DATABASE_URL": f"sqlite:///{path}", "TESTING": True})
+    with flask_app.app_context():
+        db.create_all()
+        for version, _name, fn in MIGRATIONS:
+            if version > 19:
+                break
+            fn()
+            db.session.commit()
+        db.session.remove()
+    conn = sqlite3.connect(path)
+    columns = lambda table: {c[1] for c in conn.execute(f"PRAGMA table_info({table})")}
+    assert "opening_balance_paise" in columns("client")
+    assert "monthly_salary" in columns("employee") and "monthly_salary_paise" not in columns("employee")
+    assert "principal" in columns("loan") and "amount" in columns("loan_repayment")
+    conn.close()
@@ -0,0 +1,101 @@
+import io
+import re
+import sqlite3
+import time
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import app as app_module
+from app import (
+    JOB_TIMEOUT, BackgroundJob, Client, ClientCollection, Sale, VendorCollection, db, sqlite_db_path,
+    write_contention_stats,
+)
+
+
+def test_collection_deletes_are_post_only(client):
+    db.session.add(Client(name="C1"))
+    db.session.commit()
+    db.session.add_all([
+        ClientCollection(client_id=Client.query.one().id, date=date(2025, 1, 5), amount=100.0),
+        VendorCollection(vendor_name="V1", date=date(2025, 1, 5), amount=50.0),
+    ])
+    db.session.commit()
+    cc, vc = ClientCollection.query.one().id, VendorCollection.query.one().id
+
+    assert client.get(f"/client/collection/{cc}/delete").status_code == 405
+    assert client.get(f"/vendor/collection/{vc}/delete").status_code == 405
+    assert client.post(f"/client/collection/{cc}/delete").status_code == 302
+    assert client.post(f"/vendor/collection/{vc}/delete").status_code == 302
+    assert ClientCollection.query.count() == 0 and VendorCollection.query.count() == 0
+
+
+def test_job_timeout_is_written_in_an_immediate_transaction(client):
+    job = BackgroundJob(kind="export_csv", url="/export.csv", cache_key="k", status="running",
+                        created_at=datetime.utcnow() - JOB_TIMEOUT - timedelta(minutes=1))
+    db.session.add(job)
+    db.session.commit()
+    before = write_contention_stats().get("job_status", {}).get("transactions", 0)
+
+    body = client.get(f"/jobs/{job.id}").get_json()
+    assert body["status"] == "failed" and body["error"] == "timed out"
+    assert write_contention_stats()["job_status"]["transactions"] == before + 1
+
+    # Nothing left to time out: plain read, no write lock
+    client.get(f"/jobs/{job.id}")
+    assert write_contention_stats()["job_status"]["transactions"] == before + 1
+
+
+@pytest.fixture
+def locked_db(app):
+    """A second connection holding the write lock, as another worker's save would."""
+    db.session.add(Client(name="C1"))
+    db.session.commit()
+    other = sqlite3.connect(sqlite_db_path(), isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    yield other
+    other.rollback()
+    other.close()
+
+
+def test_write_lock_wait_is_capped(locked_db, client, monkeypatch):
+    monkeypatch.setattr(app_module, "WRITE_LOCK_WAIT_MS", 400)
+    before = write_contention_stats().get("ALL", {}).get("failures", 0)
+    client_id = Client.query.one().id
+    db.session.rollback()   # the test client shares this session; let the request begin its own
+
+    started = time.perf_counter()
+    r = client.post(f"/clients/{client_id}/delete")
+    elapsed = time.perf_counter() - started
+
+    assert r.status_code == 503
+    assert 0.35 < elapsed < 1.5   # busy_timeout and retry sleeps share the 400 ms
+    stats = write_contention_stats()["ALL"]
+    assert stats["failures"] == before + 1 and stats["retries"] > 0
+
+
+def test_default_lock_wait_stays_below_the_worker_timeout():
+    assert app_module.WRITE_LOCK_WAIT_MS * 2 <= 60_000
+
+
+def test_upload_preview_does_not_wait_for_the_write_lock(locked_db, client, monkeypatch):
+    monkeypatch.setattr(app_module, "WRITE_LOCK_WAIT_MS", 200)
+    db.session.rollback()
+
+    def upload():
+        r = client.post("/import", data={"kind": "sale", "file": (
+            io.BytesIO(b"date,client,quantity,sell_rate\n2025-01-05,C1,1,100\n"), "s.csv")},
+            content_type="multipart/form-data")
+        assert r.status_code == 200
+        return re.search(rb'name="token" value="([^"]+)"', r.data).group(1).decode()
+
+    # Confirming takes the lock, only around the inserts
+    r = client.post("/import", data={"kind": "sale", "token": upload()})
+    assert app_module.WRITE_BUSY_MESSAGE.encode() in r.data
+    assert Sale.query.count() == 0
+
+    locked_db.rollback()
+    db.session.rollback()
+    r = client.post("/import", data={"kind": "sale", "token": upload()})
+    assert r.status_code == 302, re.findall(rb"alert-.*", r.data)
+    assert Sale.query.count() == 1
@@ -0,0 +1,11 @@
+"""
+WSGI entry point for production.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+With ``preload_app`` the app (and its create_app() setup) is built once in
+the gunicorn master and shared with every worker via fork.
+"""
+from app import create_app
+
+app = create_app()